@@ -1,27 +1,34 @@
-﻿from oruxmap.utils.context import Context
-
-from oruxmap.oruxmap import OruxMap
-
-context = Context()
-# context.skip_optimize_png = True
-# from oruxmap.utils.constants_switzerland import tiffs_wetzikon,
-# context.only_tiffs = tiffs_wetzikon
-# context.only_tiles_border = 5
-# context.only_tiles_modulo = 10
-# context.skip_tiff_read = True
-# context.skip_png_write = True
-context.multiprocessing = False
-
-
-def main():
-    with OruxMap("CH_SwissTopo", context=context) as oruxmap:
-        oruxmap.create_layers(iMasstabMin=25, iMasstabMax=1000)
-
-    if False:
-        # The maps in 10k scale take up a few hundred gigabytes
-        with OruxMap("CH_SwissTopo10k", context=context) as oruxmap:
-            oruxmap.create_layers(iMasstabMin=10, iMasstabMax=10)
-
-
-if __name__ == "__main__":
-    main()
+﻿from oruxmap.utils.context import Context
+
+from oruxmap.oruxmap import OruxMap
+
+context = Context()
+# context.skip_optimize_png = True
+# from oruxmap.utils.constants_switzerland import tiffs_wetzikon,
+# context.only_tiffs = tiffs_wetzikon
+# context.only_tiles_border = 5
+# context.only_tiles_modulo = 10
+# context.skip_tiff_read = True
+# context.skip_png_write = True
+# context.sheet_workers = 4
+# context.normalize_tiffs = True
+# import pathlib
+# context.delta_from = pathlib.Path("releases/CH_SwissTopo")
+# Smaller tiles pan faster on older phones, see 'tile_size_benchmark.py'
+# context.orux_pixel_per_tile = 512
+context.multiprocessing = False
+
+
+def main():
+    with OruxMap("CH_SwissTopo", context=context) as oruxmap:
+        oruxmap.create_layers(iMasstabMin=25, iMasstabMax=4000)
+
+    if False:
+        # The maps in 10k scale are jpeg encoded, see LayerParams.codec,
+        # and still take up 24 gigabytes
+        with OruxMap("CH_SwissTopo10k", context=context) as oruxmap:
+            oruxmap.create_layers(iMasstabMin=10, iMasstabMax=10)
+
+
+if __name__ == "__main__":
+    main()
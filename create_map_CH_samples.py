@@ -1,46 +1,56 @@
-﻿from oruxmap.utils.context import Context
-from oruxmap.utils.constants_switzerland import tiffs_wetzikon
-from oruxmap.oruxmap import OruxMap
-
-
-def get_contextA():
-    context = Context()
-    # context.skip_optimize_png = True
-    context.only_tiffs = tiffs_wetzikon
-    # context.only_tiles_border = 5
-    # context.only_tiles_modulo = 10
-    # context.skip_tiff_read = True
-    # context.skip_png_write = True
-    return context
-
-
-def get_contextB():
-    context = get_contextA()
-    context.skip_optimize_png = True
-    # context.multiprocessing = False
-    return context
-
-
-def main():
-    if True:
-        context = get_contextB()
-        with OruxMap("CH_samples_wetzikon_25k_up", context=context) as oruxmap:
-
-            # oruxmap.create_layers(iMasstabMin=100, iMasstabMax=100)
-            oruxmap.create_layers(iMasstabMin=50, iMasstabMax=200)
-
-        return
-
-    for context in (
-        get_contextA(),
-        get_contextB(),
-    ):
-        with OruxMap("CH_samples_wetzikon_25k_up", context=context) as oruxmap:
-            oruxmap.create_layers(iMasstabMin=25, iMasstabMax=1000)
-
-        with OruxMap("CH_samples_wetzikon_10k", context=context) as oruxmap:
-            oruxmap.create_layers(iMasstabMin=10, iMasstabMax=10)
-
-
-if __name__ == "__main__":
-    main()
+﻿from oruxmap.utils.context import Context
+from oruxmap.utils.constants_switzerland import tiffs_wetzikon
+from oruxmap.oruxmap import OruxMap
+
+
+def get_contextA():
+    context = Context()
+    # context.skip_optimize_png = True
+    context.only_tiffs = tiffs_wetzikon
+    # from oruxmap.utils.projection import BoundsCH1903, WGS84
+    # context.only_boundsCH1903 = BoundsCH1903.from_WGS84(
+    #     northWest=WGS84(lon_deg=8.75, lat_deg=47.35),
+    #     southEast=WGS84(lon_deg=8.90, lat_deg=47.28),
+    # )
+    # from oruxmap.utils.context import ENGINE_MOSAIC
+    # context.engine = ENGINE_MOSAIC
+    # Fetches the WMTS tiles instead of the tiffs, requires 'only_boundsCH1903'
+    # from oruxmap.utils.context import ENGINE_WMTS
+    # context.engine = ENGINE_WMTS
+    # context.only_tiles_border = 5
+    # context.only_tiles_modulo = 10
+    # context.skip_tiff_read = True
+    # context.skip_png_write = True
+    return context
+
+
+def get_contextB():
+    context = get_contextA()
+    context.skip_optimize_png = True
+    # context.multiprocessing = False
+    return context
+
+
+def main():
+    if True:
+        context = get_contextB()
+        with OruxMap("CH_samples_wetzikon_25k_up", context=context) as oruxmap:
+
+            # oruxmap.create_layers(iMasstabMin=100, iMasstabMax=100)
+            oruxmap.create_layers(iMasstabMin=50, iMasstabMax=200)
+
+        return
+
+    for context in (
+        get_contextA(),
+        get_contextB(),
+    ):
+        with OruxMap("CH_samples_wetzikon_25k_up", context=context) as oruxmap:
+            oruxmap.create_layers(iMasstabMin=25, iMasstabMax=1000)
+
+        with OruxMap("CH_samples_wetzikon_10k", context=context) as oruxmap:
+            oruxmap.create_layers(iMasstabMin=10, iMasstabMax=10)
+
+
+if __name__ == "__main__":
+    main()
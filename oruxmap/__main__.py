@@ -0,0 +1,3 @@
+from oruxmap.cli import main
+
+main()
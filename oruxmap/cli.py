@@ -0,0 +1,265 @@
+"""
+Builds the map stage by stage.
+
+  python -m oruxmap download --scale-min 25 --scale-max 100
+  python -m oruxmap subtiles --max-workers 8
+  python -m oruxmap tiles --engine mosaic
+  python -m oruxmap map --map-name CH_SwissTopo
+  python -m oruxmap package --map-name CH_SwissTopo --delta-from releases/CH_SwissTopo
+  python -m oruxmap validate target/maps/CH_SwissTopo
+  python -m oruxmap serve target/maps/CH_SwissTopo
+  python -m oruxmap refresh --layer 0025
+
+Every stage writes its results into 'target' and skips the results which
+exist already: The stages may run one after the other on different machines
+sharing or copying 'target'. 'map' creates missing tiles caches.
+
+The modules of a stage are imported by its command only: 'python -m oruxmap
+--help' does not import rasterio, requests, PIL or numpy. 'download' imports
+them only when a tiff is downloaded or its header is read, see 'tiffs.py'.
+"""
+import sys
+import pathlib
+import argparse
+import functools
+import importlib
+
+from oruxmap.utils.context import (
+    Context,
+    ENGINE_SUBTILES,
+    ENGINE_MOSAIC,
+    ENGINE_WMTS,
+    STORAGE_SQLITE,
+    STORAGE_PACK,
+)
+from oruxmap.layers_switzerland import LayerParams
+
+GBYTE = 1024 ** 3
+
+# These commands parse their own arguments
+DELEGATED = {
+    "validate": "oruxmap.map_validate",
+    "serve": "oruxmap.preview_server",
+    "refresh": "oruxmap.refresh_tiffs",
+}
+
+
+def _add_layer_arguments(parser: argparse.ArgumentParser) -> None:
+    group = parser.add_argument_group("layers")
+    group.add_argument(
+        "--scale-min", type=int, default=25, help="25 for the layer 1:25'000"
+    )
+    group.add_argument("--scale-max", type=int, default=4000)
+
+
+def _add_context_arguments(parser: argparse.ArgumentParser) -> None:
+    """
+    The fields of 'Context'.
+    """
+    group = parser.add_argument_group("build")
+    group.add_argument(
+        "--engine",
+        choices=(ENGINE_SUBTILES, ENGINE_MOSAIC, ENGINE_WMTS),
+        default=ENGINE_SUBTILES,
+    )
+    group.add_argument(
+        "--tile-storage", choices=(STORAGE_SQLITE, STORAGE_PACK), default=STORAGE_SQLITE
+    )
+    group.add_argument("--orux-pixel-per-tile", type=int)
+    group.add_argument("--normalize-tiffs", action="store_true")
+    group.add_argument("--save-diskspace", action="store_true")
+    group.add_argument("--diskspace-quota-gbytes", type=float)
+    group.add_argument("--skip-optimize-png", action="store_true")
+    group.add_argument("--skip-sqlite-vacuum", action="store_true")
+    group.add_argument("--wmts-url")
+    group.add_argument(
+        "--progress-interval-s",
+        type=float,
+        default=5.0,
+        help="Writes 'target/logs/progress_<layer>_<stage>.json' at most this often",
+    )
+
+    group = parser.add_argument_group("parallelism")
+    group.add_argument("--max-workers", type=int, help="Default: The number of cpus")
+    group.add_argument("--no-multiprocessing", action="store_true")
+    group.add_argument("--decode-threads", type=int, default=4)
+    group.add_argument("--sheet-workers", type=int, default=1)
+    group.add_argument("--memory-budget-gbytes", type=float)
+    group.add_argument(
+        "--partial-orux-dbs",
+        action="store_true",
+        help="Only with '--tile-storage pack'",
+    )
+
+    group = parser.add_argument_group("sampling")
+    group.add_argument("--only-tiff", action="append", dest="only_tiffs")
+    group.add_argument("--only-tiles-border", type=int)
+    group.add_argument("--only-tiles-modulo", type=int)
+    group.add_argument(
+        "--bbox-wgs84",
+        type=float,
+        nargs=4,
+        metavar=("WEST_DEG", "NORTH_DEG", "EAST_DEG", "SOUTH_DEG"),
+        help="Only the tiles intersecting this box, for example 8.75 47.35 8.90 47.28",
+    )
+    group.add_argument("--skip-tiff-read", action="store_true")
+    group.add_argument("--skip-png-write", action="store_true")
+
+
+def _gbytes(value: float) -> int:
+    if value is None:
+        return None
+    return int(value * GBYTE)
+
+
+def create_context(args: argparse.Namespace) -> Context:
+    only_boundsCH1903 = None
+    if args.bbox_wgs84 is not None:
+        # pylint: disable=import-outside-toplevel
+        from oruxmap.utils.projection import BoundsCH1903, WGS84
+
+        west_deg, north_deg, east_deg, south_deg = args.bbox_wgs84
+        only_boundsCH1903 = BoundsCH1903.from_WGS84(
+            northWest=WGS84(lon_deg=west_deg, lat_deg=north_deg),
+            southEast=WGS84(lon_deg=east_deg, lat_deg=south_deg),
+        )
+    return Context(
+        engine=args.engine,
+        tile_storage=args.tile_storage,
+        orux_pixel_per_tile=args.orux_pixel_per_tile,
+        normalize_tiffs=args.normalize_tiffs,
+        save_diskspace=args.save_diskspace,
+        diskspace_quota_bytes=_gbytes(args.diskspace_quota_gbytes),
+        skip_optimize_png=args.skip_optimize_png,
+        skip_sqlite_vacuum=args.skip_sqlite_vacuum,
+        wmts_url=args.wmts_url,
+        progress_interval_s=args.progress_interval_s,
+        max_workers=args.max_workers,
+        multiprocessing=not args.no_multiprocessing,
+        decode_threads=args.decode_threads,
+        sheet_workers=args.sheet_workers,
+        memory_budget_bytes=_gbytes(args.memory_budget_gbytes),
+        partial_orux_dbs=args.partial_orux_dbs,
+        only_tiffs=args.only_tiffs,
+        only_tiles_border=args.only_tiles_border,
+        only_tiles_modulo=args.only_tiles_modulo,
+        only_boundsCH1903=only_boundsCH1903,
+        skip_tiff_read=args.skip_tiff_read,
+        skip_png_write=args.skip_png_write,
+    )
+
+
+# pylint: disable=import-outside-toplevel
+
+
+def _enforce_diskspace_quota(context: Context, layer_param: LayerParams) -> None:
+    if context.diskspace_quota_bytes is None:
+        return
+    # The quota protects the tiles caches of all layers.
+    # 'tiffs.py' does not import 'oruxmap.py', it would import rasterio
+    from oruxmap.oruxmap import MapScale
+
+    MapScale(context=context, layer_param=layer_param).enforce_diskspace_quota()
+
+
+def command_download(args: argparse.Namespace) -> None:
+    from oruxmap.layers_switzerland import select_layers
+    from oruxmap.tiffs import download_tiffs
+
+    context = create_context(args)
+    download_tiffs(
+        context=context,
+        layers=select_layers(iMasstabMin=args.scale_min, iMasstabMax=args.scale_max),
+        enforce_diskspace_quota=functools.partial(_enforce_diskspace_quota, context),
+    )
+
+
+def command_subtiles(args: argparse.Namespace) -> None:
+    from oruxmap.layers_switzerland import select_layers
+    from oruxmap.oruxmap import create_tiles
+
+    create_tiles(
+        context=create_context(args),
+        layers=select_layers(iMasstabMin=args.scale_min, iMasstabMax=args.scale_max),
+        subtiles_only=True,
+    )
+
+
+def command_tiles(args: argparse.Namespace) -> None:
+    from oruxmap.layers_switzerland import select_layers
+    from oruxmap.oruxmap import create_tiles
+
+    create_tiles(
+        context=create_context(args),
+        layers=select_layers(iMasstabMin=args.scale_min, iMasstabMax=args.scale_max),
+    )
+
+
+def command_map(args: argparse.Namespace) -> None:
+    from oruxmap.oruxmap import OruxMap
+
+    context = create_context(args)
+    # See the command 'package'
+    context.skip_map_validate = True
+    context.skip_map_zip = True
+    with OruxMap(args.map_name, context=context) as oruxmap:
+        oruxmap.create_layers(iMasstabMin=args.scale_min, iMasstabMax=args.scale_max)
+
+
+def command_package(args: argparse.Namespace) -> None:
+    from oruxmap.oruxmap import package_map
+    from oruxmap.utils.constants_directories import DIRECTORY_MAPS
+
+    context = create_context(args)
+    context.skip_map_validate = args.skip_validate
+    context.skip_map_zip = args.skip_zip
+    context.delta_from = args.delta_from
+    directory_map = DIRECTORY_MAPS / context.append_version(args.map_name)
+    assert directory_map.exists(), f"{directory_map}: Run the command 'map' first"
+    package_map(context=context, directory_map=directory_map)
+
+
+def create_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="python -m oruxmap",
+        description=__doc__.splitlines()[1],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="\n".join(__doc__.splitlines()[2:]),
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    for name, func, help_text in (
+        ("download", command_download, "Download the tiffs"),
+        ("subtiles", command_subtiles, "Create the subtiles caches"),
+        ("tiles", command_tiles, "Create the tiles caches"),
+        ("map", command_map, "Write the map from the tiles caches"),
+        ("package", command_package, "Validate, patch and zip the map"),
+    ):
+        subparser = subparsers.add_parser(name, help=help_text)
+        subparser.set_defaults(func=func)
+        if name in ("map", "package"):
+            subparser.add_argument("--map-name", default="CH_SwissTopo")
+        if name == "package":
+            subparser.add_argument("--delta-from", type=pathlib.Path)
+            subparser.add_argument("--skip-validate", action="store_true")
+            subparser.add_argument("--skip-zip", action="store_true")
+        _add_layer_arguments(subparser)
+        _add_context_arguments(subparser)
+
+    for name, module in DELEGATED.items():
+        subparsers.add_parser(
+            name, help=f"See 'python -m {module} --help'", add_help=False
+        )
+    return parser
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if len(argv) > 0 and argv[0] in DELEGATED:
+        module = importlib.import_module(DELEGATED[argv[0]])
+        module.main(argv[1:])
+        return
+
+    args = create_parser().parse_args(argv)
+    args.func(args)
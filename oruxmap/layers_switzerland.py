@@ -1,4 +1,7 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
+from typing import List
+
+from oruxmap.utils.img_codec import TileCodec, CODEC_PNG, CODEC_JPEG_30
 
 
 @dataclass
@@ -10,6 +13,16 @@ class LayerParams:
     tiff_url: str = None
     # pixel_per_tile: int = 400
     pixel_per_tile: int = 1000
+    codec: TileCodec = CODEC_PNG
+    # 'Context.partial_orux_dbs': The number of partial orux dbs written in parallel
+    orux_shards: int = 1
+    # The scale of a finer layer: The tiles are downsampled from its tiles
+    derived_from: int = None
+    # The layer of the swisstopo WMTS, see 'Context.engine'
+    wmts_layer: str = None
+    # 'Context.orux_pixel_per_tile': The pixel_per_tile of the tiles cache
+    # the tiles of the map are cut from
+    retiled_from: int = None
 
     @property
     def name(self):
@@ -23,6 +36,34 @@ class LayerParams:
         assert isinstance(m_per_pixel, float)
         assert abs((m_per_pixel / self.m_per_pixel) - 1.0) < 0.001
 
+    @property
+    def source_layer(self) -> "LayerParams":
+        """
+        The layer 'derived_from'.
+        """
+        for layer_param in LIST_LAYERS:
+            if layer_param.scale == self.derived_from:
+                assert layer_param.derived_from is None
+                return layer_param
+        raise ValueError(f"{self.name}: Layer {self.derived_from} not found")
+
+    def retiled(self, pixel_per_tile: int) -> "LayerParams":
+        """
+        This layer cut into tiles of 'pixel_per_tile', see 'MapScale.sqlite_retile()'.
+        """
+        assert self.retiled_from is None
+        return replace(
+            self, pixel_per_tile=pixel_per_tile, retiled_from=self.pixel_per_tile
+        )
+
+    @property
+    def retiled_source(self) -> "LayerParams":
+        """
+        The layer 'retiled_from'.
+        """
+        assert self.retiled_from is not None
+        return replace(self, pixel_per_tile=self.retiled_from, retiled_from=None)
+
     @property
     def valid_data(self) -> bool:
         # The 1:1Mio maps (50 m_per_pixel) has extremely large
@@ -30,23 +71,64 @@ class LayerParams:
 
 
 LIST_LAYERS = (
-    # LayerParams(
-    #     scale=5000,
-    #     orux_layer=8,
-    # ),
-    # LayerParams(
-    #     scale=2000,
-    #     orux_layer=8,
-    #     m_per_pixel=32.0,
-    # ),
-    LayerParams(scale=1000, orux_layer=10,  m_per_pixel=50.0),
-    LayerParams(scale=500, orux_layer=11, m_per_pixel=25.0),
+    # Overviews, downsampled 4x and 2x from the 1:1Mio layer
+    LayerParams(scale=4000, orux_layer=8, m_per_pixel=200.0, derived_from=1000),
+    LayerParams(scale=2000, orux_layer=9, m_per_pixel=100.0, derived_from=1000),
+    LayerParams(
+        scale=1000,
+        orux_layer=10,
+        m_per_pixel=50.0,
+        wmts_layer="ch.swisstopo.pixelkarte-farbe-pk1000.noscale",
+    ),
+    LayerParams(
+        scale=500,
+        orux_layer=11,
+        m_per_pixel=25.0,
+        wmts_layer="ch.swisstopo.pixelkarte-farbe-pk500.noscale",
+    ),
     # Below line will result in bug as the maps are not aligned to 400px
-    LayerParams(scale=200, orux_layer=12, m_per_pixel=10.0),
+    LayerParams(
+        scale=200,
+        orux_layer=12,
+        m_per_pixel=10.0,
+        wmts_layer="ch.swisstopo.pixelkarte-farbe-pk200.noscale",
+    ),
     # Below line will create a pattern: (tile,empty,empty,emtpy) whe combinde with outer layers
     # LayerParams(scale=200, orux_layer=12, m_per_pixel=10.0, pixel_per_tile=100),
-    LayerParams(scale=100, orux_layer=13, m_per_pixel=5.0),
-    LayerParams(scale=50, orux_layer=14, m_per_pixel=2.5),
-    LayerParams(scale=25, orux_layer=15, m_per_pixel=1.25),
-    LayerParams(scale=10, orux_layer=16, m_per_pixel=0.5, pixel_per_tile=500),
+    LayerParams(
+        scale=100,
+        orux_layer=13,
+        m_per_pixel=5.0,
+        wmts_layer="ch.swisstopo.pixelkarte-farbe-pk100.noscale",
+    ),
+    LayerParams(
+        scale=50,
+        orux_layer=14,
+        m_per_pixel=2.5,
+        wmts_layer="ch.swisstopo.pixelkarte-farbe-pk50.noscale",
+    ),
+    LayerParams(
+        scale=25,
+        orux_layer=15,
+        m_per_pixel=1.25,
+        wmts_layer="ch.swisstopo.pixelkarte-farbe-pk25.noscale",
+    ),
+    # As png, the 10k layer would take 182 GBytes, see 'doc/README_evaluation.md'
+    LayerParams(
+        scale=10,
+        orux_layer=16,
+        m_per_pixel=0.5,
+        pixel_per_tile=500,
+        codec=CODEC_JPEG_30,
+        orux_shards=8,
+        wmts_layer="ch.swisstopo.landeskarte-farbe-10",
+    ),
 )
+
+
+def select_layers(iMasstabMin: int, iMasstabMax: int) -> List[LayerParams]:
+    return [
+        layer_param
+        for layer_param in LIST_LAYERS
+        if iMasstabMin <= layer_param.scale <= iMasstabMax
+    ]
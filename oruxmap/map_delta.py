@@ -0,0 +1,186 @@
+"""
+Patches to update a released map without downloading it again.
+
+  python -m oruxmap.map_delta create <old map directory> <new map directory> <patch.db>
+  python -m oruxmap.map_delta apply <patch.db> <map directory>
+
+The patch contains the tiles which are new or changed, the tiles which are
+deleted and the new '.otrk2.xml'. The tiles are compared by (x, y, z) and
+content. Every replaced or deleted tile carries the sha1 of the tile it
+expects: A patch is only applied onto the release it was created from.
+"""
+import sys
+import hashlib
+import sqlite3
+import pathlib
+import argparse
+
+from oruxmap.utils.sqlite_orux import FILENAME_ORUX_DB
+
+MBYTE = 1024 ** 2
+
+
+def _sha1(data: bytes) -> str:
+    if data is None:
+        return None
+    return hashlib.sha1(data).hexdigest()
+
+
+def _connect(filename_sqlite: pathlib.Path) -> sqlite3.Connection:
+    db = sqlite3.connect(filename_sqlite)
+    db.create_function("sha1", 1, _sha1, deterministic=True)
+    return db
+
+
+def _filename_xml(directory_map: pathlib.Path) -> pathlib.Path:
+    filenames = list(directory_map.glob("*.otrk2.xml"))
+    assert len(filenames) == 1, filenames
+    return filenames[0]
+
+
+class PatchError(Exception):
+    pass
+
+
+def create_patch(
+    directory_old: pathlib.Path,
+    directory_new: pathlib.Path,
+    filename_patch: pathlib.Path,
+) -> None:
+    filename_xml_old = _filename_xml(directory_old)
+    filename_xml_new = _filename_xml(directory_new)
+    if filename_patch.exists():
+        filename_patch.unlink()
+
+    db = _connect(filename_patch)
+    db.execute("pragma journal_mode=OFF")
+    db.execute(
+        "CREATE TABLE tiles (x int, y int, z int, image blob, base_sha1 text, PRIMARY KEY (x,y,z))"
+    )
+    db.execute(
+        "CREATE TABLE deleted (x int, y int, z int, base_sha1 text, PRIMARY KEY (x,y,z))"
+    )
+    db.execute("CREATE TABLE meta (key text PRIMARY KEY, value)")
+    db.execute("attach database ? as old", (str(directory_old / FILENAME_ORUX_DB),))
+    db.execute("attach database ? as new", (str(directory_new / FILENAME_ORUX_DB),))
+
+    # The blobs are compared by sqlite, the lookups use the primary keys
+    db.execute(
+        """insert into tiles
+            select n.x, n.y, n.z, n.image, sha1(o.image)
+            from new.tiles n left join old.tiles o on (o.x=n.x and o.y=n.y and o.z=n.z)
+            where o.image is null or o.image != n.image
+            order by n.x, n.y, n.z"""
+    )
+    db.execute(
+        """insert into deleted
+            select o.x, o.y, o.z, sha1(o.image)
+            from old.tiles o
+            where not exists (select 1 from new.tiles n where n.x=o.x and n.y=o.y and n.z=o.z)
+            order by o.x, o.y, o.z"""
+    )
+    (count_old,) = db.execute("select count(*) from old.tiles").fetchone()
+    (count_new,) = db.execute("select count(*) from new.tiles").fetchone()
+    xml_old = filename_xml_old.read_bytes()
+    xml_new = filename_xml_new.read_bytes()
+    db.executemany(
+        "insert into meta values (?,?)",
+        (
+            ("base_xml_sha1", _sha1(xml_old)),
+            ("base_tiles", count_old),
+            ("tiles", count_new),
+            ("xml_name", filename_xml_new.name),
+            ("xml", xml_new),
+        ),
+    )
+    db.commit()
+    db.execute("detach database old")
+    db.execute("detach database new")
+    db.execute("VACUUM")
+    (count_changed,) = db.execute("select count(*) from tiles").fetchone()
+    (count_deleted,) = db.execute("select count(*) from deleted").fetchone()
+    db.close()
+
+    print(
+        f"Patch {filename_patch}: {count_changed} tiles changed or new, {count_deleted} deleted, {count_new} tiles total, {filename_patch.stat().st_size/MBYTE:0.1f} MBytes"
+    )
+
+
+def apply_patch(filename_patch: pathlib.Path, directory_map: pathlib.Path) -> None:
+    """
+    Updates the map in place. The tiles are updated within one transaction:
+    If the patch does not match, the map is not changed.
+    """
+    filename_xml = _filename_xml(directory_map)
+    db = _connect(directory_map / FILENAME_ORUX_DB)
+    db.execute("attach database ? as patch", (str(filename_patch),))
+    meta = dict(db.execute("select key, value from patch.meta"))
+
+    if _sha1(filename_xml.read_bytes()) != meta["base_xml_sha1"]:
+        raise PatchError(f"{filename_xml}: The patch was created for another map")
+    (count_base,) = db.execute("select count(*) from tiles").fetchone()
+    if count_base != meta["base_tiles"]:
+        raise PatchError(
+            f"The patch expects {meta['base_tiles']} tiles, the map has {count_base}"
+        )
+    (count_mismatch,) = db.execute(
+        """select count(*) from (
+            select x, y, z, base_sha1 from patch.tiles
+            union all
+            select x, y, z, base_sha1 from patch.deleted
+        ) p left join tiles t on (t.x=p.x and t.y=p.y and t.z=p.z)
+        where sha1(t.image) is not p.base_sha1"""
+    ).fetchone()
+    if count_mismatch > 0:
+        raise PatchError(
+            f"{count_mismatch} tiles differ from the map the patch was created for"
+        )
+
+    with db:
+        db.execute(
+            """delete from tiles where exists (
+                select 1 from patch.deleted d where d.x=tiles.x and d.y=tiles.y and d.z=tiles.z
+            )"""
+        )
+        db.execute(
+            "insert or replace into tiles select x, y, z, image from patch.tiles order by x, y, z"
+        )
+        (count_tiles,) = db.execute("select count(*) from tiles").fetchone()
+        if count_tiles != meta["tiles"]:
+            # Raising within 'with db' rolls back
+            raise PatchError(f"Expected {meta['tiles']} tiles, got {count_tiles}")
+    db.execute("detach database patch")
+    db.close()
+
+    filename_xml_tmp = directory_map / (meta["xml_name"] + ".tmp")
+    filename_xml_tmp.write_bytes(meta["xml"])
+    if filename_xml.name != meta["xml_name"]:
+        filename_xml.unlink()
+    filename_xml_tmp.replace(directory_map / meta["xml_name"])
+    print(f"Patched {directory_map}: {count_tiles} tiles")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    parser_create = subparsers.add_parser("create")
+    parser_create.add_argument("directory_old", type=pathlib.Path)
+    parser_create.add_argument("directory_new", type=pathlib.Path)
+    parser_create.add_argument("filename_patch", type=pathlib.Path)
+    parser_apply = subparsers.add_parser("apply")
+    parser_apply.add_argument("filename_patch", type=pathlib.Path)
+    parser_apply.add_argument("directory_map", type=pathlib.Path)
+    args = parser.parse_args(argv)
+
+    if args.command == "create":
+        create_patch(
+            directory_old=args.directory_old,
+            directory_new=args.directory_new,
+            filename_patch=args.filename_patch,
+        )
+        return
+    apply_patch(filename_patch=args.filename_patch, directory_map=args.directory_map)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,274 @@
+"""
+Checks a finished map before it is released.
+
+  python -m oruxmap.map_validate target/maps/CH_SwissTopo [--sample 1.0]
+
+Errors:
+  Tiles outside of 'xMax'/'yMax' of the '.otrk2.xml', tiles of layers
+  missing in the '.otrk2.xml', duplicated layers, empty layers,
+  tiles which can not be decoded or have the wrong size,
+  calibration points which do not match the dimensions of the layer.
+Warnings:
+  Holes: A missing tile with tiles to its left, right, top and bottom.
+
+The keys of all tiles are checked, the images of a random sample.
+"""
+import io
+import os
+import sys
+import time
+import sqlite3
+import pathlib
+import argparse
+import itertools
+import concurrent.futures
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+import numpy as np
+import PIL.Image
+
+from oruxmap.layers_switzerland import LIST_LAYERS
+from oruxmap.utils.orux_xml_otrk2 import OruxXmlLayer, read_layers
+from oruxmap.utils.sqlite_orux import FILENAME_ORUX_DB
+
+# The share of the tiles which are decoded
+SAMPLE_DEFAULT = 0.01
+
+# Print only the first few tiles of every problem
+EXAMPLES = 5
+
+
+@dataclass
+class ValidationReport:
+    errors: List[str] = field(default_factory=list)
+    warnings: List[str] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return len(self.errors) == 0
+
+    def error(self, msg: str) -> None:
+        print(f"  ERROR: {msg}")
+        self.errors.append(msg)
+
+    def warning(self, msg: str) -> None:
+        print(f"  WARNING: {msg}")
+        self.warnings.append(msg)
+
+
+def _connect(filename_db: pathlib.Path) -> sqlite3.Connection:
+    return sqlite3.connect(f"file:{filename_db}?mode=ro", uri=True)
+
+
+def read_keys(filename_db: pathlib.Path) -> np.ndarray:
+    """
+    Returns the columns rowid, x, y, z of all tiles.
+    """
+    db = _connect(filename_db)
+    c = db.execute("select rowid, x, y, z from tiles")
+    keys = np.fromiter(itertools.chain.from_iterable(c), dtype=np.int64)
+    db.close()
+    return keys.reshape(-1, 4)
+
+
+def _examples(x: np.ndarray, y: np.ndarray) -> str:
+    return ", ".join(f"x={a} y={b}" for a, b in zip(x[:EXAMPLES], y[:EXAMPLES]))
+
+
+def check_grid(
+    report: ValidationReport, layer: OruxXmlLayer, x: np.ndarray, y: np.ndarray
+) -> None:
+    outside = (x < 0) | (x >= layer.xMax) | (y < 0) | (y >= layer.yMax)
+    if outside.any():
+        report.error(
+            f"Layer {layer.layer}: {outside.sum()} tiles outside of xMax={layer.xMax}/yMax={layer.yMax}: {_examples(x[outside], y[outside])}"
+        )
+    x, y = x[~outside], y[~outside]
+
+    grid = np.zeros((layer.yMax, layer.xMax), dtype=bool)
+    grid[y, x] = True
+    left = np.maximum.accumulate(grid, axis=1)
+    right = np.maximum.accumulate(grid[:, ::-1], axis=1)[:, ::-1]
+    top = np.maximum.accumulate(grid, axis=0)
+    bottom = np.maximum.accumulate(grid[::-1, :], axis=0)[::-1, :]
+    holes = ~grid & left & right & top & bottom
+    if holes.any():
+        y_holes, x_holes = np.nonzero(holes)
+        report.warning(
+            f"Layer {layer.layer}: {holes.sum()} holes: {_examples(x_holes, y_holes)}"
+        )
+    print(
+        f"  Layer {layer.layer}: {grid.sum()} tiles, {100.0*grid.mean():0.0f}% of {layer.xMax}x{layer.yMax}"
+    )
+
+
+def check_calibration(report: ValidationReport, layer: OruxXmlLayer) -> None:
+    if (layer.width != layer.xMax * layer.tile_size) or (
+        layer.height != layer.yMax * layer.tile_size
+    ):
+        report.error(
+            f"Layer {layer.layer}: MapDimensions {layer.width}x{layer.height} do not match MapChunks"
+        )
+    if sorted(layer.corners) != ["BL", "BR", "TL", "TR"]:
+        report.error(f"Layer {layer.layer}: CalibrationPoints {sorted(layer.corners)}")
+        return
+
+    corners = {
+        name: wgs84.to_CH1903(valid_data=False) for name, wgs84 in layer.corners.items()
+    }
+    nw, se = corners["TL"], corners["BR"]
+    m_per_pixel = (se.lon_m - nw.lon_m) / layer.width
+    for layer_param in LIST_LAYERS:
+        if layer_param.orux_layer == layer.layer:
+            m_per_pixel = layer_param.m_per_pixel
+    # The calibration points are rounded to 6 digits and
+    # 'to_WGS84()'/'to_CH1903()' are approximations
+    tolerance_m = max(5.0, 2.0 * m_per_pixel)
+
+    expected = {
+        "BR": (
+            nw.lon_m + layer.width * m_per_pixel,
+            nw.lat_m - layer.height * m_per_pixel,
+        ),
+        "TR": (nw.lon_m + layer.width * m_per_pixel, nw.lat_m),
+        "BL": (nw.lon_m, nw.lat_m - layer.height * m_per_pixel),
+    }
+    for name, (lon_m, lat_m) in expected.items():
+        corner = corners[name]
+        deviation_m = max(abs(corner.lon_m - lon_m), abs(corner.lat_m - lat_m))
+        if deviation_m > tolerance_m:
+            report.error(
+                f"Layer {layer.layer}: CalibrationPoint {name} {corner} deviates by {deviation_m:0.0f}m, expected ({lon_m:0.1f}, {lat_m:0.1f})"
+            )
+
+
+def decode_tiles(
+    filename_db: str, tile_sizes: Dict[int, int], rowids: np.ndarray
+) -> List[str]:
+    """
+    Runs in a worker process. Returns the errors.
+    """
+    db = _connect(filename_db)
+    errors = []
+    for rowid in rowids.tolist():
+        x, y, z, image = db.execute(
+            "select x, y, z, image from tiles where rowid=?", (rowid,)
+        ).fetchone()
+        try:
+            with PIL.Image.open(io.BytesIO(image)) as img:
+                img.load()
+                size = img.size
+        except Exception as e:  # pylint: disable=broad-except
+            errors.append(f"x={x} y={y} z={z}: {e}")
+            continue
+        tile_size = tile_sizes.get(z)
+        if (tile_size is not None) and (size != (tile_size, tile_size)):
+            errors.append(f"x={x} y={y} z={z}: size {size}, expected {tile_size}")
+    db.close()
+    return errors
+
+
+def check_images(
+    report: ValidationReport,
+    filename_db: pathlib.Path,
+    layers: List[OruxXmlLayer],
+    rowids: np.ndarray,
+    sample: float,
+    max_workers: int,
+) -> None:
+    if (sample <= 0.0) or (len(rowids) == 0):
+        return
+    count = min(len(rowids), max(1, int(round(sample * len(rowids)))))
+    rng = np.random.default_rng(seed=0)
+    # Sorted: The workers read the db sequentially
+    rowids = np.sort(rng.choice(rowids, size=count, replace=False))
+    tile_sizes = {layer.layer: layer.tile_size for layer in layers}
+    max_workers = max_workers or os.cpu_count()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(decode_tiles, str(filename_db), tile_sizes, chunk)
+            for chunk in np.array_split(rowids, 4 * max_workers)
+            if len(chunk) > 0
+        ]
+        errors = []
+        for future in futures:
+            errors.extend(future.result())
+    for error in errors[:EXAMPLES]:
+        report.error(f"Tile {error}")
+    if len(errors) > EXAMPLES:
+        report.error(f"... {len(errors)} of {count} decoded tiles are invalid")
+    print(f"  Decoded {count} tiles")
+
+
+def validate_map(
+    directory_map: pathlib.Path, sample: float = SAMPLE_DEFAULT, max_workers=None
+) -> ValidationReport:
+    start_s = time.perf_counter()
+    print(f"Validate {directory_map}")
+    report = ValidationReport()
+    filename_db = directory_map / FILENAME_ORUX_DB
+    filenames_xml = list(directory_map.glob("*.otrk2.xml"))
+    if len(filenames_xml) != 1:
+        report.error(f"Expected one '.otrk2.xml', found {len(filenames_xml)}")
+        return report
+    layers = read_layers(filenames_xml[0])
+
+    keys = read_keys(filename_db)
+    rowids, x, y, z = keys[:, 0], keys[:, 1], keys[:, 2], keys[:, 3]
+
+    levels = [layer.layer for layer in layers]
+    for level in sorted(set(levels)):
+        if levels.count(level) > 1:
+            report.error(f"Layer {level}: Duplicated in the '.otrk2.xml'")
+    unknown = np.setdiff1d(np.unique(z), levels)
+    for level in unknown:
+        report.error(
+            f"Layer {level}: {(z == level).sum()} tiles, missing in the '.otrk2.xml'"
+        )
+
+    for layer in layers:
+        mask = z == layer.layer
+        if not mask.any():
+            report.error(f"Layer {layer.layer}: No tiles")
+            continue
+        check_grid(report=report, layer=layer, x=x[mask], y=y[mask])
+        check_calibration(report=report, layer=layer)
+
+    check_images(
+        report=report,
+        filename_db=filename_db,
+        layers=layers,
+        rowids=rowids,
+        sample=sample,
+        max_workers=max_workers,
+    )
+
+    print(
+        f"Validate: {len(report.errors)} errors, {len(report.warnings)} warnings, {len(keys)} tiles, took {time.perf_counter() - start_s:0.1f}s"
+    )
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("directory_map", type=pathlib.Path)
+    parser.add_argument(
+        "--sample",
+        type=float,
+        default=SAMPLE_DEFAULT,
+        help="The share of the tiles to decode, 1.0 for all",
+    )
+    parser.add_argument("--max-workers", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    report = validate_map(
+        directory_map=args.directory_map,
+        sample=args.sample,
+        max_workers=args.max_workers,
+    )
+    sys.exit(0 if report.ok else 1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
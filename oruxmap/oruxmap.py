@@ -1,707 +1,2044 @@
-﻿#!/usr/bin/python
-#
-# Copyright (C) 2010-2021 Hans Maerk, Maerki Informatik
-# License: Apache License v2
-#
-# Siehe http://www.maerki.com/hans/orux
-#
-# History:
-#   2010-06-22, Hans Maerki, Implementiert
-#   2010-06-23, Hans Maerki, Koordinaten der Karte Massstab 1:50000 angepasst.
-#   2011-01-17, Hans Maerki, Neu koennen Karten in Unterordner gruppiert werden.
-#   2011-02-16, Hans Maerki, Swisstopo hat die Server gewechselt: Neue Url angepasst.
-#   2013-09-06, Hans Maerki, Swisstopo hat die Server gewechselt: Neue Url angepasst.
-#   2018-04-24, Hans Maerki, Swisstopo hat die Server gewechselt: Neue Logik angepasst.
-#   2019-06-03, Hans Maerki, Angepasst an Python 3.7.2.
-#   2021-03-28, Hans Maerki, Massive cleanup.
-"""
-http://map.geo.admin.ch
-
-http://gpso.de/navigation/utm.html
-  UTM- Koordinatensystem, WGS84- Kartendatum
-http://de.wikipedia.org/wiki/Kartendatum
-  Geodaetisches Datum
-https://www.swisstopo.admin.ch/de/wissen-fakten/geodaesie-vermessung/bezugsysteme/kartenprojektionen.html
-  Schweizerische Kartenprojektionen
-https://www.swisstopo.admin.ch/de/karten-daten-online/calculation-services/navref.html
-https://www.swisstopo.admin.ch/content/swisstopo-internet/de/online/calculation-services/_jcr_content/contentPar/tabs/items/dokumente_und_publik/tabPar/downloadlist/downloadItems/8_1467103085694.download/refsys_d.pdf
-  Umrechnung von Schweizer Landeskoordinaten in ellipsoidische WGS84-Koordinaten
-http://de.wikipedia.org/wiki/WGS_84
-  World Geodetic System 1984 (WGS 84)
-"""
-import time
-import shutil
-import pathlib
-
-from dataclasses import dataclass
-from typing import Iterable
-
-import requests
-import PIL.Image
-import rasterio
-import rasterio.plot
-
-from oruxmap.utils import projection
-from oruxmap.utils.projection import CH1903, BoundsCH1903
-from oruxmap.utils.context import Context
-from oruxmap.utils.orux_xml_otrk2 import OruxXmlOtrk2
-from oruxmap.utils.download_zip_and_extract import DownloadZipAndExtractTiff
-from oruxmap.layers_switzerland import LIST_LAYERS, LayerParams
-from oruxmap.utils.sqlite_titles import SqliteTilesPng, SqliteTilesRaw
-from oruxmap.utils.sqlite_orux import SqliteOrux
-from oruxmap.utils.constants_directories import (
-    DIRECTORY_MAPS,
-    DIRECTORY_BASE,
-    DIRECTORY_RESOURCES,
-    DIRECTORY_CACHE_TILES,
-    DIRECTORY_CACHE_TIF,
-    DIRECTORY_LOGS,
-    DIRECTORY_TESTRESULTS,
-)
-
-PIL.Image.MAX_IMAGE_PIXELS = None
-
-PIXEL_PER_SUBTILE = 100
-
-
-class DurationLogger:
-    def __init__(self, step: str):
-        self.step = step
-        self.start_s = time.perf_counter()
-
-    def __enter__(self):
-        return self
-
-    def __exit__(self, _type, value, tb):
-        print(f"{self.step} took {time.perf_counter() - self.start_s:0.0f}s")
-
-
-class OruxMap:
-    def __init__(self, map_name, context):
-        assert isinstance(context, Context)
-        self.map_name = context.append_version(map_name)
-        self.context = context
-        self.directory_map = DIRECTORY_MAPS / self.map_name
-
-        print("===== ", self.map_name)
-
-        # Remove zip file
-        filename_zip = self.directory_map.with_suffix(".zip")
-
-        if filename_zip.exists():
-            filename_zip.unlink()
-
-        # Create empty directory
-        for filename in self.directory_map.glob("*.*"):
-            filename.unlink()
-        for filename in DIRECTORY_TESTRESULTS.glob("*.*"):
-            filename.unlink()
-        self.directory_map.mkdir(parents=True, exist_ok=True)
-
-        self.db = SqliteOrux(filename_sqlite=self.directory_map / "OruxMapsImages.db")
-
-        self.xml_otrk2 = OruxXmlOtrk2(
-            filename=self.directory_map / f"{self.map_name}.otrk2.xml",
-            map_name=self.map_name,
-        )
-
-    def __enter__(self):
-        return self
-
-    def __exit__(self, _type, value, tb):
-        self.xml_otrk2.close()
-
-        self.db.commit()
-        if not self.context.skip_sqlite_vacuum:
-            with DurationLogger("sqlite.execute('VACUUM')") as duration:
-                self.db.vacuum()
-        self.db.close()
-
-        if not self.context.skip_map_zip:
-            with DurationLogger("zip") as duration:
-                filename_zip = shutil.make_archive(
-                    base_name=str(self.directory_map),
-                    root_dir=str(self.directory_map.parent),
-                    base_dir=self.directory_map.name,
-                    format="zip",
-                )
-        print("----- Ready")
-        print(
-            f'The map now is ready in "{self.directory_map.relative_to(DIRECTORY_BASE)}".'
-        )
-        print(
-            "This directory must be copied 'by Hand' onto your android into 'oruxmaps/mapfiles'."
-        )
-
-    def create_layers(self, iMasstabMin: int = 25, iMasstabMax: int = 500):
-        with DurationLogger(f"Layer {self.map_name}") as duration:
-            start_s = time.perf_counter()
-            for layer_param in LIST_LAYERS:
-                if iMasstabMin <= layer_param.scale <= iMasstabMax:
-                    self._create_layer(layer_param=layer_param)
-
-    def _create_layer(self, layer_param):
-        map_scale = MapScale(self, layer_param)
-        map_scale.sqlite_fill_subtiles()
-        map_scale.sqlite_subtiles_to_tiles()
-        map_scale.create_map()
-
-
-@dataclass
-class DebugPng:
-    tiff_filename: str
-    x_tile: int
-    y_tile: int
-    x_tif_pixel: int
-    y_tif_pixel: int
-
-    @staticmethod
-    def csv_header():
-        return "tiff_filename,x_tile,y_tile,x_tif_pixel,y_tif_pixel"
-
-    @property
-    def csv(self):
-        return f"{self.tiff_filename},{self.x_tile},{self.y_tile},{self.x_tif_pixel},{self.y_tif_pixel}"
-
-
-class DebugLogger:
-    def __init__(self, map_scale):
-        self.map_scale = map_scale
-
-    def report(self, list_tiff_attrs, boundsCH1903_extrema):
-        assert isinstance(list_tiff_attrs, list)
-        assert isinstance(boundsCH1903_extrema, BoundsCH1903)
-
-        boundsCH1903_extrema.assertIsNorthWest()
-        for tiff_attrs in list_tiff_attrs:
-            tiff_attrs.boundsCH1903.assertIsNorthWest()
-
-        def fopen(extension):
-            filename_base = f"debug_log_{self.map_scale.layer_param.name}"
-            filename = DIRECTORY_LOGS / (filename_base + extension)
-            return filename.open("w")
-
-        with fopen("_tiff.csv") as f:
-            f.write(f"filename,{BoundsCH1903.csv_header('boundsCH1903')}\n")
-            for tiff_attrs in list_tiff_attrs:
-                assert isinstance(tiff_attrs, TiffImageAttributes)
-                f.write(f"{tiff_attrs.filename.name},{tiff_attrs.boundsCH1903.csv}\n")
-            f.write(f"all,{boundsCH1903_extrema.csv}\n")
-
-
-@dataclass
-class Subtiles:
-    m_per_tile: int
-    subtiles: list = None
-    nw_east_m: int = None
-    nw_north_m: int = None
-    tile_east_idx: int = None
-
-    @property
-    def is_reset(self):
-        return self.subtiles is None
-
-    def append_if_same_tile(self, row) -> bool:
-        east_m, _north_m, _ = row
-        same_tile = self.tile_east_idx == east_m // self.m_per_tile
-        if same_tile:
-            self.subtiles.append(row)
-        return same_tile
-
-    def start_tile(self, row) -> None:
-        east_m, north_m, _ = row
-        self.tile_east_idx = east_m // self.m_per_tile
-        self.nw_east_m = east_m
-        self.nw_north_m = north_m
-        self.subtiles = [row]
-
-    def image(
-        self, subtiles_per_tile: int, pixel_per_tile: int, m_per_subtile: int
-    ) -> PIL.Image.Image:
-        assert len(self.subtiles) == subtiles_per_tile * subtiles_per_tile
-        img_tile = PIL.Image.new(
-            mode="RGB",
-            size=(
-                pixel_per_tile,
-                pixel_per_tile,
-            ),
-            color=0,
-        )
-        for nw_east_m, nw_north_m, img in self.subtiles:
-            pixel_east = int(
-                PIXEL_PER_SUBTILE * (nw_east_m - self.nw_east_m) / m_per_subtile
-            )
-            pixel_north = int(
-                PIXEL_PER_SUBTILE * (nw_north_m - self.nw_north_m) / m_per_subtile
-            )
-            pixel_south = -pixel_north
-            assert 0 <= pixel_east < pixel_per_tile
-            assert 0 <= pixel_south < pixel_per_tile
-            img_tile.paste(
-                im=img,
-                box=(pixel_east, pixel_south),
-            )
-        return img_tile
-
-
-class MapScale:
-    """
-    This object represents one scale. For example 1:25'000, 1:50'000.
-    """
-
-    def __init__(self, orux_maps: OruxMap, layer_param: LayerParams):
-        self.orux_maps = orux_maps
-        self.layer_param = layer_param
-        self.debug_logger = DebugLogger(self)
-        self.directory_resources = DIRECTORY_RESOURCES / self.layer_param.name
-        assert self.directory_resources.exists()
-
-    @property
-    def filename_subtiles_sqlite(self) -> pathlib.Path:
-        return self._filename_tiles_sqlite("subtiles")
-
-    @property
-    def filename_tiles_sqlite(self) -> pathlib.Path:
-        return self._filename_tiles_sqlite("tiles")
-
-    def _filename_tiles_sqlite(self, db_name: str) -> pathlib.Path:
-        filebase = (
-            DIRECTORY_CACHE_TILES
-            / self.orux_maps.context.append_version(db_name)
-            / self.layer_param.name
-        )
-        return filebase.with_suffix(".db")
-
-    def sqlite_fill_subtiles(self) -> None:
-        if self.filename_subtiles_sqlite.exists():
-            return
-
-        def iter_download_tiffs(filename_url_tiffs):
-            assert filename_url_tiffs.exists()
-            directory_cache = DIRECTORY_CACHE_TIF / self.layer_param.name
-            directory_cache.mkdir(exist_ok=True)
-            with filename_url_tiffs.open("r") as f:
-                for url in sorted(f.readlines()):
-                    url = url.strip()
-                    name = url.split("/")[-1]
-                    filename = directory_cache / name
-                    if self.orux_maps.context.only_tiffs is not None:
-                        if filename.name not in self.orux_maps.context.only_tiffs:
-                            continue
-                    if not filename.exists():
-                        print(f"Downloading {filename.relative_to(DIRECTORY_BASE)}")
-                        r = requests.get(url)
-                        filename.write_bytes(r.content)
-                    yield filename
-
-        def iter_filename_tiff():
-            if self.layer_param.tiff_filename:
-                # For big scales, the image has to be extracted form a zip file
-                tiff_filename = (
-                    DIRECTORY_CACHE_TIF
-                    / self.layer_param.name
-                    / self.layer_param.tiff_filename
-                )
-                d = DownloadZipAndExtractTiff(
-                    url=self.layer_param.tiff_url, tiff_filename=tiff_filename
-                )
-                d.download()
-                yield tiff_filename
-                return
-
-            filename_url_tiffs = self.directory_resources / "url_tiffs.txt"
-            yield from iter_download_tiffs(filename_url_tiffs)
-
-        with SqliteTilesRaw(
-            filename_sqlite=self.filename_subtiles_sqlite,
-            pixel_per_tile=PIXEL_PER_SUBTILE,
-            create=True,
-        ) as db:
-            db.remove()
-            db.create_db()
-
-            for filename in iter_filename_tiff():
-                tiff_attrs = TiffImageAttributes.create(
-                    layer_param=self.layer_param,
-                    filename=filename,
-                )
-                tiff_attrs.unittest_dump()
-                # print(
-                #     f"Create subtiles {filename.name} {tiff_attrs.boundsCH1903.nw.lon_m}/{tiff_attrs.boundsCH1903.nw.lat_m}"
-                # )
-
-                # with DurationLogger(f"Create subtiles {filename.name}"):
-                tiff_image_converter = TiffImageConverter(
-                    context=self.orux_maps.context, tiff_attrs=tiff_attrs
-                )
-                tiff_image_converter.create_subtiles(db=db)
-
-    def sqlite_subtiles_to_tiles(self) -> None:
-        if self.filename_tiles_sqlite.exists():
-            return
-
-        layer_param = self.layer_param
-
-        with SqliteTilesPng(
-            filename_sqlite=self.filename_tiles_sqlite,
-            pixel_per_tile=layer_param.pixel_per_tile,
-            create=True,
-        ) as db_tiles:
-            db_tiles.remove()
-            db_tiles.create_db()
-
-            with SqliteTilesRaw(
-                filename_sqlite=self.filename_subtiles_sqlite,
-                pixel_per_tile=PIXEL_PER_SUBTILE,
-            ) as db_subtiles:
-                db_subtiles.connect()
-
-                assert layer_param.pixel_per_tile % PIXEL_PER_SUBTILE == 0
-                subtiles_per_tile = layer_param.pixel_per_tile // PIXEL_PER_SUBTILE
-                m_per_subtile = int(layer_param.m_per_pixel * PIXEL_PER_SUBTILE)
-                m_per_tile = int(layer_param.m_per_tile)
-
-                def get_rounded(north: bool, select_max: bool):
-                    oper = "max" if select_max else "min"
-                    sign = 1 if select_max else -1
-                    direccion = "nw_north_m" if north else "nw_east_m"
-                    m = db_subtiles.select_int(select=f"{oper}({direccion})")
-                    return sign * m_per_tile * (sign * m // m_per_tile)
-
-                min_nw_north_m_rounded = get_rounded(north=True, select_max=False)
-                max_nw_north_m_rounded = get_rounded(north=True, select_max=True)
-                min_nw_east_m_rounded = get_rounded(north=False, select_max=False)
-                max_nw_east_m_rounded = get_rounded(north=False, select_max=True)
-
-                def iter_horizontal(top_nw_north_m: int) -> Iterable[Subtiles]:
-                    # We loop over a horizontal strip which has the height of one tile
-                    limit_vertical_stripe = f"nw_north_m <= {top_nw_north_m} and nw_north_m > {top_nw_north_m-m_per_tile}"
-                    limit_horizontal_boundries = f"nw_east_m <= {max_nw_east_m_rounded} and nw_east_m >= {min_nw_east_m_rounded}"
-                    iter_subtile = db_subtiles.select(
-                        where=limit_vertical_stripe
-                        + " and "
-                        + limit_horizontal_boundries,
-                        order="nw_east_m, nw_north_m desc",
-                    )
-                    subtiles = Subtiles(m_per_tile=m_per_tile)
-
-                    while True:
-                        try:
-                            row = next(iter_subtile)
-                        except StopIteration:
-                            return
-                        if subtiles.is_reset:
-                            # The very first time
-                            subtiles.start_tile(row)
-                            continue
-                        if subtiles.append_if_same_tile(row):
-                            continue
-                        if (
-                            len(subtiles.subtiles)
-                            == subtiles_per_tile * subtiles_per_tile
-                        ):
-                            yield subtiles
-                        subtiles.start_tile(row)
-
-                # We loop over a horizontal strip which has the height of one tile
-                for top_nw_north_m in range(
-                    min_nw_north_m_rounded, max_nw_north_m_rounded, m_per_tile
-                ):
-                    for subtiles in iter_horizontal(top_nw_north_m=top_nw_north_m):
-                        img = subtiles.image(
-                            subtiles_per_tile=subtiles_per_tile,
-                            pixel_per_tile=layer_param.pixel_per_tile,
-                            m_per_subtile=m_per_subtile,
-                        )
-                        db_tiles.add_subtile(
-                            img=img,
-                            nw_east_m=subtiles.nw_east_m,
-                            nw_north_m=subtiles.nw_north_m,
-                            skip_optimize_png=self.orux_maps.context.skip_optimize_png,
-                        )
-                        self.unittest_dump(subtiles=subtiles, img=img)
-
-    def unittest_dump(  # pylint: disable=too-many-arguments
-        self,
-        subtiles: Subtiles,
-        img=PIL.Image.Image,
-    ) -> None:
-        for probe_layer, probe_nw_east_m, probe_nw_north_m in (
-            ("0100", 2690000, 1250000),  # Does never trigger...
-            ("0100", 2690000, 1245000),
-            ("0100", 2690000, 1215000),
-        ):
-            if (
-                probe_nw_east_m == subtiles.nw_east_m
-                and probe_nw_north_m == subtiles.nw_north_m
-                and probe_layer == self.layer_param.name
-            ):
-                filename = (
-                    DIRECTORY_TESTRESULTS
-                    / f"{self.layer_param.name}-tiles-{subtiles.nw_east_m}_{subtiles.nw_north_m}.txt"
-                )
-
-                with filename.open("w") as f:
-                    f.write(f"  nw_east_m={subtiles.nw_east_m}\n")
-                    f.write(f"  nw_north_m={subtiles.nw_north_m}\n")
-                img.save(filename.with_suffix(".png"))
-
-    def create_map(self) -> None:
-        layer_param = self.layer_param
-
-        with SqliteTilesPng(
-            filename_sqlite=self.filename_tiles_sqlite,
-            pixel_per_tile=layer_param.pixel_per_tile,
-        ) as db_tiles:
-            db_tiles.connect()
-            m_per_tile = int(layer_param.m_per_tile)
-
-            min_nw_east_m = db_tiles.select_int(select="min(nw_east_m)")
-            max_nw_north_m = db_tiles.select_int(select="max(nw_north_m)")
-
-            max_se_east_m = db_tiles.select_int(select="max(nw_east_m)") + m_per_tile
-            min_se_north_m = db_tiles.select_int(select="min(nw_north_m)") - m_per_tile
-
-            assert (max_se_east_m - min_nw_east_m) % m_per_tile == 0
-            assert (max_nw_north_m - min_se_north_m) % m_per_tile == 0
-
-            nw = CH1903(lon_m=float(min_nw_east_m), lat_m=float(max_nw_north_m))
-            se = CH1903(lon_m=float(max_se_east_m), lat_m=float(min_se_north_m))
-            boundsCH1903_extrema = BoundsCH1903(nw=nw, se=se, valid_data=True)
-
-            boundsCH1903_extrema.assertIsNorthWest()
-
-            boundsWGS84 = boundsCH1903_extrema.to_WGS84(
-                valid_data=self.layer_param.valid_data
-            )
-
-            width_pixel = int(boundsCH1903_extrema.lon_m / self.layer_param.m_per_pixel)
-            height_pixel = int(
-                boundsCH1903_extrema.lat_m / self.layer_param.m_per_pixel
-            )
-            assert width_pixel % self.layer_param.pixel_per_tile == 0
-            assert height_pixel % self.layer_param.pixel_per_tile == 0
-
-            self.orux_maps.xml_otrk2.write_layer(
-                calib=boundsWGS84,
-                TILE_SIZE=self.layer_param.pixel_per_tile,
-                map_name=self.orux_maps.map_name,
-                id=self.layer_param.orux_layer,
-                xMax=width_pixel // self.layer_param.pixel_per_tile,
-                yMax=height_pixel // self.layer_param.pixel_per_tile,
-                height=height_pixel,
-                width=width_pixel,
-                minLat=boundsWGS84.southEast.lat_deg,
-                maxLat=boundsWGS84.northWest.lat_deg,
-                minLon=boundsWGS84.northWest.lon_deg,
-                maxLon=boundsWGS84.southEast.lon_deg,
-            )
-
-            for nw_east_m, nw_north_m, img in db_tiles.select(
-                where="true", order="nw_east_m, nw_north_m", raw=True
-            ):
-                lon_offset_m = nw_east_m - boundsCH1903_extrema.nw.lon_m
-                lat_offset_m = boundsCH1903_extrema.nw.lat_m - nw_north_m
-                lon_offset_m = round(lon_offset_m)
-                lat_offset_m = round(lat_offset_m)
-                assert lon_offset_m >= 0
-                assert lat_offset_m >= 0
-
-                x_tile_offset = round(lon_offset_m // self.layer_param.m_per_tile)
-                y_tile_offset = round(lat_offset_m // self.layer_param.m_per_tile)
-                assert x_tile_offset >= 0
-                assert y_tile_offset >= 0
-
-                self.orux_maps.db.insert(
-                    x_tile_offset=x_tile_offset,  # png.x_tile + x_tile_offset,
-                    y_tile_offset=y_tile_offset,  # png.y_tile + y_tile_offset,
-                    orux_layer=layer_param.orux_layer,
-                    img=img,
-                )
-
-
-@dataclass
-class TiffImageAttributes:
-    filename: pathlib.Path
-    m_per_pixel: float
-    layer_param: LayerParams
-    boundsCH1903: BoundsCH1903
-    boundsCH1903_floor: BoundsCH1903
-
-    @staticmethod
-    def create(filename: pathlib.Path, layer_param: LayerParams):
-        assert isinstance(filename, pathlib.Path)
-        assert isinstance(layer_param, LayerParams)
-
-        with rasterio.open(filename, "r") as dataset:
-            pixel_lon = dataset.width
-            pixel_lat = dataset.height
-
-            if (pixel_lon % PIXEL_PER_SUBTILE != 0) or (
-                pixel_lat % PIXEL_PER_SUBTILE != 0
-            ):
-                print(
-                    f"{filename.relative_to(DIRECTORY_BASE)}: size={pixel_lon}/{pixel_lat} does not fit in PIXEL_PER_SUBTILE={PIXEL_PER_SUBTILE}"
-                )
-
-            t = dataset.get_transform()
-            northwest_lon_m = t[0]
-            northwest_lat_m = t[3]
-            m_per_pixel = t[1]
-            assert t[1] == -t[5]
-
-            northwest = CH1903(
-                lon_m=northwest_lon_m,
-                lat_m=northwest_lat_m,
-                valid_data=layer_param.valid_data,
-            )
-            southeast = CH1903(
-                lon_m=northwest.lon_m + pixel_lon * m_per_pixel,
-                lat_m=northwest.lat_m - pixel_lat * m_per_pixel,
-                valid_data=layer_param.valid_data,
-            )
-            boundsCH1903 = BoundsCH1903(nw=northwest, se=southeast)
-            boundsCH1903.assertIsNorthWest()
-            boundsCH1903_floor = boundsCH1903.floor(
-                floor_m=layer_param.m_per_tile, valid_data=layer_param.valid_data
-            )
-            boundsCH1903_floor.assertIsNorthWest()
-            if not boundsCH1903.equals(boundsCH1903_floor):
-                print(f"{filename.relative_to(DIRECTORY_BASE)}: cropped")
-
-        layer_param.verify_m_per_pixel(m_per_pixel)
-        projection.assertSwissgridIsNorthWest(boundsCH1903)
-        return TiffImageAttributes(
-            filename=filename,
-            m_per_pixel=m_per_pixel,
-            layer_param=layer_param,
-            boundsCH1903=boundsCH1903,
-            boundsCH1903_floor=boundsCH1903_floor,
-        )
-
-    def unittest_dump(self):
-        if self.filename.name in ("swiss-map-raster100_2013_33_komb_5_2056.tif",):
-            filename_unittest = (
-                DIRECTORY_TESTRESULTS
-                / f"{self.layer_param.name}-{self.filename.stem}.txt"
-            )
-            with filename_unittest.open("w") as f:
-                f.write(f"{self.filename.relative_to(DIRECTORY_BASE)}\n")
-                f.write(f"  boundsCH1903.nw.lon_m={self.boundsCH1903.nw.lon_m}\n")
-                f.write(f"  boundsCH1903.nw.lat_m={self.boundsCH1903.nw.lat_m}\n")
-                f.write(f"  boundsCH1903.se.lon_m={self.boundsCH1903.se.lon_m}\n")
-                f.write(f"  boundsCH1903.se.lat_m={self.boundsCH1903.se.lat_m}\n")
-                f.write(f"  scale={self.layer_param.scale}\n")
-                f.write(f"  m_per_pixel={self.layer_param.m_per_pixel}\n")
-                f.write(f"  m_per_tile={self.layer_param.m_per_tile}\n")
-                f.write(
-                    f"  m_per_subtile={PIXEL_PER_SUBTILE*self.layer_param.m_per_pixel}\n"
-                )
-                f.write(f"  pixel_per_tile={self.layer_param.pixel_per_tile}\n")
-                f.write(f"  pixel_per_subtile={PIXEL_PER_SUBTILE}\n")
-                f.write(f"  scale={self.layer_param.scale}\n")
-
-
-class TiffImageConverter:
-    def __init__(self, context, tiff_attrs):
-        assert isinstance(context, Context)
-        assert isinstance(tiff_attrs, TiffImageAttributes)
-        self.context = context
-        self.tiff_attrs = tiff_attrs
-        self.layer_param = tiff_attrs.layer_param
-        self.filename = tiff_attrs.filename
-        self.boundsCH1903 = tiff_attrs.boundsCH1903
-        self.boundsCH1903_floor = tiff_attrs.boundsCH1903_floor
-        self.debug_pngs = []
-
-    def _load_image(self):
-        with rasterio.open(self.filename, "r") as dataset:
-            if len(dataset.indexes) == 3:
-                # https://rasterio.readthedocs.io/en/latest/topics/image_processing.html
-                # rasterio: (bands, rows, columns)
-                # PIL: rows, columns, bands)
-                data = dataset.read()
-                img_arr = rasterio.plot.reshape_as_image(data)
-                img = PIL.Image.fromarray(img_arr, mode="RGB")
-                del data
-                del img_arr
-                assert dataset.width == img.width
-                assert dataset.height == img.height
-            else:
-                img = PIL.Image.open(self.filename, mode="r")
-                img = img.convert("RGB")
-            return img
-
-    def create_subtiles(self, db: SqliteTilesRaw) -> None:
-        with self._load_image() as img:
-            if (img.width % PIXEL_PER_SUBTILE != 0) or (
-                img.height % PIXEL_PER_SUBTILE != 0
-            ):
-                print(
-                    f"{self.filename.relative_to(DIRECTORY_BASE)}: WARNING: Strange image size {img.width}/{img.height}"
-                )
-            m_per_pixel = self.layer_param.m_per_pixel
-            lon_m = int(self.tiff_attrs.boundsCH1903.nw.lon_m)
-            lat_m = int(self.tiff_attrs.boundsCH1903.nw.lat_m)
-            # print(f"{self.filename.name}: {lon_m}/{lat_m}")
-            for x_pixel in range(0, img.width, PIXEL_PER_SUBTILE):
-                nw_east_m = int(m_per_pixel * x_pixel) + lon_m
-                for y_pixel in range(0, img.height, PIXEL_PER_SUBTILE):
-                    nw_north_m = lat_m - int(m_per_pixel * y_pixel)
-                    img_subtile = img.crop(
-                        (
-                            x_pixel,
-                            y_pixel,
-                            x_pixel + PIXEL_PER_SUBTILE,
-                            y_pixel + PIXEL_PER_SUBTILE,
-                        )
-                    )
-                    self.unittest_dump(
-                        x_pixel=x_pixel,
-                        y_pixel=y_pixel,
-                        nw_east_m=nw_east_m,
-                        nw_north_m=nw_north_m,
-                        img=img_subtile,
-                    )
-                    db.add_subtile(
-                        img=img_subtile, nw_east_m=nw_east_m, nw_north_m=nw_north_m
-                    )
-
-    def unittest_dump(  # pylint: disable=too-many-arguments
-        self,
-        x_pixel: int,
-        y_pixel: int,
-        nw_east_m: int,
-        nw_north_m: int,
-        img=PIL.Image.Image,
-    ) -> None:
-        for probe_filename, probe_x_pixel, probe_y_pixel in (
-            ("swiss-map-raster100_2013_33_komb_5_2056.tif", 0, 0),
-            (
-                "swiss-map-raster100_2013_33_komb_5_2056.tif",
-                PIXEL_PER_SUBTILE,
-                0,
-            ),
-            (
-                "swiss-map-raster100_2013_33_komb_5_2056.tif",
-                0,
-                PIXEL_PER_SUBTILE,
-            ),
-        ):
-            if (
-                probe_x_pixel == x_pixel
-                and probe_y_pixel == y_pixel
-                and probe_filename == self.filename.name
-            ):
-                filename = (
-                    DIRECTORY_TESTRESULTS
-                    / f"{self.layer_param.name}-subtiles-{self.filename.stem}_{x_pixel}_{y_pixel}.txt"
-                )
-
-                with filename.open("w") as f:
-                    f.write(f"{self.filename}\n")
-                    f.write(f"  x_pixel={x_pixel}\n")
-                    f.write(f"  y_pixel={y_pixel}\n")
-                    f.write(f"  nw_east_m={nw_east_m}\n")
-                    f.write(f"  nw_north_m={nw_north_m}\n")
-                img.save(filename.with_suffix(".png"))
+﻿#!/usr/bin/python
+#
+# Copyright (C) 2010-2021 Hans Maerk, Maerki Informatik
+# License: Apache License v2
+#
+# Siehe http://www.maerki.com/hans/orux
+#
+# History:
+#   2010-06-22, Hans Maerki, Implementiert
+#   2010-06-23, Hans Maerki, Koordinaten der Karte Massstab 1:50000 angepasst.
+#   2011-01-17, Hans Maerki, Neu koennen Karten in Unterordner gruppiert werden.
+#   2011-02-16, Hans Maerki, Swisstopo hat die Server gewechselt: Neue Url angepasst.
+#   2013-09-06, Hans Maerki, Swisstopo hat die Server gewechselt: Neue Url angepasst.
+#   2018-04-24, Hans Maerki, Swisstopo hat die Server gewechselt: Neue Logik angepasst.
+#   2019-06-03, Hans Maerki, Angepasst an Python 3.7.2.
+#   2021-03-28, Hans Maerki, Massive cleanup.
+"""
+http://map.geo.admin.ch
+
+http://gpso.de/navigation/utm.html
+  UTM- Koordinatensystem, WGS84- Kartendatum
+http://de.wikipedia.org/wiki/Kartendatum
+  Geodaetisches Datum
+https://www.swisstopo.admin.ch/de/wissen-fakten/geodaesie-vermessung/bezugsysteme/kartenprojektionen.html
+  Schweizerische Kartenprojektionen
+https://www.swisstopo.admin.ch/de/karten-daten-online/calculation-services/navref.html
+https://www.swisstopo.admin.ch/content/swisstopo-internet/de/online/calculation-services/_jcr_content/contentPar/tabs/items/dokumente_und_publik/tabPar/downloadlist/downloadItems/8_1467103085694.download/refsys_d.pdf
+  Umrechnung von Schweizer Landeskoordinaten in ellipsoidische WGS84-Koordinaten
+http://de.wikipedia.org/wiki/WGS_84
+  World Geodetic System 1984 (WGS 84)
+"""
+import math
+import time
+import concurrent.futures
+import shutil
+import pathlib
+
+from dataclasses import dataclass
+from typing import Iterable, List, Optional
+
+import numpy as np
+import PIL.Image
+import rasterio
+import rasterio.plot
+import rasterio.windows
+from rasterio.enums import ColorInterp
+
+from oruxmap.utils import projection
+from oruxmap.utils.projection import CH1903, BoundsCH1903
+from oruxmap.utils.context import Context, ENGINE_SUBTILES, ENGINE_MOSAIC, ENGINE_WMTS
+from oruxmap.utils.scheduler import (
+    DagScheduler,
+    Task,
+    memory_budget,
+)
+from oruxmap.utils.disk_quota import DiskQuota
+from oruxmap.utils.coverage import CoverageReport
+from oruxmap.utils.progress import Progress, NO_PROGRESS
+from oruxmap.utils.tiff_catalog import TiffCatalog, TiffSheet
+from oruxmap.utils.wmts import WMTS_URL, WmtsClient, select_zoom
+from oruxmap.utils.orux_xml_otrk2 import OruxXmlOtrk2
+from oruxmap.utils.img_codec import TileCodec, CODEC_PNG
+from oruxmap.utils.download_zip_and_extract import DownloadZipAndExtractTiff
+from oruxmap.layers_switzerland import LIST_LAYERS, LayerParams, select_layers
+from oruxmap.tiffs import LayerTiffs
+from oruxmap.utils.sqlite_titles import SqliteTilesPng, SqliteTilesRaw
+from oruxmap.utils.tile_storage import (
+    STORAGES,
+    SqliteTileStorage,
+    TileRange,
+    TILE_RANGE_ALL,
+    ORDER_EAST_NORTH,
+    ORDER_EAST_NORTH_DESC,
+)
+from oruxmap.utils.sqlite_orux import SqliteOrux, FILENAME_ORUX_DB
+from oruxmap.map_delta import create_patch
+from oruxmap.map_validate import validate_map
+from oruxmap.utils.constants_directories import (
+    DIRECTORY_MAPS,
+    DIRECTORY_BASE,
+    DIRECTORY_RESOURCES,
+    DIRECTORY_CACHE_TILES,
+    DIRECTORY_CACHE_TIF,
+    DIRECTORY_CACHE_WMTS,
+    DIRECTORY_LOGS,
+    DIRECTORY_TESTRESULTS,
+    create_directories,
+)
+
+PIL.Image.MAX_IMAGE_PIXELS = None
+
+PIXEL_PER_SUBTILE = 100
+
+MBYTE = 1024 ** 2
+
+
+class DurationLogger:
+    def __init__(self, step: str):
+        self.step = step
+        self.start_s = time.perf_counter()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _type, value, tb):
+        print(f"{self.step} took {time.perf_counter() - self.start_s:0.0f}s")
+
+
+class OruxMap:
+    def __init__(self, map_name, context):
+        assert isinstance(context, Context)
+        create_directories()
+        self.map_name = context.append_version(map_name)
+        self.context = context
+        self.directory_map = DIRECTORY_MAPS / self.map_name
+        if context.delta_from is not None:
+            # The directory of the map is emptied below
+            assert context.delta_from.resolve() != self.directory_map.resolve()
+
+        print("===== ", self.map_name)
+
+        # Remove zip file
+        filename_zip = self.directory_map.with_suffix(".zip")
+
+        if filename_zip.exists():
+            filename_zip.unlink()
+
+        # Create empty directory
+        for filename in self.directory_map.glob("*.*"):
+            filename.unlink()
+        for filename in DIRECTORY_TESTRESULTS.glob("*.*"):
+            filename.unlink()
+        self.directory_map.mkdir(parents=True, exist_ok=True)
+
+        # 'Context.partial_orux_dbs'
+        self.directory_partial = DIRECTORY_MAPS / f"{self.map_name}-partial"
+        shutil.rmtree(self.directory_partial, ignore_errors=True)
+        if self.context.use_partial_orux_dbs():
+            self.directory_partial.mkdir()
+        elif self.context.partial_orux_dbs:
+            print("partial_orux_dbs: Ignored for the sqlite tile storage")
+
+        self.db = SqliteOrux(filename_sqlite=self.directory_map / FILENAME_ORUX_DB)
+
+        self.xml_otrk2 = OruxXmlOtrk2(
+            filename=self.directory_map / f"{self.map_name}.otrk2.xml",
+            map_name=self.map_name,
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _type, value, tb):
+        self.xml_otrk2.close()
+        shutil.rmtree(self.directory_partial, ignore_errors=True)
+
+        self.db.commit()
+        if not self.context.skip_sqlite_vacuum:
+            with DurationLogger("sqlite.execute('VACUUM')") as duration:
+                self.db.vacuum()
+        self.db.close()
+
+        package_map(context=self.context, directory_map=self.directory_map)
+
+    def create_layers(self, iMasstabMin: int = 25, iMasstabMax: int = 500):
+        with DurationLogger(f"Layer {self.map_name}") as duration:
+            start_s = time.perf_counter()
+            scheduler = create_scheduler(context=self.context)
+            layers = select_layers(iMasstabMin=iMasstabMin, iMasstabMax=iMasstabMax)
+            # The derived layers depend on the tiles of a finer layer
+            for layer_param in sorted(layers, key=lambda l: l.derived_from is not None):
+                add_tiles_tasks(
+                    scheduler=scheduler, context=self.context, layer_param=layer_param
+                )
+            previous_map_task = None
+            for layer_param in layers:
+                previous_map_task = self._add_map_tasks(
+                    scheduler=scheduler,
+                    layer_param=layer_param,
+                    previous_map_task=previous_map_task,
+                )
+            scheduler.run()
+
+    def _add_map_tasks(
+        self,
+        scheduler: DagScheduler,
+        layer_param: LayerParams,
+        previous_map_task: Optional[str],
+    ) -> str:
+        """
+        Writing into 'OruxMapsImages.db' is done in the main process
+        in the order of LIST_LAYERS.
+        """
+        task_tiles = scheduler.tasks[f"tiles {layer_param.name}"]
+        layer_param = map_layer_param(context=self.context, layer_param=layer_param)
+        if layer_param.retiled_from is not None:
+            task_tiles = scheduler.tasks[f"retile {layer_param.name}"]
+        map_scale = MapScale(context=self.context, layer_param=layer_param)
+        tasks = []
+        task_map = Task(
+            name=f"map {layer_param.name}",
+            func=map_scale.create_map,
+            args=(self,),
+            dependencies=[task_tiles.name],
+            serial=True,
+        )
+        if self.context.use_partial_orux_dbs():
+            # The shards are written in parallel, the main process merges them
+            task_map.func = map_scale.merge_map
+            task_map.dependencies = []
+            for shard in range(layer_param.orux_shards):
+                task_partial = Task(
+                    name=f"partial map {layer_param.name} {shard}",
+                    func=run_partial_map,
+                    args=(self.context, layer_param, self.directory_partial, shard),
+                    dependencies=[task_tiles.name],
+                )
+                tasks.append(task_partial)
+                task_map.dependencies.append(task_partial.name)
+        if previous_map_task is not None:
+            task_map.dependencies.append(previous_map_task)
+        tasks.append(task_map)
+        for task in tasks:
+            scheduler.add(task)
+        return task_map.name
+
+
+def package_map(context: Context, directory_map: pathlib.Path) -> None:
+    """
+    Validates the map, writes the patch 'Context.delta_from' and zips the map.
+    See the command 'package' of 'cli.py'.
+    """
+    if not context.skip_map_validate:
+        with DurationLogger("validate") as duration:
+            report = validate_map(
+                directory_map=directory_map,
+                max_workers=context.max_workers,
+            )
+        assert report.ok, f"{directory_map}: {len(report.errors)} errors"
+
+    if context.delta_from is not None:
+        with DurationLogger("patch") as duration:
+            create_patch(
+                directory_old=context.delta_from,
+                directory_new=directory_map,
+                filename_patch=DIRECTORY_MAPS / f"{directory_map.name}-patch.db",
+            )
+
+    if not context.skip_map_zip:
+        with DurationLogger("zip") as duration:
+            filename_zip = shutil.make_archive(
+                base_name=str(directory_map),
+                root_dir=str(directory_map.parent),
+                base_dir=directory_map.name,
+                format="zip",
+            )
+    print("----- Ready")
+    print(f'The map now is ready in "{directory_map.relative_to(DIRECTORY_BASE)}".')
+    print(
+        "This directory must be copied 'by Hand' onto your android into 'oruxmaps/mapfiles'."
+    )
+
+
+def create_scheduler(context: Context) -> DagScheduler:
+    return DagScheduler(
+        multiprocessing=context.multiprocessing,
+        max_workers=context.max_workers,
+        memory_budget_bytes=context.memory_budget_bytes,
+    )
+
+
+def add_tiles_tasks(
+    scheduler: DagScheduler, context: Context, layer_param: LayerParams
+) -> None:
+    """
+    The tasks creating the tiles cache 'tiles <layer>'.
+    The layers are independent till they are written into 'OruxMapsImages.db'.
+    """
+    task_tiles = _add_task_tiles(
+        scheduler=scheduler, context=context, layer_param=layer_param
+    )
+
+    layer_param_map = map_layer_param(context=context, layer_param=layer_param)
+    if layer_param_map.retiled_from is not None:
+        map_retiled = MapScale(context=context, layer_param=layer_param_map)
+        task_retile = Task(
+            name=f"retile {layer_param.name}",
+            func=run_stage,
+            args=(context, layer_param_map, STAGE_RETILE),
+            dependencies=[task_tiles.name],
+            is_done=map_retiled.filename_tiles_sqlite.exists,
+        )
+        scheduler.add(task_retile)
+
+
+def _add_task_tiles(
+    scheduler: DagScheduler, context: Context, layer_param: LayerParams
+) -> Task:
+    """
+    A derived layer needs the tiles of its source layer: If the source layer
+    is not selected, its tasks are added too.
+    """
+    map_scale = MapScale(context=context, layer_param=layer_param)
+    task_tiles = Task(
+        name=f"tiles {layer_param.name}",
+        func=run_stage,
+        args=(context, layer_param, STAGE_TILES),
+        is_done=map_scale.filename_tiles_sqlite.exists,
+    )
+    if layer_param.derived_from is not None:
+        task_tiles.args = (context, layer_param, STAGE_DERIVE)
+        task_source = f"tiles {layer_param.source_layer.name}"
+        if task_source not in scheduler.tasks:
+            _add_task_tiles(
+                scheduler=scheduler,
+                context=context,
+                layer_param=layer_param.source_layer,
+            )
+        task_tiles.dependencies.append(task_source)
+    elif context.engine == ENGINE_MOSAIC:
+        task_tiles.args = (context, layer_param, STAGE_MOSAIC)
+    elif context.engine == ENGINE_WMTS:
+        task_tiles.args = (context, layer_param, STAGE_WMTS)
+    else:
+        task_subtiles = Task(
+            name=f"subtiles {layer_param.name}",
+            func=run_stage,
+            args=(context, layer_param, STAGE_SUBTILES),
+            is_done=map_scale.filename_subtiles_sqlite.exists,
+        )
+        scheduler.add(task_subtiles)
+        task_tiles.dependencies.append(task_subtiles.name)
+    scheduler.add(task_tiles)
+    return task_tiles
+
+
+def map_layer_param(context: Context, layer_param: LayerParams) -> LayerParams:
+    """
+    The layer as written into the map, see 'Context.orux_pixel_per_tile'.
+    """
+    pixel_per_tile = context.orux_pixel_per_tile
+    if (pixel_per_tile is None) or (pixel_per_tile == layer_param.pixel_per_tile):
+        return layer_param
+    return layer_param.retiled(pixel_per_tile)
+
+
+def create_tiles(
+    context: Context, layers: List[LayerParams], subtiles_only: bool = False
+) -> None:
+    """
+    Creates the tiles caches of the layers without writing a map.
+    See the commands 'subtiles' and 'tiles' of 'cli.py'.
+    'subtiles_only': Stops after the subtiles, engine 'subtiles' only.
+    """
+    create_directories()
+    scheduler = create_scheduler(context=context)
+    for layer_param in sorted(layers, key=lambda l: l.derived_from is not None):
+        add_tiles_tasks(scheduler=scheduler, context=context, layer_param=layer_param)
+    if subtiles_only:
+        assert context.engine == ENGINE_SUBTILES, context.engine
+        scheduler.tasks = {
+            name: task
+            for name, task in scheduler.tasks.items()
+            if name.startswith("subtiles ")
+        }
+    scheduler.run()
+
+
+STAGE_SUBTILES = "sqlite_fill_subtiles"
+STAGE_TILES = "sqlite_subtiles_to_tiles"
+STAGE_MOSAIC = "sqlite_mosaic_tiles"
+STAGE_DERIVE = "sqlite_derive_tiles"
+STAGE_WMTS = "sqlite_wmts_tiles"
+STAGE_RETILE = "sqlite_retile"
+
+
+def run_stage(context: Context, layer_param: LayerParams, stage: str) -> None:
+    """
+    Entry point of a worker process: Creates one cache db of one layer.
+    """
+    assert stage in (
+        STAGE_SUBTILES,
+        STAGE_TILES,
+        STAGE_MOSAIC,
+        STAGE_DERIVE,
+        STAGE_WMTS,
+        STAGE_RETILE,
+    )
+    progress = NO_PROGRESS
+    if context.progress_interval_s is not None:
+        progress = Progress(
+            layer=layer_param.name, stage=stage, interval_s=context.progress_interval_s
+        )
+    with progress:
+        map_scale = MapScale(
+            context=context, layer_param=layer_param, progress=progress
+        )
+        getattr(map_scale, stage)()
+
+
+def run_partial_map(
+    context: Context, layer_param: LayerParams, directory: pathlib.Path, shard: int
+) -> None:
+    """
+    Entry point of a worker process: Writes one shard of a layer into a partial orux db.
+    """
+    map_scale = MapScale(context=context, layer_param=layer_param)
+    map_scale.create_partial_map(directory=directory, shard=shard)
+
+
+@dataclass
+class DebugPng:
+    tiff_filename: str
+    x_tile: int
+    y_tile: int
+    x_tif_pixel: int
+    y_tif_pixel: int
+
+    @staticmethod
+    def csv_header():
+        return "tiff_filename,x_tile,y_tile,x_tif_pixel,y_tif_pixel"
+
+    @property
+    def csv(self):
+        return f"{self.tiff_filename},{self.x_tile},{self.y_tile},{self.x_tif_pixel},{self.y_tif_pixel}"
+
+
+class DebugLogger:
+    def __init__(self, map_scale):
+        self.map_scale = map_scale
+
+    def report(self, list_tiff_attrs, boundsCH1903_extrema):
+        assert isinstance(list_tiff_attrs, list)
+        assert isinstance(boundsCH1903_extrema, BoundsCH1903)
+
+        boundsCH1903_extrema.assertIsNorthWest()
+        for tiff_attrs in list_tiff_attrs:
+            tiff_attrs.boundsCH1903.assertIsNorthWest()
+
+        def fopen(extension):
+            filename_base = f"debug_log_{self.map_scale.layer_param.name}"
+            filename = DIRECTORY_LOGS / (filename_base + extension)
+            return filename.open("w")
+
+        with fopen("_tiff.csv") as f:
+            f.write(f"filename,{BoundsCH1903.csv_header('boundsCH1903')}\n")
+            for tiff_attrs in list_tiff_attrs:
+                assert isinstance(tiff_attrs, TiffImageAttributes)
+                f.write(f"{tiff_attrs.filename.name},{tiff_attrs.boundsCH1903.csv}\n")
+            f.write(f"all,{boundsCH1903_extrema.csv}\n")
+
+
+@dataclass
+class Subtiles:
+    m_per_tile: int
+    subtiles: list = None
+    nw_east_m: int = None
+    nw_north_m: int = None
+    tile_east_idx: int = None
+
+    @property
+    def is_reset(self):
+        return self.subtiles is None
+
+    def append_if_same_tile(self, row) -> bool:
+        east_m, _north_m, _ = row
+        same_tile = self.tile_east_idx == east_m // self.m_per_tile
+        if same_tile:
+            self.subtiles.append(row)
+        return same_tile
+
+    def start_tile(self, row) -> None:
+        east_m, north_m, _ = row
+        self.tile_east_idx = east_m // self.m_per_tile
+        self.nw_east_m = east_m
+        self.nw_north_m = north_m
+        self.subtiles = [row]
+
+    def image(
+        self, subtiles_per_tile: int, pixel_per_tile: int, m_per_subtile: int
+    ) -> PIL.Image.Image:
+        assert len(self.subtiles) == subtiles_per_tile * subtiles_per_tile
+        img_tile = PIL.Image.new(
+            mode="RGB",
+            size=(
+                pixel_per_tile,
+                pixel_per_tile,
+            ),
+            color=0,
+        )
+        for nw_east_m, nw_north_m, img in self.subtiles:
+            pixel_east = int(
+                PIXEL_PER_SUBTILE * (nw_east_m - self.nw_east_m) / m_per_subtile
+            )
+            pixel_north = int(
+                PIXEL_PER_SUBTILE * (nw_north_m - self.nw_north_m) / m_per_subtile
+            )
+            pixel_south = -pixel_north
+            assert 0 <= pixel_east < pixel_per_tile
+            assert 0 <= pixel_south < pixel_per_tile
+            img_tile.paste(
+                im=img,
+                box=(pixel_east, pixel_south),
+            )
+        return img_tile
+
+
+class MapScale:
+    """
+    This object represents one scale. For example 1:25'000, 1:50'000.
+    """
+
+    # Engine 'mosaic': The tiles of a strip are assembled in blocks of this width
+    MOSAIC_TILES_PER_BLOCK = 8
+    # 'sqlite_retile()': The tiles are cut in vertical stripes of this width
+    RETILE_TILES_PER_STRIPE = 32
+
+    def __init__(
+        self,
+        context: Context,
+        layer_param: LayerParams,
+        progress: Progress = NO_PROGRESS,
+    ):
+        assert isinstance(context, Context)
+        self.context = context
+        self.layer_param = layer_param
+        # Counts the tiles written by the stage, see 'run_stage()'
+        self.progress = progress
+        self.debug_logger = DebugLogger(self)
+        self.directory_resources = DIRECTORY_RESOURCES / self.layer_param.name
+        if layer_param.derived_from is None:
+            assert self.directory_resources.exists()
+
+    @property
+    def filename_subtiles_sqlite(self) -> pathlib.Path:
+        return self._filename_tiles_sqlite("subtiles")
+
+    @property
+    def filename_tiles_sqlite(self) -> pathlib.Path:
+        db_name = "tiles"
+        if self.layer_param.codec != CODEC_PNG:
+            # Do not mix up tiles of different codecs in the cache
+            db_name += f"_{self.layer_param.codec.name}"
+        if self.layer_param.retiled_from is not None:
+            db_name += f"_{self.layer_param.pixel_per_tile}px"
+        return self._filename_tiles_sqlite(db_name)
+
+    def _filename_tiles_sqlite(self, db_name: str) -> pathlib.Path:
+        filebase = (
+            DIRECTORY_CACHE_TILES
+            / self.context.append_version(db_name)
+            / self.layer_param.name
+        )
+        return filebase.with_suffix(STORAGES[self.context.tile_storage].SUFFIX)
+
+    def enforce_diskspace_quota(self) -> None:
+        """
+        Tiffs, subtiles and WMTS tiles may be recreated. The tiles of this map
+        and the subtiles still waiting to be turned into tiles are protected.
+        """
+        if self.context.diskspace_quota_bytes is None:
+            return
+        protect = [
+            MapScale(
+                context=self.context, layer_param=layer_param
+            ).filename_tiles_sqlite
+            for layer_param in LIST_LAYERS
+        ]
+        if self.context.orux_pixel_per_tile is not None:
+            protect.extend(
+                MapScale(
+                    context=self.context,
+                    layer_param=layer_param.retiled(self.context.orux_pixel_per_tile),
+                ).filename_tiles_sqlite
+                for layer_param in LIST_LAYERS
+            )
+        for layer_param in LIST_LAYERS:
+            # The subtiles are needed until the tiles cache of the layer exists:
+            # Its tiles task may wait in the DagScheduler for another layer
+            map_scale = MapScale(context=self.context, layer_param=layer_param)
+            if not map_scale.filename_tiles_sqlite.exists():
+                protect.append(map_scale.filename_subtiles_sqlite)
+        disk_quota = DiskQuota(
+            directories=[
+                DIRECTORY_CACHE_TIF,
+                DIRECTORY_CACHE_TILES,
+                DIRECTORY_CACHE_WMTS,
+            ],
+            quota_bytes=self.context.diskspace_quota_bytes,
+        )
+        disk_quota.enforce(protect=protect)
+
+    def remove_tiff(self, filename: pathlib.Path) -> None:
+        for filename_remove in (
+            filename,
+            filename.with_suffix(".tfw"),
+            filename.with_name(DownloadZipAndExtractTiff.FILENAME_ZIP),
+        ):
+            if filename_remove.exists():
+                print(f"Remove {filename_remove.relative_to(DIRECTORY_BASE)}")
+                filename_remove.unlink()
+
+    @property
+    def tiffs(self) -> LayerTiffs:
+        return LayerTiffs(
+            context=self.context,
+            layer_param=self.layer_param,
+            enforce_diskspace_quota=self.enforce_diskspace_quota,
+        )
+
+    def write_coverage(
+        self,
+        coverage: CoverageReport,
+        processed: Iterable[str],
+        sheets: List[TiffSheet] = None,
+    ):
+        """
+        'sheets': None for the sheets of the catalog, limited like the
+        tiffs in 'LayerTiffs.iter_tiffs()'.
+        """
+        if sheets is None:
+            with TiffCatalog() as catalog:
+                sheets = catalog.select_layer(layer=self.layer_param.name)
+            if self.context.only_tiffs is not None:
+                sheets = [s for s in sheets if s.name in self.context.only_tiffs]
+            if self.context.only_boundsCH1903 is not None:
+                sheets = [
+                    s for s in sheets if s.intersects(self.context.only_boundsCH1903)
+                ]
+        with self._open_tiles() as db_tiles:
+            db_tiles.connect()
+            written_east_m, written_north_m = db_tiles.keys()
+        coverage.write(
+            written_east_m=written_east_m,
+            written_north_m=written_north_m,
+            sheets=sheets,
+            processed=processed,
+        )
+
+    def sqlite_fill_subtiles(self) -> None:
+        if self.filename_subtiles_sqlite.exists():
+            return
+
+        with SqliteTilesRaw(
+            filename_sqlite=self.filename_subtiles_sqlite,
+            pixel_per_tile=PIXEL_PER_SUBTILE,
+            create=True,
+            codec=self.layer_param.codec,
+            progress=self.progress,
+        ) as db, TiffCatalog() as catalog:
+            db.resume_or_create_db(auto_vacuum=self.context.save_diskspace)
+            # The checkpoints are the names of the tiffs done
+            self.progress.resume(sheets=db.storage.count_checkpoints())
+            self.progress.set_totals(sheets=self.tiffs.count_sheets())
+
+            for url, filename in self.tiffs.iter_tiffs(
+                catalog=catalog, is_done=db.is_checkpoint
+            ):
+                sheet = catalog.get(
+                    layer=self.layer_param.name, url=url, filename=filename
+                )
+                tiff_attrs = TiffImageAttributes.create(
+                    sheet=sheet,
+                    layer_param=self.layer_param,
+                )
+                tiff_attrs.unittest_dump()
+                # print(
+                #     f"Create subtiles {filename.name} {tiff_attrs.boundsCH1903.nw.lon_m}/{tiff_attrs.boundsCH1903.nw.lat_m}"
+                # )
+
+                # with DurationLogger(f"Create subtiles {filename.name}"):
+                tiff_image_converter = TiffImageConverter(
+                    context=self.context, tiff_attrs=tiff_attrs
+                )
+                tiff_image_converter.create_subtiles(db=db)
+                db.checkpoint(filename.name)
+                self.progress.add_sheet()
+                if self.context.save_diskspace:
+                    self.remove_tiff(filename)
+
+    def sqlite_subtiles_to_tiles(self) -> None:
+        if self.filename_tiles_sqlite.exists():
+            return
+
+        layer_param = self.layer_param
+        coverage = CoverageReport(
+            layer_name=layer_param.name, m_per_tile=int(layer_param.m_per_tile)
+        )
+
+        with SqliteTilesPng(
+            filename_sqlite=self.filename_tiles_sqlite,
+            pixel_per_tile=layer_param.pixel_per_tile,
+            create=True,
+            codec=layer_param.codec,
+            progress=self.progress,
+        ) as db_tiles:
+            db_tiles.resume_or_create_db()
+
+            with SqliteTilesRaw(
+                filename_sqlite=self.filename_subtiles_sqlite,
+                pixel_per_tile=PIXEL_PER_SUBTILE,
+            ) as db_subtiles, concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.context.decode_threads
+            ) as executor:
+                db_subtiles.connect()
+                # No subtiles: An empty region of interest or, with
+                # 'save_diskspace', all strips have been done by a previous run.
+                # The loop below is skipped, the cleanup at the end is done.
+
+                assert layer_param.pixel_per_tile % PIXEL_PER_SUBTILE == 0
+                subtiles_per_tile = layer_param.pixel_per_tile // PIXEL_PER_SUBTILE
+                tiles_total = db_subtiles.count() // (subtiles_per_tile ** 2)
+                if self.context.save_diskspace:
+                    # The subtiles of the strips done by a previous run are deleted
+                    tiles_total += self.progress.tiles_done
+                self.progress.set_totals(tiles=tiles_total)
+                m_per_subtile = int(layer_param.m_per_pixel * PIXEL_PER_SUBTILE)
+                m_per_tile = int(layer_param.m_per_tile)
+
+                def range_vertical_stripe(top_nw_north_m: int) -> TileRange:
+                    return TileRange(
+                        min_north_m=top_nw_north_m - m_per_tile + 1,
+                        max_north_m=top_nw_north_m,
+                    )
+
+                def iter_horizontal(top_nw_north_m: int) -> Iterable[Subtiles]:
+                    # We loop over a horizontal strip which has the height of one tile
+                    # The subtiles of the next two tiles are decoded ahead by 'executor'
+                    iter_subtile = db_subtiles.select_prefetch(
+                        tile_range=range_vertical_stripe(top_nw_north_m),
+                        order=ORDER_EAST_NORTH_DESC,
+                        executor=executor,
+                        depth=2 * subtiles_per_tile * subtiles_per_tile,
+                    )
+                    subtiles = Subtiles(m_per_tile=m_per_tile)
+
+                    def is_complete() -> bool:
+                        count = len(subtiles.subtiles)
+                        if count == subtiles_per_tile * subtiles_per_tile:
+                            return True
+                        # Only partially covered by tiffs: The tile is dropped
+                        coverage.drop(
+                            nw_east_m=subtiles.tile_east_idx * m_per_tile,
+                            nw_north_m=top_nw_north_m,
+                            coverage=count / (subtiles_per_tile * subtiles_per_tile),
+                        )
+                        return False
+
+                    for row in iter_subtile:
+                        if subtiles.is_reset:
+                            # The very first time
+                            subtiles.start_tile(row)
+                            continue
+                        if subtiles.append_if_same_tile(row):
+                            continue
+                        if is_complete():
+                            yield subtiles
+                        subtiles.start_tile(row)
+                    # The last tile of the strip
+                    if not subtiles.is_reset and is_complete():
+                        yield subtiles
+
+                # Skip the strips without subtiles, see 'Context.range()'
+                tops_nw_north_m = set(
+                    -(-nw_north_m // m_per_tile) * m_per_tile
+                    for nw_north_m in db_subtiles.norths()
+                )
+
+                # We loop over a horizontal strip which has the height of one tile
+                for top_nw_north_m in sorted(tops_nw_north_m):
+                    checkpoint = f"strip {top_nw_north_m}"
+                    if db_tiles.is_checkpoint(checkpoint):
+                        # Already done by a previous, interrupted run
+                        continue
+                    for subtiles in iter_horizontal(top_nw_north_m=top_nw_north_m):
+                        if self.context.skip_png_write:
+                            db_tiles.add_placeholder(
+                                nw_east_m=subtiles.nw_east_m,
+                                nw_north_m=subtiles.nw_north_m,
+                            )
+                            continue
+                        img = subtiles.image(
+                            subtiles_per_tile=subtiles_per_tile,
+                            pixel_per_tile=layer_param.pixel_per_tile,
+                            m_per_subtile=m_per_subtile,
+                        )
+                        db_tiles.add_subtile(
+                            img=img,
+                            nw_east_m=subtiles.nw_east_m,
+                            nw_north_m=subtiles.nw_north_m,
+                            skip_optimize_png=self.context.skip_optimize_png,
+                        )
+                        self.unittest_dump(subtiles=subtiles, img=img)
+                    db_tiles.checkpoint(checkpoint)
+                    if self.context.save_diskspace:
+                        # The tiles of this strip are committed: Drop its subtiles
+                        db_subtiles.delete(range_vertical_stripe(top_nw_north_m))
+
+                with TiffCatalog() as catalog:
+                    processed = [
+                        sheet.name
+                        for sheet in catalog.select_layer(layer=layer_param.name)
+                        if db_subtiles.is_checkpoint(sheet.name)
+                    ]
+
+        self.write_coverage(coverage=coverage, processed=processed)
+        if self.context.save_diskspace:
+            print(f"Remove {self.filename_subtiles_sqlite.relative_to(DIRECTORY_BASE)}")
+            SqliteTilesRaw(
+                filename_sqlite=self.filename_subtiles_sqlite,
+                pixel_per_tile=PIXEL_PER_SUBTILE,
+            ).remove()
+        self.enforce_diskspace_quota()
+
+    def sqlite_derive_tiles(self) -> None:
+        """
+        'LayerParams.derived_from': The tiles are downsampled from the tiles
+        cache of a finer layer by averaging blocks of pixels. No tiff is read.
+        Tiles of the finer layer which are missing are white.
+        """
+        if self.filename_tiles_sqlite.exists():
+            return
+
+        layer_param = self.layer_param
+        source = MapScale(context=self.context, layer_param=layer_param.source_layer)
+        source_param = source.layer_param
+        factor = round(layer_param.m_per_pixel / source_param.m_per_pixel)
+        assert factor * source_param.m_per_pixel == layer_param.m_per_pixel
+        m_per_tile = int(layer_param.m_per_tile)
+        m_per_source_tile = int(source_param.m_per_tile)
+        assert m_per_tile % m_per_source_tile == 0
+        # The pixels of the finer layer covered by one tile
+        pixel_per_block = factor * layer_param.pixel_per_tile
+
+        with source._open_tiles() as db_source, SqliteTilesPng(
+            filename_sqlite=self.filename_tiles_sqlite,
+            pixel_per_tile=layer_param.pixel_per_tile,
+            create=True,
+            codec=layer_param.codec,
+            progress=self.progress,
+        ) as db_tiles:
+            db_source.connect()
+            db_tiles.resume_or_create_db()
+            if self._is_empty(db_source):
+                # The tiles cache stays empty, see 'create_map()'
+                return
+            self.progress.set_totals(
+                tiles=round(db_source.count() * (m_per_source_tile / m_per_tile) ** 2)
+            )
+            key_range = db_source.key_range()
+            west_m = m_per_tile * (key_range.min_east_m // m_per_tile)
+            east_m = m_per_tile * (key_range.max_east_m // m_per_tile)
+            north_m = m_per_tile * math.ceil(key_range.max_north_m / m_per_tile)
+            south_m = m_per_tile * math.ceil(key_range.min_north_m / m_per_tile)
+
+            for nw_north_m in range(north_m, south_m - m_per_tile, -m_per_tile):
+                checkpoint = f"strip {nw_north_m}"
+                if db_tiles.is_checkpoint(checkpoint):
+                    # Already done by a previous, interrupted run
+                    continue
+                for nw_east_m in range(west_m, east_m + m_per_tile, m_per_tile):
+                    block = np.full(
+                        (pixel_per_block, pixel_per_block, 3), 255, dtype=np.uint8
+                    )
+                    count = 0
+                    for source_east_m, source_north_m, img in db_source.select(
+                        tile_range=TileRange(
+                            min_east_m=nw_east_m,
+                            max_east_m=nw_east_m + m_per_tile - 1,
+                            min_north_m=nw_north_m - m_per_tile + 1,
+                            max_north_m=nw_north_m,
+                        ),
+                        order=ORDER_EAST_NORTH_DESC,
+                    ):
+                        x = int((source_east_m - nw_east_m) / source_param.m_per_pixel)
+                        y = int(
+                            (nw_north_m - source_north_m) / source_param.m_per_pixel
+                        )
+                        size = source_param.pixel_per_tile
+                        block[y : y + size, x : x + size] = np.asarray(
+                            img.convert("RGB")
+                        )
+                        count += 1
+                    if count == 0:
+                        continue
+                    # Box filter: The mean of factor x factor pixels
+                    pixels = block.reshape(
+                        layer_param.pixel_per_tile,
+                        factor,
+                        layer_param.pixel_per_tile,
+                        factor,
+                        3,
+                    ).mean(axis=(1, 3), dtype=np.float32)
+                    img = PIL.Image.fromarray(
+                        np.rint(pixels).astype(np.uint8), mode="RGB"
+                    )
+                    db_tiles.add_subtile(
+                        img=img,
+                        nw_east_m=nw_east_m,
+                        nw_north_m=nw_north_m,
+                        skip_optimize_png=self.context.skip_optimize_png,
+                    )
+                db_tiles.checkpoint(checkpoint)
+
+    def sqlite_retile(self) -> None:
+        """
+        'Context.orux_pixel_per_tile': Cuts the tiles of the map from the tiles
+        cache of 'LayerParams.retiled_from' pixels. The tiles of the map start at
+        the north west corner of the cache. The tiles at the east and south border
+        reach beyond the cache: These pixels are white, as are missing tiles of
+        the cache. A tile is written if it overlaps at least one tile of the cache.
+
+        The tiles are cut in vertical stripes from north to south. Only two rows
+        of decoded tiles of the cache are kept per stripe.
+        """
+        if self.filename_tiles_sqlite.exists():
+            return
+
+        layer_param = self.layer_param
+        source = MapScale(context=self.context, layer_param=layer_param.retiled_source)
+        m_per_tile = int(layer_param.m_per_tile)
+        m_per_source_tile = int(source.layer_param.m_per_tile)
+        assert m_per_tile == layer_param.m_per_tile
+        pixel_per_tile = layer_param.pixel_per_tile
+
+        with source._open_tiles() as db_source, SqliteTilesPng(
+            filename_sqlite=self.filename_tiles_sqlite,
+            pixel_per_tile=pixel_per_tile,
+            create=True,
+            codec=layer_param.codec,
+            progress=self.progress,
+        ) as db_tiles, concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.context.decode_threads
+        ) as executor:
+            db_source.connect()
+            db_tiles.resume_or_create_db()
+            if self._is_empty(db_source):
+                # The tiles cache stays empty, see 'create_map()'
+                return
+            self.progress.set_totals(
+                tiles=round(db_source.count() * (m_per_source_tile / m_per_tile) ** 2)
+            )
+            key_range = db_source.key_range()
+            west_m = key_range.min_east_m
+            north_m = key_range.max_north_m
+            count_x = math.ceil(
+                (key_range.max_east_m + m_per_source_tile - west_m) / m_per_tile
+            )
+            count_y = math.ceil(
+                (north_m - key_range.min_north_m + m_per_source_tile) / m_per_tile
+            )
+
+            for x_stripe in range(0, count_x, self.RETILE_TILES_PER_STRIPE):
+                checkpoint = f"stripe {x_stripe}"
+                if db_tiles.is_checkpoint(checkpoint):
+                    # Already done by a previous, interrupted run
+                    continue
+                tiles_x = range(
+                    x_stripe, min(count_x, x_stripe + self.RETILE_TILES_PER_STRIPE)
+                )
+                stripe_west_m = west_m + tiles_x.start * m_per_tile
+                stripe_east_m = west_m + tiles_x.stop * m_per_tile
+                source_range_east = dict(
+                    min_east_m=west_m
+                    + m_per_source_tile
+                    * ((stripe_west_m - west_m) // m_per_source_tile),
+                    max_east_m=stripe_east_m - 1,
+                )
+                # The decoded tiles of the cache: north -> list of (east, img)
+                source_rows = {}
+                for y in range(count_y):
+                    nw_north_m = north_m - y * m_per_tile
+                    # The norths of the rows of the cache overlapping this row
+                    norths = range(
+                        north_m
+                        - m_per_source_tile
+                        * ((north_m - nw_north_m) // m_per_source_tile),
+                        nw_north_m - m_per_tile,
+                        -m_per_source_tile,
+                    )
+                    for north in list(source_rows):
+                        if north not in norths:
+                            del source_rows[north]
+                    for north in norths:
+                        if north not in source_rows:
+                            source_rows[north] = [
+                                (east, img)
+                                for east, _north, img in db_source.select_prefetch(
+                                    tile_range=TileRange(
+                                        min_north_m=north,
+                                        max_north_m=north,
+                                        **source_range_east,
+                                    ),
+                                    order=ORDER_EAST_NORTH,
+                                    executor=executor,
+                                    depth=2 * self.context.decode_threads,
+                                )
+                            ]
+                    self._retile_row(
+                        db_tiles=db_tiles,
+                        source_rows=source_rows,
+                        m_per_source_tile=m_per_source_tile,
+                        stripe_west_m=stripe_west_m,
+                        nw_north_m=nw_north_m,
+                        count=len(tiles_x),
+                    )
+                db_tiles.checkpoint(checkpoint)
+
+    def _retile_row(  # pylint: disable=too-many-arguments
+        self,
+        db_tiles: SqliteTilesPng,
+        source_rows: dict,
+        m_per_source_tile: int,
+        stripe_west_m: int,
+        nw_north_m: int,
+        count: int,
+    ) -> None:
+        """
+        Writes 'count' tiles of a stripe from the decoded tiles of the cache.
+        """
+        m_per_pixel = self.layer_param.m_per_pixel
+        m_per_tile = int(self.layer_param.m_per_tile)
+        pixel_per_tile = self.layer_param.pixel_per_tile
+        img_row = PIL.Image.new(
+            mode="RGB", size=(count * pixel_per_tile, pixel_per_tile), color="white"
+        )
+        # The tiles of the row overlapping a tile of the cache
+        overlapping = set()
+        for north, row in source_rows.items():
+            for east, img in row:
+                img_row.paste(
+                    im=img.convert("RGB"),
+                    box=(
+                        round((east - stripe_west_m) / m_per_pixel),
+                        round((nw_north_m - north) / m_per_pixel),
+                    ),
+                )
+                first = max(0, (east - stripe_west_m) // m_per_tile)
+                last = min(
+                    count - 1,
+                    (east + m_per_source_tile - 1 - stripe_west_m) // m_per_tile,
+                )
+                overlapping.update(range(first, last + 1))
+
+        for x in sorted(overlapping):
+            box = (x * pixel_per_tile, 0, (x + 1) * pixel_per_tile, pixel_per_tile)
+            db_tiles.add_subtile(
+                img=img_row.crop(box),
+                nw_east_m=stripe_west_m + x * m_per_tile,
+                nw_north_m=nw_north_m,
+                skip_optimize_png=self.context.skip_optimize_png,
+            )
+
+    def _strip_tops(self, boundsCH1903: BoundsCH1903) -> List[int]:
+        """
+        The north of the strips of tiles intersecting the bounds, from north to south.
+        """
+        m_per_tile = int(self.layer_param.m_per_tile)
+        north_m = m_per_tile * math.ceil(boundsCH1903.nw.lat_m / m_per_tile)
+        south_m = m_per_tile * math.floor(boundsCH1903.se.lat_m / m_per_tile)
+        return list(range(north_m, south_m, -m_per_tile))
+
+    def _mosaic_grid(self, sheets: List[TiffSheet]) -> BoundsCH1903:
+        """
+        The tile aligned bounds of all sheets, limited by 'Context.only_boundsCH1903'.
+        """
+        return self._tile_grid(
+            west_m=min(sheet.nw_east_m for sheet in sheets),
+            east_m=max(sheet.se_east_m for sheet in sheets),
+            north_m=max(sheet.nw_north_m for sheet in sheets),
+            south_m=min(sheet.se_north_m for sheet in sheets),
+        )
+
+    def _tile_grid(
+        self, west_m: float, east_m: float, north_m: float, south_m: float
+    ) -> BoundsCH1903:
+        """
+        The tile aligned bounds, limited by 'Context.only_boundsCH1903'.
+        """
+        m_per_tile = int(self.layer_param.m_per_tile)
+        boundsCH1903 = self.context.only_boundsCH1903
+        if boundsCH1903 is not None:
+            west_m = max(west_m, boundsCH1903.nw.lon_m)
+            east_m = min(east_m, boundsCH1903.se.lon_m)
+            north_m = min(north_m, boundsCH1903.nw.lat_m)
+            south_m = max(south_m, boundsCH1903.se.lat_m)
+        return BoundsCH1903(
+            nw=CH1903(
+                lon_m=float(m_per_tile * math.floor(west_m / m_per_tile)),
+                lat_m=float(m_per_tile * math.ceil(north_m / m_per_tile)),
+                valid_data=False,
+            ),
+            se=CH1903(
+                lon_m=float(m_per_tile * math.ceil(east_m / m_per_tile)),
+                lat_m=float(m_per_tile * math.floor(south_m / m_per_tile)),
+                valid_data=False,
+            ),
+            valid_data=False,
+        )
+
+    def _count_tiles_covered(self, sheets: List[TiffSheet], grid: BoundsCH1903) -> int:
+        """
+        An estimate of the tiles of the grid covered by the sheets.
+        Used as total by 'Progress'.
+        """
+        area_m2 = 0.0
+        for sheet in sheets:
+            width_m = min(sheet.se_east_m, grid.se.lon_m) - max(
+                sheet.nw_east_m, grid.nw.lon_m
+            )
+            height_m = min(sheet.nw_north_m, grid.nw.lat_m) - max(
+                sheet.se_north_m, grid.se.lat_m
+            )
+            area_m2 += max(0.0, width_m) * max(0.0, height_m)
+        return round(area_m2 / self.layer_param.m_per_tile ** 2)
+
+    def sqlite_mosaic_tiles(self) -> None:
+        """
+        Engine 'mosaic', replaces the subtiles and tiles stages.
+        Loops over the tiles and reads the windows of the tiffs covering
+        a tile straight into the tile. No subtiles are written.
+        Like the subtiles engine, only tiles completely covered by tiffs are written.
+        'Context.range()' is applied to the tile grid of the layer and not per tiff.
+        """
+        if self.filename_tiles_sqlite.exists():
+            return
+
+        layer_param = self.layer_param
+        m_per_tile = int(layer_param.m_per_tile)
+        coverage = CoverageReport(layer_name=layer_param.name, m_per_tile=m_per_tile)
+
+        with SqliteTilesPng(
+            filename_sqlite=self.filename_tiles_sqlite,
+            pixel_per_tile=layer_param.pixel_per_tile,
+            create=True,
+            codec=layer_param.codec,
+            progress=self.progress,
+        ) as db_tiles, TiffCatalog() as catalog:
+            db_tiles.resume_or_create_db()
+            # The sheets done by a previous, interrupted run
+            sheets_done = []
+
+            def is_done(name: str) -> bool:
+                # All strips of the tiff have been done by a previous, interrupted run
+                sheet = catalog.lookup(layer=layer_param.name, name=name)
+                if sheet is None:
+                    return False
+                done = all(
+                    db_tiles.is_checkpoint(f"strip {top_nw_north_m}")
+                    for top_nw_north_m in self._strip_tops(
+                        sheet.boundsCH1903(valid_data=False)
+                    )
+                )
+                if done:
+                    sheets_done.append(sheet)
+                return done
+
+            # The tiffs to be read have to be on disk
+            sheets = [
+                catalog.get(layer=layer_param.name, url=url, filename=filename)
+                for url, filename in self.tiffs.iter_tiffs(
+                    catalog=catalog, is_done=is_done
+                )
+            ]
+            if len(sheets) + len(sheets_done) == 0:
+                return
+            for sheet in sheets:
+                layer_param.verify_m_per_pixel(sheet.m_per_pixel)
+            names = set(sheet.name for sheet in sheets)
+
+            # The grid of all sheets: 'Context.range()' selects the same
+            # tiles as in the interrupted run
+            grid = self._mosaic_grid(sheets=sheets + sheets_done)
+            count_x = round(grid.lon_m / m_per_tile)
+            count_y = round(grid.lat_m / m_per_tile)
+            selected_x = set(self.context.range(count_x))
+            selected_y = set(self.context.range(count_y))
+            self.progress.set_totals(
+                tiles=round(
+                    self._count_tiles_covered(sheets=sheets + sheets_done, grid=grid)
+                    * len(selected_x)
+                    * len(selected_y)
+                    / (count_x * count_y)
+                ),
+            )
+
+            for y in sorted(selected_y):
+                top_nw_north_m = int(grid.nw.lat_m) - y * m_per_tile
+                checkpoint = f"strip {top_nw_north_m}"
+                if db_tiles.is_checkpoint(checkpoint):
+                    # Already done by a previous, interrupted run
+                    continue
+                for x_block in range(0, count_x, self.MOSAIC_TILES_PER_BLOCK):
+                    tiles_x = [
+                        x - x_block
+                        for x in range(x_block, x_block + self.MOSAIC_TILES_PER_BLOCK)
+                        if x in selected_x
+                    ]
+                    if len(tiles_x) == 0:
+                        continue
+                    self._mosaic_block(
+                        db_tiles=db_tiles,
+                        catalog=catalog,
+                        coverage=coverage,
+                        names=names,
+                        west_m=int(grid.nw.lon_m) + x_block * m_per_tile,
+                        top_nw_north_m=top_nw_north_m,
+                        tiles_x=tiles_x,
+                    )
+                db_tiles.checkpoint(checkpoint)
+                if self.context.save_diskspace:
+                    # The strips are done from north to south
+                    for sheet in sheets:
+                        if sheet.se_north_m >= top_nw_north_m - m_per_tile:
+                            self.remove_tiff(sheet.filename)
+
+        self.write_coverage(
+            coverage=coverage,
+            processed=names | set(sheet.name for sheet in sheets_done),
+        )
+        self.enforce_diskspace_quota()
+
+    def _mosaic_block(  # pylint: disable=too-many-arguments,too-many-locals
+        self,
+        db_tiles: SqliteTilesPng,
+        catalog: TiffCatalog,
+        coverage: CoverageReport,
+        names: set,
+        west_m: int,
+        top_nw_north_m: int,
+        tiles_x: List[int],
+    ) -> None:
+        """
+        Assembles some neighbouring tiles of a strip.
+        'tiles_x' are the tiles to be written, 0 is the tile at 'west_m'.
+        """
+        layer_param = self.layer_param
+        m_per_pixel = layer_param.m_per_pixel
+        m_per_tile = int(layer_param.m_per_tile)
+        pixel_per_tile = layer_param.pixel_per_tile
+        count = tiles_x[-1] + 1
+        east_m = west_m + count * m_per_tile
+        south_m = top_nw_north_m - m_per_tile
+        block = BoundsCH1903(
+            nw=CH1903(
+                lon_m=float(west_m), lat_m=float(top_nw_north_m), valid_data=False
+            ),
+            se=CH1903(lon_m=float(east_m), lat_m=float(south_m), valid_data=False),
+            valid_data=False,
+        )
+
+        size = (count * pixel_per_tile, pixel_per_tile)
+        img_block = PIL.Image.new(mode="RGB", size=size, color=0)
+        # 255: The pixel is covered by a tiff
+        mask_block = PIL.Image.new(mode="L", size=size, color=0)
+        for sheet in catalog.select_intersecting(
+            layer=layer_param.name, boundsCH1903=block
+        ):
+            if sheet.name not in names:
+                continue
+            w_m = max(west_m, sheet.nw_east_m)
+            e_m = min(east_m, sheet.se_east_m)
+            n_m = min(top_nw_north_m, sheet.nw_north_m)
+            s_m = max(south_m, sheet.se_north_m)
+            window = rasterio.windows.Window(
+                col_off=round((w_m - sheet.nw_east_m) / m_per_pixel),
+                row_off=round((sheet.nw_north_m - n_m) / m_per_pixel),
+                width=round((e_m - w_m) / m_per_pixel),
+                height=round((n_m - s_m) / m_per_pixel),
+            )
+            x_pixel = round((w_m - west_m) / m_per_pixel)
+            y_pixel = round((top_nw_north_m - n_m) / m_per_pixel)
+            if not self.context.skip_tiff_read:
+                with rasterio.open(sheet.filename, "r") as dataset:
+                    img = read_window(dataset=dataset, window=window)
+                img_block.paste(im=img, box=(x_pixel, y_pixel))
+            mask_block.paste(
+                255,
+                box=(x_pixel, y_pixel, x_pixel + window.width, y_pixel + window.height),
+            )
+
+        for x in tiles_x:
+            box = (x * pixel_per_tile, 0, (x + 1) * pixel_per_tile, pixel_per_tile)
+            nw_east_m = west_m + x * m_per_tile
+            mask_tile = mask_block.crop(box)
+            if mask_tile.getextrema()[0] < 255:
+                # Not completely covered by tiffs
+                covered = np.asarray(mask_tile).mean() / 255.0
+                if covered > 0.0:
+                    coverage.drop(
+                        nw_east_m=nw_east_m,
+                        nw_north_m=top_nw_north_m,
+                        coverage=covered,
+                    )
+                continue
+            if self.context.skip_tiff_read or self.context.skip_png_write:
+                db_tiles.add_placeholder(nw_east_m=nw_east_m, nw_north_m=top_nw_north_m)
+                continue
+            db_tiles.add_subtile(
+                img=img_block.crop(box),
+                nw_east_m=nw_east_m,
+                nw_north_m=top_nw_north_m,
+                skip_optimize_png=self.context.skip_optimize_png,
+            )
+
+    def sqlite_wmts_tiles(self) -> None:
+        """
+        Engine 'wmts', replaces the subtiles and tiles stages.
+        Fetches only the WMTS tiles covering 'Context.only_boundsCH1903'
+        and assembles them into the tile grid of the layer. No tiff is read.
+        The WMTS tiles of a block are fetched concurrently, see 'wmts.py'.
+        Like the mosaic engine, only tiles completely covered are written.
+        """
+        if self.filename_tiles_sqlite.exists():
+            return
+
+        layer_param = self.layer_param
+        boundsCH1903 = self.context.only_boundsCH1903
+        assert boundsCH1903 is not None, "Engine 'wmts' requires 'only_boundsCH1903'"
+        assert layer_param.wmts_layer is not None, f"{layer_param.name}: No WMTS layer"
+        m_per_tile = int(layer_param.m_per_tile)
+        pixel_per_tile = layer_param.pixel_per_tile
+        zoom = select_zoom(layer_param.m_per_pixel)
+        coverage = CoverageReport(layer_name=layer_param.name, m_per_tile=m_per_tile)
+
+        grid = self._tile_grid(
+            west_m=boundsCH1903.nw.lon_m,
+            east_m=boundsCH1903.se.lon_m,
+            north_m=boundsCH1903.nw.lat_m,
+            south_m=boundsCH1903.se.lat_m,
+        )
+        count_x = round(grid.lon_m / m_per_tile)
+        count_y = round(grid.lat_m / m_per_tile)
+        selected_x = set(self.context.range(count_x))
+        selected_y = set(self.context.range(count_y))
+
+        with SqliteTilesPng(
+            filename_sqlite=self.filename_tiles_sqlite,
+            pixel_per_tile=pixel_per_tile,
+            create=True,
+            codec=layer_param.codec,
+            progress=self.progress,
+        ) as db_tiles, WmtsClient(
+            layer=layer_param.wmts_layer,
+            url=self.context.wmts_url or WMTS_URL,
+            max_connections=self.context.wmts_max_connections,
+            requests_per_s=self.context.wmts_requests_per_s,
+        ) as client:
+            db_tiles.resume_or_create_db()
+            self.progress.set_totals(tiles=len(selected_x) * len(selected_y))
+
+            for y in sorted(selected_y):
+                top_nw_north_m = int(grid.nw.lat_m) - y * m_per_tile
+                checkpoint = f"strip {top_nw_north_m}"
+                if db_tiles.is_checkpoint(checkpoint):
+                    # Already done by a previous, interrupted run
+                    continue
+                for x_block in range(0, count_x, self.MOSAIC_TILES_PER_BLOCK):
+                    tiles_x = [
+                        x - x_block
+                        for x in range(x_block, x_block + self.MOSAIC_TILES_PER_BLOCK)
+                        if x in selected_x
+                    ]
+                    if len(tiles_x) == 0:
+                        continue
+                    self._wmts_block(
+                        db_tiles=db_tiles,
+                        client=client,
+                        coverage=coverage,
+                        zoom=zoom,
+                        west_m=int(grid.nw.lon_m) + x_block * m_per_tile,
+                        top_nw_north_m=top_nw_north_m,
+                        tiles_x=tiles_x,
+                    )
+                db_tiles.checkpoint(checkpoint)
+            print(
+                f"WMTS {layer_param.wmts_layer} zoom {zoom}: {client.count_requests} requests, {client.count_cached} cached, {client.bytes_downloaded/MBYTE:0.1f} MBytes"
+            )
+
+        self.write_coverage(coverage=coverage, processed=[], sheets=[])
+        self.enforce_diskspace_quota()
+
+    def _wmts_block(  # pylint: disable=too-many-arguments
+        self,
+        db_tiles: SqliteTilesPng,
+        client: WmtsClient,
+        coverage: CoverageReport,
+        zoom: int,
+        west_m: int,
+        top_nw_north_m: int,
+        tiles_x: List[int],
+    ) -> None:
+        """
+        Like '_mosaic_block()', but the block is assembled from WMTS tiles.
+        """
+        pixel_per_tile = self.layer_param.pixel_per_tile
+        m_per_tile = int(self.layer_param.m_per_tile)
+        img_block, mask_block = client.mosaic(
+            zoom=zoom,
+            west_m=west_m,
+            north_m=top_nw_north_m,
+            east_m=west_m + (tiles_x[-1] + 1) * m_per_tile,
+            south_m=top_nw_north_m - m_per_tile,
+        )
+        # The pixels of a tile at the resolution of the WMTS
+        pixel_per_wmts = img_block.height
+        for x in tiles_x:
+            box = (x * pixel_per_wmts, 0, (x + 1) * pixel_per_wmts, pixel_per_wmts)
+            nw_east_m = west_m + x * m_per_tile
+            mask_tile = mask_block.crop(box)
+            if mask_tile.getextrema()[0] < 255:
+                # Not completely covered by WMTS tiles
+                covered = np.asarray(mask_tile).mean() / 255.0
+                if covered > 0.0:
+                    coverage.drop(
+                        nw_east_m=nw_east_m,
+                        nw_north_m=top_nw_north_m,
+                        coverage=covered,
+                    )
+                continue
+            if self.context.skip_png_write:
+                db_tiles.add_placeholder(nw_east_m=nw_east_m, nw_north_m=top_nw_north_m)
+                continue
+            img = img_block.crop(box)
+            if pixel_per_wmts != pixel_per_tile:
+                # For example 1:25'000: 1.25 m_per_pixel from the 1.0 zoom
+                img = img.resize(
+                    (pixel_per_tile, pixel_per_tile),
+                    resample=PIL.Image.Resampling.LANCZOS,
+                )
+            db_tiles.add_subtile(
+                img=img,
+                nw_east_m=nw_east_m,
+                nw_north_m=top_nw_north_m,
+                skip_optimize_png=self.context.skip_optimize_png,
+            )
+
+    def unittest_dump(  # pylint: disable=too-many-arguments
+        self,
+        subtiles: Subtiles,
+        img=PIL.Image.Image,
+    ) -> None:
+        for probe_layer, probe_nw_east_m, probe_nw_north_m in (
+            ("0100", 2690000, 1250000),  # Does never trigger...
+            ("0100", 2690000, 1245000),
+            ("0100", 2690000, 1215000),
+        ):
+            if (
+                probe_nw_east_m == subtiles.nw_east_m
+                and probe_nw_north_m == subtiles.nw_north_m
+                and probe_layer == self.layer_param.name
+            ):
+                filename = (
+                    DIRECTORY_TESTRESULTS
+                    / f"{self.layer_param.name}-tiles-{subtiles.nw_east_m}_{subtiles.nw_north_m}.txt"
+                )
+
+                with filename.open("w") as f:
+                    f.write(f"  nw_east_m={subtiles.nw_east_m}\n")
+                    f.write(f"  nw_north_m={subtiles.nw_north_m}\n")
+                img.save(filename.with_suffix(".png"))
+
+    def _open_tiles(self) -> SqliteTilesPng:
+        return SqliteTilesPng(
+            filename_sqlite=self.filename_tiles_sqlite,
+            pixel_per_tile=self.layer_param.pixel_per_tile,
+            codec=self.layer_param.codec,
+        )
+
+    def _write_layer_xml(
+        self, xml_otrk2: OruxXmlOtrk2, map_name: str, db_tiles: SqliteTilesPng
+    ) -> TileRange:
+        """
+        Returns the range of the tiles: Its north west corner is the tile x=0/y=0.
+        """
+        layer_param = self.layer_param
+        m_per_tile = int(layer_param.m_per_tile)
+
+        key_range = db_tiles.key_range()
+        min_nw_east_m = key_range.min_east_m
+        max_nw_north_m = key_range.max_north_m
+
+        max_se_east_m = key_range.max_east_m + m_per_tile
+        min_se_north_m = key_range.min_north_m - m_per_tile
+
+        assert (max_se_east_m - min_nw_east_m) % m_per_tile == 0
+        assert (max_nw_north_m - min_se_north_m) % m_per_tile == 0
+
+        nw = CH1903(lon_m=float(min_nw_east_m), lat_m=float(max_nw_north_m))
+        se = CH1903(lon_m=float(max_se_east_m), lat_m=float(min_se_north_m))
+        boundsCH1903_extrema = BoundsCH1903(nw=nw, se=se, valid_data=True)
+
+        boundsCH1903_extrema.assertIsNorthWest()
+
+        boundsWGS84 = boundsCH1903_extrema.to_WGS84(
+            valid_data=self.layer_param.valid_data
+        )
+
+        width_pixel = int(boundsCH1903_extrema.lon_m / self.layer_param.m_per_pixel)
+        height_pixel = int(boundsCH1903_extrema.lat_m / self.layer_param.m_per_pixel)
+        assert width_pixel % self.layer_param.pixel_per_tile == 0
+        assert height_pixel % self.layer_param.pixel_per_tile == 0
+
+        xml_otrk2.write_layer(
+            calib=boundsWGS84,
+            TILE_SIZE=self.layer_param.pixel_per_tile,
+            map_name=map_name,
+            id=self.layer_param.orux_layer,
+            xMax=width_pixel // self.layer_param.pixel_per_tile,
+            yMax=height_pixel // self.layer_param.pixel_per_tile,
+            height=height_pixel,
+            width=width_pixel,
+            minLat=boundsWGS84.southEast.lat_deg,
+            maxLat=boundsWGS84.northWest.lat_deg,
+            minLon=boundsWGS84.northWest.lon_deg,
+            maxLon=boundsWGS84.southEast.lon_deg,
+        )
+
+        if self.context.only_tiles_border or self.context.only_tiles_modulo:
+            count_tiles = db_tiles.count()
+            count_grid = (width_pixel // self.layer_param.pixel_per_tile) * (
+                height_pixel // self.layer_param.pixel_per_tile
+            )
+            print(
+                f"{layer_param.name}: subset of {count_tiles} tiles within a grid of {count_grid} tiles"
+            )
+
+        return key_range
+
+    def _insert_tiles(
+        self,
+        db_orux: SqliteOrux,
+        db_tiles: SqliteTilesPng,
+        key_range: TileRange,
+        tile_range: TileRange,
+    ) -> None:
+        layer_param = self.layer_param
+        m_per_tile = int(layer_param.m_per_tile)
+        assert m_per_tile == layer_param.m_per_tile
+        # The tile bytes are not copied into python objects
+        if isinstance(db_tiles.storage, SqliteTileStorage):
+            db_orux.insert_attached(
+                filename_tiles=self.filename_tiles_sqlite,
+                tile_range=tile_range,
+                orux_layer=layer_param.orux_layer,
+                nw_east_m=key_range.min_east_m,
+                nw_north_m=key_range.max_north_m,
+                m_per_tile=m_per_tile,
+            )
+            return
+        db_orux.insert_rows(
+            rows=db_tiles.select(
+                tile_range=tile_range, order=ORDER_EAST_NORTH_DESC, raw=True
+            ),
+            orux_layer=layer_param.orux_layer,
+            nw_east_m=key_range.min_east_m,
+            nw_north_m=key_range.max_north_m,
+            m_per_tile=m_per_tile,
+        )
+
+    def _is_empty(self, db_tiles: SqliteTilesPng) -> bool:
+        """
+        A tiles cache is empty if the region of interest does not
+        intersect the tiffs of the layer.
+        """
+        if db_tiles.count() > 0:
+            return False
+        print(f"{db_tiles.filename_sqlite.relative_to(DIRECTORY_BASE)}: No tiles")
+        return True
+
+    def create_map(self, orux_maps: OruxMap) -> None:
+        with self._open_tiles() as db_tiles:
+            db_tiles.connect()
+            if self._is_empty(db_tiles):
+                # The layer is left out of the map
+                return
+            key_range = self._write_layer_xml(
+                xml_otrk2=orux_maps.xml_otrk2,
+                map_name=orux_maps.map_name,
+                db_tiles=db_tiles,
+            )
+            self._insert_tiles(
+                db_orux=orux_maps.db,
+                db_tiles=db_tiles,
+                key_range=key_range,
+                tile_range=TILE_RANGE_ALL,
+            )
+
+    def filename_partial_map(self, directory: pathlib.Path, shard: int) -> pathlib.Path:
+        return directory / f"{self.layer_param.name}_{shard}.db"
+
+    def create_partial_map(self, directory: pathlib.Path, shard: int) -> None:
+        """
+        'Context.partial_orux_dbs': Runs in a worker process and writes the tiles
+        of a shard into its own orux db. A shard are neighbouring columns of tiles.
+        """
+        layer_param = self.layer_param
+        m_per_tile = int(layer_param.m_per_tile)
+        with self._open_tiles() as db_tiles:
+            db_tiles.connect()
+            if self._is_empty(db_tiles):
+                # No partial orux db is written, see 'merge_map()'
+                return
+            key_range = db_tiles.key_range()
+            count_x = (key_range.max_east_m - key_range.min_east_m) // m_per_tile + 1
+            columns = math.ceil(count_x / layer_param.orux_shards)
+            min_east_m = key_range.min_east_m + shard * columns * m_per_tile
+            tile_range = TileRange(
+                min_east_m=min_east_m,
+                max_east_m=min_east_m + (columns - 1) * m_per_tile,
+            )
+            db_orux = SqliteOrux(
+                filename_sqlite=self.filename_partial_map(directory, shard)
+            )
+            self._insert_tiles(
+                db_orux=db_orux,
+                db_tiles=db_tiles,
+                key_range=key_range,
+                tile_range=tile_range,
+            )
+            db_orux.commit()
+            db_orux.close()
+
+    def merge_map(self, orux_maps: OruxMap) -> None:
+        """
+        'Context.partial_orux_dbs': Merges the partial orux dbs written by
+        'create_partial_map()' into 'OruxMapsImages.db'.
+        """
+        with self._open_tiles() as db_tiles:
+            db_tiles.connect()
+            if self._is_empty(db_tiles):
+                return
+            self._write_layer_xml(
+                xml_otrk2=orux_maps.xml_otrk2,
+                map_name=orux_maps.map_name,
+                db_tiles=db_tiles,
+            )
+        for shard in range(self.layer_param.orux_shards):
+            filename = self.filename_partial_map(orux_maps.directory_partial, shard)
+            orux_maps.db.insert_partial(filename_partial=filename)
+            filename.unlink()
+
+
+@dataclass
+class TiffImageAttributes:
+    filename: pathlib.Path
+    m_per_pixel: float
+    layer_param: LayerParams
+    boundsCH1903: BoundsCH1903
+    boundsCH1903_floor: BoundsCH1903
+    width_pixel: int
+    height_pixel: int
+    bands: int
+
+    def decoded_bytes(self, window: rasterio.windows.Window) -> int:
+        """
+        Estimated memory used by '_load_image()':
+        The raster as read by rasterio plus the RGB image.
+        """
+        return window.width * window.height * (self.bands + 3)
+
+    @property
+    def window_full(self) -> rasterio.windows.Window:
+        return rasterio.windows.Window(
+            col_off=0, row_off=0, width=self.width_pixel, height=self.height_pixel
+        )
+
+    def window(self, boundsCH1903: BoundsCH1903) -> rasterio.windows.Window:
+        """
+        The pixels of all tiles which intersect 'boundsCH1903'.
+        The window is aligned to the subtiles of the full image.
+        Returns None if the image does not intersect.
+        """
+        if boundsCH1903 is None:
+            return self.window_full
+        m_per_tile = self.layer_param.m_per_tile
+        m_per_subtile = PIXEL_PER_SUBTILE * self.m_per_pixel
+        west_m = m_per_tile * math.floor(boundsCH1903.nw.lon_m / m_per_tile)
+        east_m = m_per_tile * math.ceil(boundsCH1903.se.lon_m / m_per_tile)
+        north_m = m_per_tile * math.ceil(boundsCH1903.nw.lat_m / m_per_tile)
+        south_m = m_per_tile * math.floor(boundsCH1903.se.lat_m / m_per_tile)
+
+        nw = self.boundsCH1903.nw
+        col_start = math.floor((west_m - nw.lon_m) / m_per_subtile)
+        col_stop = math.ceil((east_m - nw.lon_m) / m_per_subtile)
+        row_start = math.floor((nw.lat_m - north_m) / m_per_subtile)
+        row_stop = math.ceil((nw.lat_m - south_m) / m_per_subtile)
+
+        col_start = max(0, PIXEL_PER_SUBTILE * col_start)
+        col_stop = min(self.width_pixel, PIXEL_PER_SUBTILE * col_stop)
+        row_start = max(0, PIXEL_PER_SUBTILE * row_start)
+        row_stop = min(self.height_pixel, PIXEL_PER_SUBTILE * row_stop)
+        if (col_start >= col_stop) or (row_start >= row_stop):
+            return None
+        return rasterio.windows.Window(
+            col_off=col_start,
+            row_off=row_start,
+            width=col_stop - col_start,
+            height=row_stop - row_start,
+        )
+
+    @staticmethod
+    def create(sheet: TiffSheet, layer_param: LayerParams):
+        assert isinstance(sheet, TiffSheet)
+        assert isinstance(layer_param, LayerParams)
+
+        filename = sheet.filename
+        pixel_lon = sheet.width_pixel
+        pixel_lat = sheet.height_pixel
+
+        if (pixel_lon % PIXEL_PER_SUBTILE != 0) or (
+            pixel_lat % PIXEL_PER_SUBTILE != 0
+        ):
+            print(
+                f"{filename.relative_to(DIRECTORY_BASE)}: size={pixel_lon}/{pixel_lat} does not fit in PIXEL_PER_SUBTILE={PIXEL_PER_SUBTILE}"
+            )
+
+        m_per_pixel = sheet.m_per_pixel
+        boundsCH1903 = sheet.boundsCH1903(valid_data=layer_param.valid_data)
+        boundsCH1903.assertIsNorthWest()
+        boundsCH1903_floor = boundsCH1903.floor(
+            floor_m=layer_param.m_per_tile, valid_data=layer_param.valid_data
+        )
+        boundsCH1903_floor.assertIsNorthWest()
+        if not boundsCH1903.equals(boundsCH1903_floor):
+            print(f"{filename.relative_to(DIRECTORY_BASE)}: cropped")
+
+        layer_param.verify_m_per_pixel(m_per_pixel)
+        projection.assertSwissgridIsNorthWest(boundsCH1903)
+        return TiffImageAttributes(
+            filename=filename,
+            m_per_pixel=m_per_pixel,
+            layer_param=layer_param,
+            boundsCH1903=boundsCH1903,
+            boundsCH1903_floor=boundsCH1903_floor,
+            width_pixel=pixel_lon,
+            height_pixel=pixel_lat,
+            bands=sheet.bands,
+        )
+
+    def unittest_dump(self):
+        if self.filename.name in ("swiss-map-raster100_2013_33_komb_5_2056.tif",):
+            filename_unittest = (
+                DIRECTORY_TESTRESULTS
+                / f"{self.layer_param.name}-{self.filename.stem}.txt"
+            )
+            with filename_unittest.open("w") as f:
+                f.write(f"{self.filename.relative_to(DIRECTORY_BASE)}\n")
+                f.write(f"  boundsCH1903.nw.lon_m={self.boundsCH1903.nw.lon_m}\n")
+                f.write(f"  boundsCH1903.nw.lat_m={self.boundsCH1903.nw.lat_m}\n")
+                f.write(f"  boundsCH1903.se.lon_m={self.boundsCH1903.se.lon_m}\n")
+                f.write(f"  boundsCH1903.se.lat_m={self.boundsCH1903.se.lat_m}\n")
+                f.write(f"  scale={self.layer_param.scale}\n")
+                f.write(f"  m_per_pixel={self.layer_param.m_per_pixel}\n")
+                f.write(f"  m_per_tile={self.layer_param.m_per_tile}\n")
+                f.write(
+                    f"  m_per_subtile={PIXEL_PER_SUBTILE*self.layer_param.m_per_pixel}\n"
+                )
+                f.write(f"  pixel_per_tile={self.layer_param.pixel_per_tile}\n")
+                f.write(f"  pixel_per_subtile={PIXEL_PER_SUBTILE}\n")
+                f.write(f"  scale={self.layer_param.scale}\n")
+
+
+def read_window(dataset, window: rasterio.windows.Window) -> PIL.Image.Image:
+    """
+    Reads the pixels within 'window' of a rasterio dataset as RGB image.
+    Like 'PIL.Image.convert("RGB")', grey is replicated and alpha is dropped.
+    """
+    if dataset.colorinterp[0] == ColorInterp.palette:
+        # Indexed colors
+        data = dataset.read(1, window=window)
+        img = PIL.Image.fromarray(data, mode="P")
+        colormap = dataset.colormap(1)
+        palette = []
+        for i in range(256):
+            palette.extend(colormap.get(i, (0, 0, 0, 255))[:3])
+        img.putpalette(palette)
+        return img.convert("RGB")
+
+    if len(dataset.indexes) < 3:
+        # Grey, possibly with alpha
+        data = dataset.read(1, window=window)
+        return PIL.Image.fromarray(data, mode="L").convert("RGB")
+
+    # RGB, possibly with alpha
+    data = dataset.read((1, 2, 3), window=window)
+    img_arr = rasterio.plot.reshape_as_image(data)
+    return PIL.Image.fromarray(img_arr, mode="RGB")
+
+
+class TiffImageConverter:
+    def __init__(self, context, tiff_attrs):
+        assert isinstance(context, Context)
+        assert isinstance(tiff_attrs, TiffImageAttributes)
+        self.context = context
+        self.tiff_attrs = tiff_attrs
+        self.layer_param = tiff_attrs.layer_param
+        self.filename = tiff_attrs.filename
+        self.boundsCH1903 = tiff_attrs.boundsCH1903
+        self.boundsCH1903_floor = tiff_attrs.boundsCH1903_floor
+        self.window = tiff_attrs.window(context.only_boundsCH1903)
+        self.debug_pngs = []
+
+    def _load_image(self):
+        with rasterio.open(self.filename, "r") as dataset:
+            if self.window != self.tiff_attrs.window_full:
+                return self._load_image_window(dataset=dataset)
+            if len(dataset.indexes) == 3:
+                # https://rasterio.readthedocs.io/en/latest/topics/image_processing.html
+                # rasterio: (bands, rows, columns)
+                # PIL: rows, columns, bands)
+                data = dataset.read()
+                img_arr = rasterio.plot.reshape_as_image(data)
+                img = PIL.Image.fromarray(img_arr, mode="RGB")
+                del data
+                del img_arr
+                assert dataset.width == img.width
+                assert dataset.height == img.height
+            else:
+                img = PIL.Image.open(self.filename, mode="r")
+                img = img.convert("RGB")
+            return img
+
+    def _load_image_window(self, dataset) -> PIL.Image.Image:
+        """
+        Only the pixels within 'self.window' are read.
+        """
+        return read_window(dataset=dataset, window=self.window)
+
+    def create_subtiles(self, db: SqliteTilesRaw) -> None:
+        if self.window is None:
+            return
+        if self.context.skip_tiff_read:
+            self._add_subtiles(db=db, img=None)
+            return
+        if self.context.sheet_workers > 1:
+            self._create_subtiles_parallel(db=db)
+            return
+        self._create_subtiles_window(db=db)
+
+    def _iter_band_windows(self, count: int) -> Iterable[rasterio.windows.Window]:
+        """
+        Splits 'self.window' into horizontal bands.
+        The height of a band is a multiple of a subtile.
+        """
+        height = int(self.window.height)
+        rows_per_band = PIXEL_PER_SUBTILE * max(
+            1, math.ceil(height / PIXEL_PER_SUBTILE / count)
+        )
+        for row in range(0, height, rows_per_band):
+            yield rasterio.windows.Window(
+                col_off=self.window.col_off,
+                row_off=self.window.row_off + row,
+                width=self.window.width,
+                height=min(rows_per_band, height - row),
+            )
+
+    def _create_subtiles_parallel(self, db: SqliteTilesRaw) -> None:
+        """
+        The bands are read, cropped and encoded by threads: This already runs
+        in a process of the DagScheduler. rasterio and the codecs release the GIL.
+        The encoded subtiles are inserted by this thread: sqlite has one writer.
+        More bands than workers: the last band does not delay the sheet.
+        """
+        bands = list(self._iter_band_windows(count=4 * self.context.sheet_workers))
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.context.sheet_workers,
+        ) as executor:
+            futures = [
+                executor.submit(
+                    create_subtiles_band,
+                    self.context,
+                    self.tiff_attrs,
+                    band,
+                    db.codec,
+                )
+                for band in bands
+            ]
+            for future in futures:
+                future.result().flush(db=db)
+
+    def _create_subtiles_window(self, db) -> None:
+        with memory_budget().admit(
+            name=self.filename.name,
+            nbytes=self.tiff_attrs.decoded_bytes(window=self.window),
+        ):
+            with self._load_image() as img:
+                if (img.width % PIXEL_PER_SUBTILE != 0) or (
+                    img.height % PIXEL_PER_SUBTILE != 0
+                ):
+                    print(
+                        f"{self.filename.relative_to(DIRECTORY_BASE)}: WARNING: Strange image size {img.width}/{img.height}"
+                    )
+                self._add_subtiles(db=db, img=img)
+
+    def _selected_tiles(self, count: int, offset_m: float) -> set:
+        """
+        The tiles selected by 'Context.range()' along one axis of the image.
+        The index 0 is the first tile of the tile grid touching the image.
+        """
+        m_per_tile = self.layer_param.m_per_tile
+        count_pixel_m = count * self.layer_param.m_per_pixel
+        count_tiles = math.ceil((offset_m + count_pixel_m) / m_per_tile)
+        return set(self.context.range(count_tiles))
+
+    def _add_subtiles(self, db: SqliteTilesRaw, img: PIL.Image.Image) -> None:
+        """
+        img is None: 'Context.skip_tiff_read'
+        Only the subtiles of the tiles selected by 'Context.range()' are added.
+        """
+        m_per_pixel = self.layer_param.m_per_pixel
+        m_per_tile = self.layer_param.m_per_tile
+        lon_m = int(self.tiff_attrs.boundsCH1903.nw.lon_m)
+        lat_m = int(self.tiff_attrs.boundsCH1903.nw.lat_m)
+        # The pixel offset of the window within the full image
+        col_off = int(self.window.col_off)
+        row_off = int(self.window.row_off)
+        # The offset of the image within the tile grid
+        offset_east_m = lon_m % m_per_tile
+        offset_north_m = (-lat_m) % m_per_tile
+        selected_x = self._selected_tiles(
+            count=self.tiff_attrs.width_pixel, offset_m=offset_east_m
+        )
+        selected_y = self._selected_tiles(
+            count=self.tiff_attrs.height_pixel, offset_m=offset_north_m
+        )
+        # print(f"{self.filename.name}: {lon_m}/{lat_m}")
+        for x_pixel in range(0, int(self.window.width), PIXEL_PER_SUBTILE):
+            offset_x_m = m_per_pixel * (col_off + x_pixel)
+            if int((offset_east_m + offset_x_m) // m_per_tile) not in selected_x:
+                continue
+            nw_east_m = int(offset_x_m) + lon_m
+            for y_pixel in range(0, int(self.window.height), PIXEL_PER_SUBTILE):
+                offset_y_m = m_per_pixel * (row_off + y_pixel)
+                if int((offset_north_m + offset_y_m) // m_per_tile) not in selected_y:
+                    continue
+                nw_north_m = lat_m - int(offset_y_m)
+                if img is None:
+                    db.add_placeholder(nw_east_m=nw_east_m, nw_north_m=nw_north_m)
+                    continue
+                img_subtile = img.crop(
+                    (
+                        x_pixel,
+                        y_pixel,
+                        x_pixel + PIXEL_PER_SUBTILE,
+                        y_pixel + PIXEL_PER_SUBTILE,
+                    )
+                )
+                self.unittest_dump(
+                    x_pixel=col_off + x_pixel,
+                    y_pixel=row_off + y_pixel,
+                    nw_east_m=nw_east_m,
+                    nw_north_m=nw_north_m,
+                    img=img_subtile,
+                )
+                if self.context.skip_png_write:
+                    db.add_placeholder(nw_east_m=nw_east_m, nw_north_m=nw_north_m)
+                    continue
+                db.add_subtile(
+                    img=img_subtile, nw_east_m=nw_east_m, nw_north_m=nw_north_m
+                )
+
+    def unittest_dump(  # pylint: disable=too-many-arguments
+        self,
+        x_pixel: int,
+        y_pixel: int,
+        nw_east_m: int,
+        nw_north_m: int,
+        img=PIL.Image.Image,
+    ) -> None:
+        for probe_filename, probe_x_pixel, probe_y_pixel in (
+            ("swiss-map-raster100_2013_33_komb_5_2056.tif", 0, 0),
+            (
+                "swiss-map-raster100_2013_33_komb_5_2056.tif",
+                PIXEL_PER_SUBTILE,
+                0,
+            ),
+            (
+                "swiss-map-raster100_2013_33_komb_5_2056.tif",
+                0,
+                PIXEL_PER_SUBTILE,
+            ),
+        ):
+            if (
+                probe_x_pixel == x_pixel
+                and probe_y_pixel == y_pixel
+                and probe_filename == self.filename.name
+            ):
+                filename = (
+                    DIRECTORY_TESTRESULTS
+                    / f"{self.layer_param.name}-subtiles-{self.filename.stem}_{x_pixel}_{y_pixel}.txt"
+                )
+
+                with filename.open("w") as f:
+                    f.write(f"{self.filename}\n")
+                    f.write(f"  x_pixel={x_pixel}\n")
+                    f.write(f"  y_pixel={y_pixel}\n")
+                    f.write(f"  nw_east_m={nw_east_m}\n")
+                    f.write(f"  nw_north_m={nw_north_m}\n")
+                img.save(filename.with_suffix(".png"))
+
+
+class SubtilesBuffer:
+    """
+    Collects the subtiles of a band, encoded with the codec of the subtiles db.
+    Implements the methods of 'SqliteTilesRaw' used by 'TiffImageConverter'.
+    """
+
+    def __init__(self, codec: TileCodec):
+        self.codec = codec
+        self.rows = []
+
+    def add_subtile(self, img: PIL.Image.Image, nw_east_m: int, nw_north_m: int):
+        assert img.width == PIXEL_PER_SUBTILE
+        assert img.height == PIXEL_PER_SUBTILE
+        data = self.codec.tobytes(img=img, skip_optimize_png=False)
+        self.rows.append((nw_east_m, nw_north_m, data))
+
+    def add_placeholder(self, nw_east_m: int, nw_north_m: int):
+        self.rows.append((nw_east_m, nw_north_m, None))
+
+    def flush(self, db: SqliteTilesRaw) -> None:
+        for nw_east_m, nw_north_m, data in self.rows:
+            if data is None:
+                db.add_placeholder(nw_east_m=nw_east_m, nw_north_m=nw_north_m)
+                continue
+            db.add_subtile_raw(data=data, nw_east_m=nw_east_m, nw_north_m=nw_north_m)
+        self.rows = []
+
+
+def create_subtiles_band(
+    context: Context,
+    tiff_attrs: TiffImageAttributes,
+    window: rasterio.windows.Window,
+    codec: TileCodec,
+) -> SubtilesBuffer:
+    """
+    Runs in a thread, see 'TiffImageConverter._create_subtiles_parallel()'.
+    """
+    converter = TiffImageConverter(context=context, tiff_attrs=tiff_attrs)
+    converter.window = window
+    buffer = SubtilesBuffer(codec=codec)
+    converter._create_subtiles_window(db=buffer)  # pylint: disable=protected-access
+    return buffer
@@ -0,0 +1,99 @@
+"""
+Measures latency and throughput of 'preview_server.py'.
+
+  python -m oruxmap.preview_loadtest target/maps/CH_SwissTopo --threads 16
+
+The tiles are picked at random from 'OruxMapsImages.db'. A part of the
+requests revisits tiles already requested to exercise the LRU.
+"""
+import sys
+import time
+import random
+import sqlite3
+import pathlib
+import argparse
+import threading
+import urllib.error
+import urllib.request
+from typing import List
+
+from oruxmap.utils.sqlite_orux import FILENAME_ORUX_DB
+
+
+def read_keys(directory_map: pathlib.Path) -> List[tuple]:
+    db = sqlite3.connect(f"file:{directory_map / FILENAME_ORUX_DB}?mode=ro", uri=True)
+    keys = db.execute("select z, x, y from tiles").fetchall()
+    db.close()
+    assert len(keys) > 0
+    return keys
+
+
+def percentile(values_sorted: List[float], fraction: float) -> float:
+    index = min(len(values_sorted) - 1, int(fraction * len(values_sorted)))
+    return values_sorted[index]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("directory_map", type=pathlib.Path)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--revisit", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    keys = read_keys(args.directory_map)
+    rnd = random.Random(args.seed)
+    paths = []
+    for _ in range(args.requests):
+        if len(paths) > 0 and rnd.random() < args.revisit:
+            paths.append(rnd.choice(paths))
+            continue
+        z, x, y = rnd.choice(keys)
+        paths.append(f"/orux/{z}/{x}/{y}")
+
+    latencies_s = []
+    errors = []
+    lock = threading.Lock()
+
+    def worker(paths_worker: List[str]) -> None:
+        for path in paths_worker:
+            start_s = time.perf_counter()
+            try:
+                with urllib.request.urlopen(args.url + path) as response:
+                    response.read()
+            except urllib.error.URLError as e:
+                with lock:
+                    errors.append(f"{path}: {e}")
+                continue
+            with lock:
+                latencies_s.append(time.perf_counter() - start_s)
+
+    threads = [
+        threading.Thread(target=worker, args=(paths[i :: args.threads],))
+        for i in range(args.threads)
+    ]
+    start_s = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration_s = time.perf_counter() - start_s
+
+    latencies_s.sort()
+    print(f"Requests: {len(latencies_s)} ok, {len(errors)} errors")
+    for error in errors[:10]:
+        print(f"  {error}")
+    if len(latencies_s) == 0:
+        return
+    print(f"Throughput: {len(latencies_s)/duration_s:0.0f} requests/s")
+    for name, fraction in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99)):
+        print(f"Latency {name}: {percentile(latencies_s, fraction)*1000:0.1f}ms")
+    print(f"Latency max: {latencies_s[-1]*1000:0.1f}ms")
+    with urllib.request.urlopen(args.url + "/stats") as response:
+        print(f"Server: {response.read().decode('ascii')}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,394 @@
+"""
+A local http server to review a map without copying it onto the phone.
+
+  python -m oruxmap.preview_server target/maps/CH_SwissTopo
+
+http://localhost:8000/
+  A minimal slippy map of the layers in the '.otrk2.xml'.
+http://localhost:8000/orux/<z>/<x>/<y>
+  A tile of 'OruxMapsImages.db'. z is the orux layer.
+http://localhost:8000/cache/<db_name>/<layer>/<nw_east_m>/<nw_north_m>
+  A tile of 'cache_tiles', for example '/cache/tiles/0025/2690000/1245000'.
+
+See 'preview_loadtest.py' to measure the latency and throughput.
+"""
+import re
+import sys
+import json
+import sqlite3
+import pathlib
+import argparse
+import threading
+import collections
+import http.server
+from typing import Dict, Tuple
+
+from oruxmap.utils.constants_directories import DIRECTORY_CACHE_TILES
+from oruxmap.utils.orux_xml_otrk2 import read_layers
+from oruxmap.utils.sqlite_orux import FILENAME_ORUX_DB
+from oruxmap.utils.sqlite_titles import SqliteTilesPng
+from oruxmap.utils.tile_storage import STORAGES, TileRange, ORDER_EAST_NORTH
+
+MIME_TYPES = (
+    (b"\x89PNG", "image/png"),
+    (b"\xff\xd8", "image/jpeg"),
+)
+
+
+def mime_type(data: bytes) -> str:
+    for magic, mime in MIME_TYPES:
+        if data[: len(magic)] == magic:
+            return mime
+    return "application/octet-stream"
+
+
+class TileLru:
+    """
+    The recently requested tiles, limited by the sum of their sizes.
+    Shared by all threads of the server.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._tiles = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> bytes:
+        """
+        Returns None if the tile is not cached.
+        """
+        with self._lock:
+            data = self._tiles.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._tiles.move_to_end(key)
+            return data
+
+    def put(self, key: tuple, data: bytes) -> None:
+        with self._lock:
+            if key in self._tiles:
+                return
+            self._tiles[key] = data
+            self.used_bytes += len(data)
+            while self.used_bytes > self.max_bytes:
+                _key, data_removed = self._tiles.popitem(last=False)
+                self.used_bytes -= len(data_removed)
+
+
+class TileSources:
+    """
+    Every db is opened once and shared by all threads: 'ThreadingHTTPServer'
+    starts a new thread for every request. The lock of a db serializes its
+    reads. A db is reopened when it has been rebuilt.
+    """
+
+    def __init__(self, directory_map: pathlib.Path):
+        self.directory_map = directory_map
+        self.filename_orux = directory_map / FILENAME_ORUX_DB
+        assert self.filename_orux.exists(), self.filename_orux
+        self._lock = threading.Lock()
+        # filename -> (mtime_ns, lock, db)
+        self._dbs: Dict[pathlib.Path, Tuple[int, threading.Lock, object]] = {}
+
+    def filename(self, key: tuple) -> pathlib.Path:
+        if key[0] == "orux":
+            return self.filename_orux
+        _, db_name, layer, _nw_east_m, _nw_north_m = key
+        for cls in STORAGES.values():
+            filename = DIRECTORY_CACHE_TILES / db_name / f"{layer}{cls.SUFFIX}"
+            if filename.exists():
+                return filename
+        raise FileNotFoundError(f"{db_name}/{layer}")
+
+    @staticmethod
+    def etag(key: tuple, mtime_ns: int) -> str:
+        """
+        Changes when the db is rebuilt.
+        """
+        return '"' + "-".join(str(v) for v in key + (mtime_ns,)) + '"'
+
+    def _open(self, filename: pathlib.Path) -> object:
+        if filename == self.filename_orux:
+            return sqlite3.connect(
+                f"file:{filename}?mode=ro", uri=True, check_same_thread=False
+            )
+        # The codec does not matter: The tiles are not decoded
+        db = SqliteTilesPng(filename_sqlite=filename, pixel_per_tile=0)
+        db.connect()
+        return db
+
+    @staticmethod
+    def _close(db: object) -> None:
+        if isinstance(db, sqlite3.Connection):
+            db.close()
+            return
+        db.storage.close(commit=False)
+
+    def _db(
+        self, filename: pathlib.Path, mtime_ns: int
+    ) -> Tuple[threading.Lock, object]:
+        with self._lock:
+            entry = self._dbs.get(filename)
+            if entry is not None:
+                mtime_ns_open, lock, db = entry
+                if mtime_ns_open == mtime_ns:
+                    return lock, db
+                with lock:
+                    self._close(db)
+            lock = threading.Lock()
+            db = self._open(filename)
+            self._dbs[filename] = (mtime_ns, lock, db)
+            return lock, db
+
+    def close(self) -> None:
+        with self._lock:
+            for _mtime_ns, lock, db in self._dbs.values():
+                with lock:
+                    self._close(db)
+            self._dbs.clear()
+
+    def get(self, key: tuple, filename: pathlib.Path, mtime_ns: int) -> bytes:
+        """
+        Returns None if the tile does not exist.
+        """
+        lock, db = self._db(filename, mtime_ns)
+        with lock:
+            if key[0] == "orux":
+                _, z, x, y = key
+                row = db.execute(
+                    "select image from tiles where x=? and y=? and z=?", (x, y, z)
+                ).fetchone()
+                if row is None:
+                    return None
+                return row[0]
+
+            _, _db_name, _layer, nw_east_m, nw_north_m = key
+            for _, _, data in db.select(
+                tile_range=TileRange(
+                    min_east_m=nw_east_m,
+                    max_east_m=nw_east_m,
+                    min_north_m=nw_north_m,
+                    max_north_m=nw_north_m,
+                ),
+                order=ORDER_EAST_NORTH,
+                raw=True,
+            ):
+                return bytes(data)
+            return None
+
+
+PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>
+  body {{ margin: 0; overflow: hidden; font-family: sans-serif; }}
+  #map {{ position: absolute; top: 0; bottom: 0; left: 0; right: 0; background: #ddd; cursor: move; }}
+  #map img {{ position: absolute; }}
+  #bar {{ position: absolute; top: 8px; left: 8px; z-index: 1; background: white; padding: 4px; }}
+</style>
+</head>
+<body>
+<div id="map"></div>
+<div id="bar"><button id="out">-</button> <span id="layer"></span> <button id="in">+</button></div>
+<script>
+const layers = {layers};
+const map = document.getElementById("map");
+let index = 0, offsetX = 0, offsetY = 0;
+
+function render() {{
+  const layer = layers[index];
+  const size = layer.tile_size;
+  document.getElementById("layer").textContent = "layer " + layer.z;
+  map.innerHTML = "";
+  const x0 = Math.max(0, Math.floor(-offsetX / size));
+  const y0 = Math.max(0, Math.floor(-offsetY / size));
+  const x1 = Math.min(layer.xMax, Math.ceil((map.clientWidth - offsetX) / size));
+  const y1 = Math.min(layer.yMax, Math.ceil((map.clientHeight - offsetY) / size));
+  for (let x = x0; x < x1; x++) {{
+    for (let y = y0; y < y1; y++) {{
+      const img = document.createElement("img");
+      img.src = "/orux/" + layer.z + "/" + x + "/" + y;
+      img.style.left = (offsetX + x * size) + "px";
+      img.style.top = (offsetY + y * size) + "px";
+      img.onerror = () => img.remove();
+      map.appendChild(img);
+    }}
+  }}
+}}
+
+function zoom(delta) {{
+  // Keep the center of the view
+  const before = layers[index];
+  index = Math.min(layers.length - 1, Math.max(0, index + delta));
+  const after = layers[index];
+  const fx = (after.xMax * after.tile_size) / (before.xMax * before.tile_size);
+  const fy = (after.yMax * after.tile_size) / (before.yMax * before.tile_size);
+  const cx = map.clientWidth / 2, cy = map.clientHeight / 2;
+  offsetX = cx - (cx - offsetX) * fx;
+  offsetY = cy - (cy - offsetY) * fy;
+  render();
+}}
+
+// While dragging, the tiles are moved by a transform and rendered on release
+let drag = null;
+map.onmousedown = (e) => {{ drag = [e.clientX, e.clientY, offsetX, offsetY]; }};
+window.onmouseup = () => {{
+  if (drag === null) return;
+  drag = null;
+  map.style.transform = "";
+  render();
+}};
+window.onmousemove = (e) => {{
+  if (drag === null) return;
+  const dx = e.clientX - drag[0], dy = e.clientY - drag[1];
+  offsetX = drag[2] + dx;
+  offsetY = drag[3] + dy;
+  map.style.transform = "translate(" + dx + "px, " + dy + "px)";
+}};
+document.getElementById("in").onclick = () => zoom(1);
+document.getElementById("out").onclick = () => zoom(-1);
+window.onresize = render;
+render();
+</script>
+</body>
+</html>
+"""
+
+RE_ORUX = re.compile(r"^/orux/(\d+)/(\d+)/(\d+)$")
+RE_CACHE = re.compile(r"^/cache/([\w-]+)/(\d+)/(\d+)/(\d+)$")
+
+
+class PreviewHandler(http.server.BaseHTTPRequestHandler):
+    # Set by 'create_server()'
+    sources: TileSources = None
+    lru: TileLru = None
+    page: bytes = None
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        # Do not log every tile
+        pass
+
+    def _send(self, status: int, content_type: str, body: bytes, etag=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if etag is not None:
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _tile_key(self) -> Tuple:
+        match = RE_ORUX.match(self.path)
+        if match is not None:
+            return ("orux",) + tuple(int(v) for v in match.groups())
+        match = RE_CACHE.match(self.path)
+        if match is not None:
+            db_name, layer, nw_east_m, nw_north_m = match.groups()
+            return ("cache", db_name, layer, int(nw_east_m), int(nw_north_m))
+        return None
+
+    def do_HEAD(self):  # pylint: disable=invalid-name
+        self.do_GET()
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        if self.path in ("/", "/index.html"):
+            self._send(200, "text/html; charset=utf-8", self.page)
+            return
+        if self.path == "/stats":
+            stats = dict(
+                hits=self.lru.hits,
+                misses=self.lru.misses,
+                used_bytes=self.lru.used_bytes,
+            )
+            self._send(200, "application/json", json.dumps(stats).encode("ascii"))
+            return
+
+        key = self._tile_key()
+        if key is None:
+            self._send(404, "text/plain", b"Not found")
+            return
+        try:
+            filename = self.sources.filename(key)
+            mtime_ns = filename.stat().st_mtime_ns
+        except FileNotFoundError:
+            self._send(404, "text/plain", b"Not found")
+            return
+        etag = self.sources.etag(key, mtime_ns)
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        # A rebuilt db must not return the cached tiles
+        lru_key = key + (mtime_ns,)
+        data = self.lru.get(lru_key)
+        if data is None:
+            data = self.sources.get(key, filename=filename, mtime_ns=mtime_ns)
+            if data is None:
+                self._send(404, "text/plain", b"Tile not found")
+                return
+            self.lru.put(lru_key, data)
+        self._send(200, mime_type(data), data, etag=etag)
+
+
+def create_server(
+    directory_map: pathlib.Path, port: int, lru_bytes: int, host: str = "127.0.0.1"
+) -> http.server.ThreadingHTTPServer:
+    """
+    Binds to localhost by default: The map is not served to the network.
+    """
+    filename_xml = next(directory_map.glob("*.otrk2.xml"))
+    layers = [
+        dict(z=layer.layer, xMax=layer.xMax, yMax=layer.yMax, tile_size=layer.tile_size)
+        for layer in read_layers(filename_xml)
+    ]
+    handler = type(
+        "Handler",
+        (PreviewHandler,),
+        dict(
+            sources=TileSources(directory_map),
+            lru=TileLru(max_bytes=lru_bytes),
+            page=PAGE.format(
+                title=directory_map.name, layers=json.dumps(layers)
+            ).encode("utf-8"),
+        ),
+    )
+    return http.server.ThreadingHTTPServer((host, port), handler)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("directory_map", type=pathlib.Path)
+    parser.add_argument(
+        "--host", default="127.0.0.1", help="Use 0.0.0.0 to serve the network"
+    )
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--lru-mbytes", type=int, default=256)
+    args = parser.parse_args(argv)
+
+    server = create_server(
+        directory_map=args.directory_map,
+        host=args.host,
+        port=args.port,
+        lru_bytes=args.lru_mbytes * 1024 * 1024,
+    )
+    print(f"Serving {args.directory_map} on http://{args.host}:{args.port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    server.RequestHandlerClass.sources.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
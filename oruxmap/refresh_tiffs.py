@@ -0,0 +1,242 @@
+"""
+Re-downloads the tiffs in 'cache_tif' which changed on the server.
+
+  python -m oruxmap.refresh_tiffs [--layer 0025] [--rewrite-url https://data.geo.admin.ch=http://localhost:8001]
+
+Every tiff of 'resources/*/url_tiffs.txt' which is in 'cache_tif' is checked
+by a conditional request using the ETag and Last-Modified stored in the
+tiff catalog. Tiffs which are not in 'cache_tif' are left to the build.
+
+If a tiff of a layer changed, the caches of the layer in 'cache_tiles'
+are removed: The next build recreates this layer only.
+
+'--rewrite-url' replaces the beginning of the urls, for example to test
+against a local http server.
+"""
+import sys
+import argparse
+import pathlib
+import threading
+import concurrent.futures
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from typing import Callable, List
+
+import requests
+
+from oruxmap.layers_switzerland import LIST_LAYERS
+from oruxmap.utils.tiff_catalog import TiffCatalog
+from oruxmap.utils.constants_directories import (
+    DIRECTORY_BASE,
+    DIRECTORY_CACHE_TIF,
+    DIRECTORY_CACHE_TILES,
+    DIRECTORY_RESOURCES,
+    create_directories,
+)
+
+STATUS_UNCHANGED = "unchanged"
+STATUS_CHANGED = "changed"
+
+TIMEOUT_S = 60.0
+CHUNK_BYTES = 1024 * 1024
+
+
+@dataclass
+class Sheet:
+    layer: str
+    url: str
+    filename: pathlib.Path
+    etag: str
+    last_modified: str
+
+
+@dataclass
+class Refreshed:
+    sheet: Sheet
+    status: str
+    etag: str
+    last_modified: str
+
+
+def iter_sheets(catalog: TiffCatalog, layers: List[str] = None):
+    """
+    The tiffs of 'url_tiffs.txt' which are in 'cache_tif'.
+    """
+    for filename_url_tiffs in sorted(DIRECTORY_RESOURCES.glob("*/url_tiffs.txt")):
+        layer = filename_url_tiffs.parent.name
+        if (layers is not None) and (layer not in layers):
+            continue
+        for url in filename_url_tiffs.read_text().split():
+            name = url.split("/")[-1]
+            filename = DIRECTORY_CACHE_TIF / layer / name
+            if not filename.exists():
+                continue
+            etag, last_modified = catalog.lookup_validators(layer=layer, name=name)
+            yield Sheet(
+                layer=layer,
+                url=url,
+                filename=filename,
+                etag=etag,
+                last_modified=last_modified,
+            )
+
+
+def _is_unchanged(response: requests.Response, filename: pathlib.Path) -> bool:
+    """
+    No validators are stored, for example for tiffs downloaded before
+    the validators were introduced. The tiff was written after it was
+    modified on the server. 'Context.normalize_tiffs' changes the size.
+    """
+    last_modified = response.headers.get("Last-Modified")
+    if last_modified is not None:
+        modified_s = parsedate_to_datetime(last_modified).timestamp()
+        return filename.stat().st_mtime >= modified_s
+    content_length = response.headers.get("Content-Length")
+    if content_length is not None:
+        return int(content_length) == filename.stat().st_size
+    return False
+
+
+class Refresher:
+    def __init__(self, rewrite_url: Callable[[str], str]):
+        self.rewrite_url = rewrite_url
+        # A 'requests.Session' per thread
+        self._local = threading.local()
+
+    @property
+    def session(self) -> requests.Session:
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def refresh(self, sheet: Sheet) -> Refreshed:
+        """
+        Runs in a thread: The catalog is updated by the caller.
+        """
+        url = self.rewrite_url(sheet.url)
+        headers = {}
+        if sheet.etag is not None:
+            headers["If-None-Match"] = sheet.etag
+        if sheet.last_modified is not None:
+            headers["If-Modified-Since"] = sheet.last_modified
+        if len(headers) == 0:
+            r = self.session.head(url, timeout=TIMEOUT_S, allow_redirects=True)
+            r.raise_for_status()
+            if _is_unchanged(response=r, filename=sheet.filename):
+                return Refreshed(
+                    sheet=sheet,
+                    status=STATUS_UNCHANGED,
+                    etag=r.headers.get("ETag"),
+                    last_modified=r.headers.get("Last-Modified"),
+                )
+
+        with self.session.get(
+            url, headers=headers, timeout=TIMEOUT_S, stream=True
+        ) as r:
+            if r.status_code == 304:
+                return Refreshed(
+                    sheet=sheet,
+                    status=STATUS_UNCHANGED,
+                    etag=r.headers.get("ETag", sheet.etag),
+                    last_modified=r.headers.get("Last-Modified", sheet.last_modified),
+                )
+            r.raise_for_status()
+            filename_tmp = sheet.filename.with_name(sheet.filename.name + ".tmp")
+            try:
+                with filename_tmp.open("wb") as f:
+                    for chunk in r.iter_content(chunk_size=CHUNK_BYTES):
+                        f.write(chunk)
+                filename_tmp.replace(sheet.filename)
+            finally:
+                # A failed download keeps the old tiff and leaves no '.tmp'
+                filename_tmp.unlink(missing_ok=True)
+            return Refreshed(
+                sheet=sheet,
+                status=STATUS_CHANGED,
+                etag=r.headers.get("ETag"),
+                last_modified=r.headers.get("Last-Modified"),
+            )
+
+
+def invalidate_layer(layer: str) -> None:
+    """
+    Removes the subtiles and tiles of the layer and of the layers derived
+    from it, of all maps and versions.
+    """
+    names = [layer] + [
+        layer_param.name
+        for layer_param in LIST_LAYERS
+        if (layer_param.derived_from is not None)
+        and (layer_param.source_layer.name == layer)
+    ]
+    for name in names:
+        for filename in sorted(DIRECTORY_CACHE_TILES.glob(f"*/{name}.*")):
+            print(f"Remove {filename.relative_to(DIRECTORY_BASE)}")
+            filename.unlink()
+
+
+def url_rewriter(rule: str) -> Callable[[str], str]:
+    """
+    'rule' is 'prefix=replacement'.
+    """
+    prefix, replacement = rule.split("=", 1)
+
+    def rewrite_url(url: str) -> str:
+        if url.startswith(prefix):
+            return replacement + url[len(prefix) :]
+        return url
+
+    return rewrite_url
+
+
+def refresh_tiffs(
+    layers: List[str] = None,
+    max_workers: int = 8,
+    rewrite_url: Callable[[str], str] = None,
+) -> List[Refreshed]:
+    if rewrite_url is None:
+        rewrite_url = lambda url: url  # pylint: disable=unnecessary-lambda-assignment
+    create_directories()
+    refresher = Refresher(rewrite_url=rewrite_url)
+    results = []
+    with TiffCatalog() as catalog:
+        sheets = list(iter_sheets(catalog=catalog, layers=layers))
+        print(f"Refresh {len(sheets)} tiffs")
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for result in executor.map(refresher.refresh, sheets):
+                sheet = result.sheet
+                catalog.update_validators(
+                    layer=sheet.layer,
+                    name=sheet.filename.name,
+                    etag=result.etag,
+                    last_modified=result.last_modified,
+                )
+                if result.status == STATUS_CHANGED:
+                    print(f"Changed {sheet.filename.relative_to(DIRECTORY_BASE)}")
+                results.append(result)
+
+    changed = [r for r in results if r.status == STATUS_CHANGED]
+    for layer in sorted(set(r.sheet.layer for r in changed)):
+        invalidate_layer(layer)
+    print(f"Refresh: {len(changed)} of {len(results)} tiffs changed")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--layer", action="append", dest="layers")
+    parser.add_argument("--max-workers", type=int, default=8)
+    parser.add_argument(
+        "--rewrite-url", help="'prefix=replacement' applied to the urls"
+    )
+    args = parser.parse_args(argv)
+
+    refresh_tiffs(
+        layers=args.layers,
+        max_workers=args.max_workers,
+        rewrite_url=None if args.rewrite_url is None else url_rewriter(args.rewrite_url),
+    )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
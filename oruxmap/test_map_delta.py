@@ -0,0 +1,94 @@
+"""
+Tests 'map_delta.py': A patch turns the old release into the new one and
+is refused by a map it was not created from.
+
+  python -m pytest oruxmap/test_map_delta.py
+"""
+import shutil
+import sqlite3
+import pathlib
+
+import pytest
+
+from oruxmap.map_delta import PatchError, apply_patch, create_patch
+from oruxmap.utils.sqlite_orux import FILENAME_ORUX_DB
+
+TILES_OLD = {
+    (0, 0, 13): b"unchanged",
+    (1, 0, 13): b"changed old",
+    (2, 0, 13): b"deleted",
+}
+TILES_NEW = {
+    (0, 0, 13): b"unchanged",
+    (1, 0, 13): b"changed new",
+    (3, 0, 13): b"new",
+}
+
+
+def write_map(directory: pathlib.Path, tiles: dict, xml: str) -> pathlib.Path:
+    directory.mkdir()
+    (directory / "map.otrk2.xml").write_text(xml)
+    db = sqlite3.connect(directory / FILENAME_ORUX_DB)
+    db.execute(
+        "CREATE TABLE tiles (x int, y int, z int, image blob, PRIMARY KEY (x,y,z))"
+    )
+    db.executemany(
+        "insert into tiles values (?,?,?,?)",
+        [(x, y, z, image) for (x, y, z), image in tiles.items()],
+    )
+    db.commit()
+    db.close()
+    return directory
+
+
+def read_tiles(directory: pathlib.Path) -> dict:
+    db = sqlite3.connect(directory / FILENAME_ORUX_DB)
+    tiles = {(x, y, z): image for x, y, z, image in db.execute("select * from tiles")}
+    db.close()
+    return tiles
+
+
+@pytest.fixture(name="patch")
+def fixture_patch(tmp_path) -> pathlib.Path:
+    directory_old = write_map(tmp_path / "old", TILES_OLD, xml="<old/>")
+    directory_new = write_map(tmp_path / "new", TILES_NEW, xml="<new/>")
+    filename_patch = tmp_path / "patch.db"
+    create_patch(
+        directory_old=directory_old,
+        directory_new=directory_new,
+        filename_patch=filename_patch,
+    )
+    return filename_patch
+
+
+def test_apply(tmp_path, patch):
+    directory_map = tmp_path / "map"
+    shutil.copytree(tmp_path / "old", directory_map)
+
+    apply_patch(filename_patch=patch, directory_map=directory_map)
+
+    assert read_tiles(directory_map) == TILES_NEW
+    assert (directory_map / "map.otrk2.xml").read_text() == "<new/>"
+
+
+def test_base_sha1_mismatch(tmp_path, patch):
+    # The tile to be replaced differs from the release the patch was created from
+    tiles = dict(TILES_OLD)
+    tiles[(1, 0, 13)] = b"changed locally"
+    directory_map = write_map(tmp_path / "map", tiles, xml="<old/>")
+
+    with pytest.raises(PatchError, match="1 tiles differ"):
+        apply_patch(filename_patch=patch, directory_map=directory_map)
+
+    # The map is not changed
+    assert read_tiles(directory_map) == tiles
+    assert (directory_map / "map.otrk2.xml").read_text() == "<old/>"
+
+
+def test_other_map(tmp_path, patch):
+    directory_map = write_map(tmp_path / "map", TILES_OLD, xml="<other/>")
+
+    with pytest.raises(PatchError, match="another map"):
+        apply_patch(filename_patch=patch, directory_map=directory_map)
+
+    assert read_tiles(directory_map) == TILES_OLD
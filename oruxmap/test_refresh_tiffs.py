@@ -0,0 +1,184 @@
+"""
+Tests 'refresh_tiffs.py' against a stand-in for the swisstopo server.
+
+  python -m pytest oruxmap/test_refresh_tiffs.py
+"""
+import threading
+import http.server
+
+import pytest
+import requests
+
+from oruxmap import refresh_tiffs
+from oruxmap.refresh_tiffs import (
+    Refresher,
+    Sheet,
+    STATUS_CHANGED,
+    STATUS_UNCHANGED,
+    invalidate_layer,
+    url_rewriter,
+)
+
+TIFF_OLD = b"II*\x00old"
+TIFF_NEW = b"II*\x00new tiff"
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    """
+    'resources': path -> dict(body=bytes, etag=str, broken=bool)
+    'requests': (method, path, headers) of every request
+    """
+
+    resources: dict = None
+    requests: list = None
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def _respond(self, send_body: bool) -> None:
+        self.requests.append((self.command, self.path, dict(self.headers)))
+        resource = self.resources.get(self.path)
+        if resource is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        etag = resource.get("etag")
+        if (etag is not None) and (self.headers.get("If-None-Match") == etag):
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        body = resource["body"]
+        self.send_response(200)
+        if etag is not None:
+            self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if not send_body:
+            return
+        if resource.get("broken", False):
+            # The connection drops in the middle of the tiff
+            self.wfile.write(body[: len(body) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def do_HEAD(self):  # pylint: disable=invalid-name
+        self._respond(send_body=False)
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        self._respond(send_body=True)
+
+
+@pytest.fixture(name="server")
+def fixture_server():
+    handler = type("Handler", (StandInHandler,), dict(resources={}, requests=[]))
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _refresher(server) -> Refresher:
+    return Refresher(
+        rewrite_url=url_rewriter(
+            f"https://data.geo.admin.ch=http://127.0.0.1:{server.server_port}"
+        )
+    )
+
+
+def _sheet(tmp_path, name: str, etag: str = None) -> Sheet:
+    filename = tmp_path / name
+    filename.write_bytes(TIFF_OLD)
+    return Sheet(
+        layer="0025",
+        url=f"https://data.geo.admin.ch/{name}",
+        filename=filename,
+        etag=etag,
+        last_modified=None,
+    )
+
+
+def test_not_modified(server, tmp_path):
+    server.RequestHandlerClass.resources["/a.tif"] = dict(body=TIFF_NEW, etag='"v1"')
+    sheet = _sheet(tmp_path, "a.tif", etag='"v1"')
+
+    result = _refresher(server).refresh(sheet)
+
+    assert result.status == STATUS_UNCHANGED
+    assert result.etag == '"v1"'
+    assert sheet.filename.read_bytes() == TIFF_OLD
+    ((method, _path, headers),) = server.RequestHandlerClass.requests
+    assert method == "GET"
+    assert headers["If-None-Match"] == '"v1"'
+
+
+def test_new_etag(server, tmp_path):
+    server.RequestHandlerClass.resources["/a.tif"] = dict(body=TIFF_NEW, etag='"v2"')
+    sheet = _sheet(tmp_path, "a.tif", etag='"v1"')
+
+    result = _refresher(server).refresh(sheet)
+
+    assert result.status == STATUS_CHANGED
+    assert result.etag == '"v2"'
+    assert sheet.filename.read_bytes() == TIFF_NEW
+    assert list(tmp_path.iterdir()) == [sheet.filename]
+
+
+@pytest.mark.parametrize(
+    "body,status", ((TIFF_OLD, STATUS_UNCHANGED), (TIFF_NEW, STATUS_CHANGED))
+)
+def test_head_without_validators(server, tmp_path, body, status):
+    # Neither ETag nor Last-Modified: Only the size is compared
+    server.RequestHandlerClass.resources["/a.tif"] = dict(body=body)
+    sheet = _sheet(tmp_path, "a.tif")
+
+    result = _refresher(server).refresh(sheet)
+
+    assert result.status == status
+    assert result.etag is None
+    assert sheet.filename.read_bytes() == body
+    methods = [
+        method for method, _path, _headers in server.RequestHandlerClass.requests
+    ]
+    assert methods == (["HEAD"] if status == STATUS_UNCHANGED else ["HEAD", "GET"])
+
+
+def test_broken_download(server, tmp_path):
+    server.RequestHandlerClass.resources["/a.tif"] = dict(
+        body=TIFF_NEW, etag='"v2"', broken=True
+    )
+    sheet = _sheet(tmp_path, "a.tif", etag='"v1"')
+
+    with pytest.raises(requests.RequestException):
+        _refresher(server).refresh(sheet)
+
+    # The old tiff is kept and no '.tmp' is left
+    assert sheet.filename.read_bytes() == TIFF_OLD
+    assert list(tmp_path.iterdir()) == [sheet.filename]
+
+
+def test_invalidate_layer(tmp_path, monkeypatch):
+    monkeypatch.setattr(refresh_tiffs, "DIRECTORY_BASE", tmp_path)
+    monkeypatch.setattr(refresh_tiffs, "DIRECTORY_CACHE_TILES", tmp_path)
+    names = (
+        "subtiles/1000.db",
+        "tiles/1000.pack",
+        "tiles/1000.pack-idx",
+        "tiles/2000.db",
+        "tiles/4000.db",
+        "tiles/0500.db",
+    )
+    for name in names:
+        filename = tmp_path / name
+        filename.parent.mkdir(exist_ok=True)
+        filename.write_bytes(b"")
+
+    # '2000' and '4000' are derived from '1000'
+    invalidate_layer("1000")
+
+    remaining = sorted(str(f.relative_to(tmp_path)) for f in tmp_path.glob("*/*"))
+    assert remaining == ["tiles/0500.db"]
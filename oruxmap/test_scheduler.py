@@ -0,0 +1,128 @@
+"""
+Tests 'utils/scheduler.py': The tasks run after their dependencies and
+the tasks whose output is not needed are pruned.
+
+  python -m pytest oruxmap/test_scheduler.py
+"""
+import os
+import time
+import pathlib
+
+import pytest
+
+from oruxmap.utils.scheduler import DagScheduler, Task
+
+
+def record(filename: pathlib.Path, duration_s: float) -> None:
+    """
+    Runs in a worker process: Writes pid, start and end.
+    """
+    start_s = time.monotonic()
+    time.sleep(duration_s)
+    filename.write_text(f"{os.getpid()} {start_s} {time.monotonic()}")
+
+
+def read_records(tmp_path: pathlib.Path) -> dict:
+    records = {}
+    for filename in tmp_path.glob("*.txt"):
+        pid, start_s, end_s = filename.read_text().split()
+        records[filename.stem] = (int(pid), float(start_s), float(end_s))
+    return records
+
+
+def add_task(scheduler, tmp_path, name, dependencies=(), cached=False, **kwargs):
+    scheduler.add(
+        Task(
+            name=name,
+            func=record,
+            args=(tmp_path / f"{name}.txt", 0.2),
+            dependencies=list(dependencies),
+            is_done=lambda: cached,
+            **kwargs,
+        )
+    )
+
+
+@pytest.mark.parametrize("multiprocessing", (False, True))
+def test_ordering(tmp_path, multiprocessing):
+    # 'subtiles' of two layers, 'tiles' each depending on its 'subtiles',
+    # 'map' depending on both 'tiles' and running in the main process
+    scheduler = DagScheduler(multiprocessing=multiprocessing, max_workers=2)
+    add_task(scheduler, tmp_path, "subtiles_a")
+    add_task(scheduler, tmp_path, "subtiles_b")
+    add_task(scheduler, tmp_path, "tiles_a", dependencies=["subtiles_a"])
+    add_task(scheduler, tmp_path, "tiles_b", dependencies=["subtiles_b"])
+    add_task(
+        scheduler, tmp_path, "map", dependencies=["tiles_a", "tiles_b"], serial=True
+    )
+
+    scheduler.run()
+
+    records = read_records(tmp_path)
+    assert records.keys() == scheduler.tasks.keys()
+    for name, task in scheduler.tasks.items():
+        _pid, start_s, _end_s = records[name]
+        for dependency in task.dependencies:
+            _pid, _start_s, end_s = records[dependency]
+            assert end_s <= start_s, (dependency, name)
+    pid, _start_s, _end_s = records["map"]
+    assert pid == os.getpid()
+    if multiprocessing:
+        # The independent layers ran in parallel in worker processes
+        _pid, start_a, end_a = records["subtiles_a"]
+        _pid, start_b, end_b = records["subtiles_b"]
+        assert max(start_a, start_b) < min(end_a, end_b)
+        assert records["subtiles_a"][0] != os.getpid()
+
+
+def test_prune_cached(tmp_path):
+    scheduler = DagScheduler(multiprocessing=False)
+    # The tiles of 'a' are cached: Its subtiles are not needed
+    add_task(scheduler, tmp_path, "subtiles_a")
+    add_task(scheduler, tmp_path, "tiles_a", dependencies=["subtiles_a"], cached=True)
+    # The subtiles of 'b' are cached, but not its tiles
+    add_task(scheduler, tmp_path, "subtiles_b", cached=True)
+    add_task(scheduler, tmp_path, "tiles_b", dependencies=["subtiles_b"])
+    add_task(scheduler, tmp_path, "map", dependencies=["tiles_a", "tiles_b"])
+
+    scheduler.run()
+
+    assert sorted(read_records(tmp_path)) == ["map", "tiles_b"]
+
+
+def test_prune_all_cached(tmp_path):
+    scheduler = DagScheduler(multiprocessing=False)
+    add_task(scheduler, tmp_path, "subtiles_a")
+    add_task(scheduler, tmp_path, "tiles_a", dependencies=["subtiles_a"])
+    add_task(scheduler, tmp_path, "map", dependencies=["tiles_a"], cached=True)
+
+    scheduler.run()
+
+    assert read_records(tmp_path) == {}
+
+
+def test_dependency_added_first(tmp_path):
+    scheduler = DagScheduler(multiprocessing=False)
+    with pytest.raises(AssertionError):
+        add_task(scheduler, tmp_path, "tiles_a", dependencies=["subtiles_a"])
+
+
+def test_derived_layer_adds_source():
+    # pylint: disable=import-outside-toplevel
+    from oruxmap.oruxmap import add_tiles_tasks
+    from oruxmap.layers_switzerland import select_layers
+    from oruxmap.utils.context import Context
+
+    # 1:2Mio and 1:4Mio are derived from 1:1Mio, which is not selected
+    scheduler = DagScheduler(multiprocessing=False)
+    for layer_param in select_layers(iMasstabMin=2000, iMasstabMax=4000):
+        add_tiles_tasks(scheduler=scheduler, context=Context(), layer_param=layer_param)
+
+    assert sorted(scheduler.tasks) == [
+        "subtiles 1000",
+        "tiles 1000",
+        "tiles 2000",
+        "tiles 4000",
+    ]
+    assert scheduler.tasks["tiles 2000"].dependencies == ["tiles 1000"]
+    assert scheduler.tasks["tiles 4000"].dependencies == ["tiles 1000"]
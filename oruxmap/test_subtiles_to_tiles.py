@@ -0,0 +1,102 @@
+"""
+Tests 'MapScale.sqlite_subtiles_to_tiles()': Every strip of the subtiles
+is turned into tiles, including the northernmost strip and the last and
+easternmost tile of each strip.
+
+  python -m pytest oruxmap/test_subtiles_to_tiles.py
+"""
+import dataclasses
+
+import numpy as np
+import PIL.Image
+
+from oruxmap import oruxmap
+from oruxmap.oruxmap import MapScale, PIXEL_PER_SUBTILE
+from oruxmap.layers_switzerland import LIST_LAYERS
+from oruxmap.utils import coverage
+from oruxmap.utils.context import Context
+from oruxmap.utils.sqlite_titles import SqliteTilesPng, SqliteTilesRaw
+from oruxmap.utils.tiff_catalog import TiffCatalog
+from oruxmap.utils.tile_storage import TILE_RANGE_ALL, ORDER_EAST_NORTH
+
+# 1:100'000 with 2x2 subtiles per tile: 1000 m_per_tile
+LAYER_PARAM = dataclasses.replace(
+    next(l for l in LIST_LAYERS if l.name == "0100"),
+    pixel_per_tile=2 * PIXEL_PER_SUBTILE,
+)
+M_PER_SUBTILE = int(LAYER_PARAM.m_per_pixel * PIXEL_PER_SUBTILE)
+M_PER_TILE = int(LAYER_PARAM.m_per_tile)
+
+# The subtiles cover 3 tiles from west to east and 2 strips, aligned to the tiles
+WEST_M = 2600000
+NORTH_M = 1200000
+TILES_EAST = 3
+TILES_SOUTH = 2
+
+
+def color(nw_east_m: int, nw_north_m: int) -> tuple:
+    return (
+        (nw_east_m - WEST_M) // M_PER_SUBTILE * 40,
+        (NORTH_M - nw_north_m) // M_PER_SUBTILE * 60,
+        0,
+    )
+
+
+def test_all_strips_and_tiles(tmp_path, monkeypatch):
+    monkeypatch.setattr(oruxmap, "DIRECTORY_CACHE_TILES", tmp_path / "cache_tiles")
+    monkeypatch.setattr(
+        oruxmap, "TiffCatalog", lambda: TiffCatalog(tmp_path / "tiff_catalog.db")
+    )
+    monkeypatch.setattr(coverage, "DIRECTORY_BASE", tmp_path)
+    monkeypatch.setattr(coverage, "DIRECTORY_LOGS", tmp_path)
+    map_scale = MapScale(context=Context(), layer_param=LAYER_PARAM)
+
+    with SqliteTilesRaw(
+        filename_sqlite=map_scale.filename_subtiles_sqlite,
+        pixel_per_tile=PIXEL_PER_SUBTILE,
+        create=True,
+    ) as db_subtiles:
+        db_subtiles.create_db()
+        for x in range(2 * TILES_EAST):
+            for y in range(2 * TILES_SOUTH):
+                nw_east_m = WEST_M + x * M_PER_SUBTILE
+                nw_north_m = NORTH_M - y * M_PER_SUBTILE
+                img = PIL.Image.new(
+                    mode="RGB",
+                    size=(PIXEL_PER_SUBTILE, PIXEL_PER_SUBTILE),
+                    color=color(nw_east_m, nw_north_m),
+                )
+                db_subtiles.add_subtile(
+                    img=img, nw_east_m=nw_east_m, nw_north_m=nw_north_m
+                )
+
+    map_scale.sqlite_subtiles_to_tiles()
+
+    with SqliteTilesPng(
+        filename_sqlite=map_scale.filename_tiles_sqlite,
+        pixel_per_tile=LAYER_PARAM.pixel_per_tile,
+    ) as db_tiles:
+        db_tiles.connect()
+        tiles = {
+            (nw_east_m, nw_north_m): np.asarray(img.convert("RGB"))
+            for nw_east_m, nw_north_m, img in db_tiles.select(
+                tile_range=TILE_RANGE_ALL, order=ORDER_EAST_NORTH
+            )
+        }
+
+    assert sorted(tiles) == sorted(
+        (WEST_M + x * M_PER_TILE, NORTH_M - y * M_PER_TILE)
+        for x in range(TILES_EAST)
+        for y in range(TILES_SOUTH)
+    )
+    # The subtiles are placed in the tile
+    for (nw_east_m, nw_north_m), data in tiles.items():
+        for x in range(2):
+            for y in range(2):
+                pixel = data[y * PIXEL_PER_SUBTILE, x * PIXEL_PER_SUBTILE]
+                expected = color(
+                    nw_east_m + x * M_PER_SUBTILE, nw_north_m - y * M_PER_SUBTILE
+                )
+                assert tuple(pixel) == expected
+    # No tile is dropped
+    assert (tmp_path / "coverage_0100.csv").read_text().count("\n") == 1
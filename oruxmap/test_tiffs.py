@@ -0,0 +1,59 @@
+"""
+Tests the download of 'tiffs.py': A failed download leaves no tiff and no '.tmp'.
+
+  python -m pytest oruxmap/test_tiffs.py
+"""
+import threading
+import http.server
+
+import pytest
+import requests
+
+from oruxmap.tiffs import LayerTiffs
+
+TIFF = b"II*\x00" + b"tiff" * 1000
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        if self.path != "/sheet.tif":
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(TIFF)))
+        self.send_header("ETag", '"4711"')
+        self.end_headers()
+        self.wfile.write(TIFF)
+
+
+@pytest.fixture(name="url")
+def fixture_url():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_download(tmp_path, url):
+    filename = tmp_path / "sheet.tif"
+    with requests.Session() as session:
+        etag, last_modified = LayerTiffs._download(  # pylint: disable=protected-access
+            session=session, url=f"{url}/sheet.tif", filename=filename
+        )
+    assert filename.read_bytes() == TIFF
+    assert (etag, last_modified) == ('"4711"', None)
+    assert [f.name for f in tmp_path.iterdir()] == ["sheet.tif"]
+
+
+def test_download_failed(tmp_path, url):
+    filename = tmp_path / "missing.tif"
+    with requests.Session() as session:
+        with pytest.raises(requests.HTTPError):
+            LayerTiffs._download(  # pylint: disable=protected-access
+                session=session, url=f"{url}/missing.tif", filename=filename
+            )
+    assert list(tmp_path.iterdir()) == []
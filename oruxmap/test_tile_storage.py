@@ -0,0 +1,149 @@
+"""
+Tests the pack file storage of 'utils/tile_storage.py'.
+
+  python -m pytest oruxmap/test_tile_storage.py
+"""
+import pytest
+
+from oruxmap.utils.tile_storage import (
+    ORDER_EAST_NORTH,
+    TILE_RANGE_ALL,
+    PackTileStorage,
+    TileRange,
+)
+
+M_PER_TILE = 1000
+
+
+def strip(north_m: int, count: int = 3) -> list:
+    return [
+        (east_m, north_m, f"tile {east_m}/{north_m}".encode() * (east_m % 7 + 1))
+        for east_m in range(2600000, 2600000 + count * M_PER_TILE, M_PER_TILE)
+    ]
+
+
+def read_all(storage: PackTileStorage) -> list:
+    return [
+        (east_m, north_m, bytes(data))
+        for east_m, north_m, data in storage.select(
+            tile_range=TILE_RANGE_ALL, order=ORDER_EAST_NORTH
+        )
+    ]
+
+
+@pytest.fixture(name="filenames")
+def fixture_filenames(tmp_path):
+    return tmp_path / "0100.pack.tmp", tmp_path / "0100.pack"
+
+
+def test_round_trip(filenames):
+    filename_tmp, filename = filenames
+    rows = strip(1200000) + strip(1199000)
+
+    storage = PackTileStorage()
+    storage.create(filename_tmp, auto_vacuum=False)
+    for east_m, north_m, data in rows:
+        storage.add(nw_east_m=east_m, nw_north_m=north_m, data=data)
+    storage.checkpoint("0100.tif")
+    storage.close(commit=True)
+    storage.rename(filename_tmp=filename_tmp, filename=filename)
+
+    storage = PackTileStorage()
+    storage.open_read(filename)
+    assert storage.count(TILE_RANGE_ALL) == len(rows)
+    assert read_all(storage) == sorted(rows)
+    assert storage.count(TileRange(min_north_m=1200000)) == 3
+    assert storage.key_range() == TileRange(
+        min_east_m=2600000,
+        max_east_m=2602000,
+        min_north_m=1199000,
+        max_north_m=1200000,
+    )
+    assert storage.norths() == [1199000, 1200000]
+    # The readers know the processed tiffs
+    assert storage.is_checkpoint("0100.tif")
+    storage.close(commit=False)
+
+
+def test_resume(filenames):
+    filename_tmp, filename = filenames
+    rows_done = strip(1200000)
+    rows_lost = strip(1199000)
+
+    storage = PackTileStorage()
+    storage.create(filename_tmp, auto_vacuum=False)
+    for east_m, north_m, data in rows_done:
+        storage.add(nw_east_m=east_m, nw_north_m=north_m, data=data)
+    storage.checkpoint("strip 1200000")
+    for east_m, north_m, data in rows_lost[:2]:
+        storage.add(nw_east_m=east_m, nw_north_m=north_m, data=data)
+    # The process is killed while writing a tile and a checkpoint
+    storage.f.write(b"\x01\x02")
+    storage.f.close()
+    filename_checkpoints = filename_tmp.with_name(filename_tmp.name + "-checkpoints")
+    with filename_checkpoints.open("a") as f:
+        f.write("4711")
+
+    storage = PackTileStorage()
+    storage.resume(filename_tmp)
+    assert storage.count_added() == len(rows_done)
+    assert storage.is_checkpoint("strip 1200000")
+    assert storage.count_checkpoints() == 1
+    for east_m, north_m, data in rows_lost:
+        storage.add(nw_east_m=east_m, nw_north_m=north_m, data=data)
+    storage.checkpoint("strip 1199000")
+    storage.close(commit=True)
+    storage.rename(filename_tmp=filename_tmp, filename=filename)
+
+    storage = PackTileStorage()
+    storage.open_read(filename)
+    assert read_all(storage) == sorted(rows_done + rows_lost)
+    assert storage.count_checkpoints() == 2
+    assert storage.checkpoints["strip 1199000"] == filename.stat().st_size
+    storage.close(commit=False)
+
+
+def test_delete(filenames):
+    filename_tmp, filename = filenames
+    strips = [strip(north_m) for north_m in (1200000, 1199000, 1198000, 1197000)]
+
+    storage = PackTileStorage()
+    storage.create(filename_tmp, auto_vacuum=False)
+    for rows in strips:
+        for east_m, north_m, data in rows:
+            storage.add(nw_east_m=east_m, nw_north_m=north_m, data=data)
+    storage.close(commit=True)
+    storage.rename(filename_tmp=filename_tmp, filename=filename)
+    size_bytes = filename.stat().st_size
+
+    def delete_strip(north_m: int) -> None:
+        storage = PackTileStorage()
+        storage.open_read(filename)
+        storage.delete(TileRange(min_north_m=north_m, max_north_m=north_m))
+        storage.close(commit=False)
+
+    def remaining(strips: list) -> list:
+        storage = PackTileStorage()
+        storage.open_read(filename)
+        rows = read_all(storage)
+        assert storage.count(TILE_RANGE_ALL) == len(rows)
+        storage.close(commit=False)
+        assert rows == sorted(row for rows in strips for row in rows)
+        return rows
+
+    # The deleted tiles take up less than half of the pack file: Only the index
+    delete_strip(1197000)
+    remaining(strips[:3])
+    assert filename.stat().st_size == size_bytes
+
+    # Now the pack file is compacted
+    delete_strip(1198000)
+    rows = remaining(strips[:2])
+    assert filename.stat().st_size == sum(
+        PackTileStorage.RECORD_HEADER.size + len(data) for _, _, data in rows
+    )
+    assert sorted(f.name for f in filename.parent.iterdir()) == [
+        "0100.pack",
+        "0100.pack-checkpoints",
+        "0100.pack-idx",
+    ]
@@ -0,0 +1,275 @@
+"""
+Tests 'utils/wmts.py' and the engine 'wmts' against a stand-in for
+wmts.geo.admin.ch.
+
+  python -m pytest oruxmap/test_wmts.py
+"""
+import io
+import time
+import threading
+import dataclasses
+import http.server
+
+import numpy as np
+import PIL.Image
+import pytest
+import rasterio
+import rasterio.transform
+
+from oruxmap.layers_switzerland import LIST_LAYERS
+from oruxmap.oruxmap import MapScale
+from oruxmap.utils import tiff_catalog
+from oruxmap.utils.context import Context
+from oruxmap.utils.coverage import CoverageReport
+from oruxmap.utils.tiff_catalog import TiffSheet
+from oruxmap.utils.wmts import (
+    PIXEL_PER_WMTS_TILE,
+    RESOLUTIONS_M_PER_PIXEL,
+    TOP_LEFT_EAST_M,
+    TOP_LEFT_NORTH_M,
+    WmtsClient,
+    select_zoom,
+    wmts_tiles,
+)
+
+# 1:100'000 with small tiles: 500 m_per_tile
+LAYER_PARAM = dataclasses.replace(
+    next(l for l in LIST_LAYERS if l.name == "0100"), pixel_per_tile=100
+)
+ZOOM = select_zoom(LAYER_PARAM.m_per_pixel)
+M_PER_PIXEL = RESOLUTIONS_M_PER_PIXEL[ZOOM]
+# The WMTS tiles from this column eastwards are missing (404)
+COL_MISSING = 143
+
+# The tiff of the mosaic engine
+WEST_M = 2600000
+NORTH_M = 1200000
+EAST_M = 2603000
+SOUTH_M = 1199000
+
+
+def world(x_pixel: np.ndarray, y_pixel: np.ndarray) -> np.ndarray:
+    """
+    The map of both the WMTS and the tiff. The pixels are counted
+    from the top left corner of the WMTS tile matrix set.
+    """
+    x, y = np.meshgrid(x_pixel, y_pixel)
+    return np.dstack((x * 7 % 256, y * 3 % 256, (x + y) // 4 % 256)).astype(np.uint8)
+
+
+class WmtsHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Answers the first request for every third tile with 503.
+    """
+
+    protocol_version = "HTTP/1.1"
+    lock: threading.Lock = None
+    seen: set = None
+    count_requests = 0
+    count_503 = 0
+    fail_first = True
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def _reply(self, status: int, body: bytes) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        _, _layer, zoom, col, row = self.path.split("/")
+        zoom, col, row = int(zoom), int(col), int(row.split(".")[0])
+        cls = type(self)
+        with self.lock:
+            cls.count_requests += 1
+            if (
+                self.fail_first
+                and ((col + row) % 3 == 0)
+                and (col, row) not in self.seen
+            ):
+                self.seen.add((col, row))
+                cls.count_503 += 1
+                self._reply(503, b"")
+                return
+        if col >= COL_MISSING:
+            self._reply(404, b"")
+            return
+        assert zoom == ZOOM
+        pixels = np.arange(PIXEL_PER_WMTS_TILE)
+        data = world(
+            col * PIXEL_PER_WMTS_TILE + pixels, row * PIXEL_PER_WMTS_TILE + pixels
+        )
+        f = io.BytesIO()
+        PIL.Image.fromarray(data, mode="RGB").save(f, format="PNG")
+        self._reply(200, f.getvalue())
+
+
+@pytest.fixture(name="server")
+def fixture_server():
+    handler = type("Handler", (WmtsHandler,), dict(lock=threading.Lock(), seen=set()))
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _client(server, tmp_path, **kwargs) -> WmtsClient:
+    return WmtsClient(
+        layer=LAYER_PARAM.wmts_layer,
+        url=f"http://127.0.0.1:{server.server_port}/{{layer}}/{{zoom}}/{{col}}/{{row}}.png",
+        directory_cache=tmp_path / "cache_wmts",
+        **kwargs,
+    )
+
+
+def test_fetch(server, tmp_path):
+    tiles = wmts_tiles(
+        zoom=ZOOM, west_m=WEST_M, north_m=NORTH_M, east_m=EAST_M + 2000, south_m=SOUTH_M
+    )
+    missing = [tile for tile in tiles if tile.col >= COL_MISSING]
+    assert 0 < len(missing) < len(tiles)
+
+    with _client(server, tmp_path) as client:
+        result = client.fetch_many(tiles)
+    # The 503 are retried
+    handler = server.RequestHandlerClass
+    assert handler.count_503 > 0
+    assert handler.count_requests == len(tiles) + handler.count_503
+    assert client.count_requests == len(tiles)
+    for tile, data in result.items():
+        if tile in missing:
+            assert data is None
+            continue
+        with PIL.Image.open(io.BytesIO(data)) as img:
+            assert img.size == (PIXEL_PER_WMTS_TILE, PIXEL_PER_WMTS_TILE)
+
+    # A missing tile is cached as empty file
+    for tile in missing:
+        filename = client._filename(tile)  # pylint: disable=protected-access
+        assert filename.stat().st_size == 0
+    assert not list((tmp_path / "cache_wmts").rglob("*.tmp"))
+
+    # The second time, all tiles come from the cache
+    count_requests = handler.count_requests
+    with _client(server, tmp_path) as client:
+        assert client.fetch_many(tiles) == result
+    assert handler.count_requests == count_requests
+    assert client.count_cached == len(tiles)
+
+
+def test_rate_limiter(server, tmp_path):
+    server.RequestHandlerClass.fail_first = False
+    tiles = wmts_tiles(
+        zoom=ZOOM, west_m=WEST_M, north_m=NORTH_M, east_m=EAST_M, south_m=SOUTH_M - 2000
+    )
+    assert len(tiles) >= 6
+
+    start_s = time.monotonic()
+    with _client(server, tmp_path, max_connections=4, requests_per_s=10.0) as client:
+        client.fetch_many(tiles)
+    duration_s = time.monotonic() - start_s
+
+    # The first request is not delayed
+    assert duration_s >= (len(tiles) - 1) / 10.0 * 0.9
+
+
+def test_wmts_block_matches_mosaic(server, tmp_path, monkeypatch):
+    class RecordingTiles:
+        def __init__(self):
+            self.tiles = {}
+
+        def add_subtile(self, img, nw_east_m, nw_north_m, skip_optimize_png):
+            self.tiles[(nw_east_m, nw_north_m)] = np.asarray(img)
+
+    class Catalog:
+        def __init__(self, sheet: TiffSheet):
+            self.sheet = sheet
+
+        def select_intersecting(self, layer, boundsCH1903):
+            return [self.sheet]
+
+    monkeypatch.setattr(tiff_catalog, "DIRECTORY_CACHE_TIF", tmp_path)
+    width = round((EAST_M - WEST_M) / M_PER_PIXEL)
+    height = round((NORTH_M - SOUTH_M) / M_PER_PIXEL)
+    sheet = TiffSheet(
+        layer=LAYER_PARAM.name,
+        name="world.tif",
+        url="",
+        size_bytes=0,
+        mtime_ns=0,
+        nw_east_m=WEST_M,
+        nw_north_m=NORTH_M,
+        se_east_m=EAST_M,
+        se_north_m=SOUTH_M,
+        m_per_pixel=M_PER_PIXEL,
+        width_pixel=width,
+        height_pixel=height,
+        bands=3,
+    )
+    sheet.filename.parent.mkdir()
+    data = world(
+        round((WEST_M - TOP_LEFT_EAST_M) / M_PER_PIXEL) + np.arange(width),
+        round((TOP_LEFT_NORTH_M - NORTH_M) / M_PER_PIXEL) + np.arange(height),
+    )
+    with rasterio.open(
+        sheet.filename,
+        "w",
+        driver="GTiff",
+        width=width,
+        height=height,
+        count=3,
+        dtype="uint8",
+        photometric="RGB",
+        transform=rasterio.transform.from_origin(
+            WEST_M, NORTH_M, M_PER_PIXEL, M_PER_PIXEL
+        ),
+    ) as dataset:
+        dataset.write(data.transpose(2, 0, 1))
+
+    map_scale = MapScale(context=Context(), layer_param=LAYER_PARAM)
+    m_per_tile = int(LAYER_PARAM.m_per_tile)
+    # Two tiles east of the tiff. The WMTS covers the first one partially.
+    tiles_x = list(range(round((EAST_M - WEST_M) / m_per_tile) + 2))
+
+    db_mosaic = RecordingTiles()
+    coverage_mosaic = CoverageReport(layer_name="mosaic", m_per_tile=m_per_tile)
+    map_scale._mosaic_block(  # pylint: disable=protected-access
+        db_tiles=db_mosaic,
+        catalog=Catalog(sheet),
+        coverage=coverage_mosaic,
+        names={sheet.name},
+        west_m=WEST_M,
+        top_nw_north_m=NORTH_M,
+        tiles_x=tiles_x,
+    )
+
+    db_wmts = RecordingTiles()
+    coverage_wmts = CoverageReport(layer_name="wmts", m_per_tile=m_per_tile)
+    with _client(server, tmp_path) as client:
+        map_scale._wmts_block(  # pylint: disable=protected-access
+            db_tiles=db_wmts,
+            client=client,
+            coverage=coverage_wmts,
+            zoom=ZOOM,
+            west_m=WEST_M,
+            top_nw_north_m=NORTH_M,
+            tiles_x=tiles_x,
+        )
+
+    assert len(db_mosaic.tiles) == len(tiles_x) - 2
+    assert db_wmts.tiles.keys() == db_mosaic.tiles.keys()
+    for key, img in db_mosaic.tiles.items():
+        np.testing.assert_array_equal(db_wmts.tiles[key], img)
+    assert coverage_mosaic.dropped == []
+    # The WMTS tiles of 'COL_MISSING' and eastwards are missing
+    (dropped,) = coverage_wmts.dropped
+    assert dropped.nw_east_m == EAST_M
+    col_missing_east_m = (
+        TOP_LEFT_EAST_M + COL_MISSING * PIXEL_PER_WMTS_TILE * M_PER_PIXEL
+    )
+    assert dropped.coverage == pytest.approx((col_missing_east_m - EAST_M) / m_per_tile)
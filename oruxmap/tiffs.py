@@ -0,0 +1,224 @@
+"""
+The tiffs of a layer: Selected by 'Context' and downloaded if missing.
+
+This module and the modules it imports do not import requests, numpy, PIL
+or rasterio: They are imported as soon as a tiff is downloaded or its header
+is read. The command 'download' of 'cli.py' returns quickly if all tiffs
+are cached.
+"""
+import pathlib
+import functools
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from oruxmap.layers_switzerland import LayerParams
+from oruxmap.utils.context import Context
+from oruxmap.utils.disk_quota import touch_atime
+from oruxmap.utils.tiff_catalog import TiffCatalog, TiffSheet
+from oruxmap.utils.constants_directories import (
+    DIRECTORY_BASE,
+    DIRECTORY_CACHE_TIF,
+    DIRECTORY_RESOURCES,
+    create_directories,
+)
+
+# pylint: disable=import-outside-toplevel
+
+# Like 'refresh_tiffs.py'
+TIMEOUT_S = 60.0
+CHUNK_BYTES = 1024 * 1024
+
+
+def _normalize_tiff(filename: pathlib.Path) -> None:
+    from oruxmap.utils.tiff_normalize import normalize_tiff
+
+    normalize_tiff(filename)
+
+
+class LayerTiffs:
+    """
+    'enforce_diskspace_quota()' is called before a tiff is downloaded,
+    see 'MapScale.enforce_diskspace_quota()'.
+    """
+
+    def __init__(
+        self,
+        context: Context,
+        layer_param: LayerParams,
+        enforce_diskspace_quota: Callable[[], None],
+    ):
+        self.context = context
+        self.layer_param = layer_param
+        self.enforce_diskspace_quota = enforce_diskspace_quota
+        self.directory_resources = DIRECTORY_RESOURCES / layer_param.name
+
+    def is_sheet_needed(
+        self, catalog: TiffCatalog, url: str, filename: pathlib.Path
+    ) -> bool:
+        boundsCH1903 = self.context.only_boundsCH1903
+        if boundsCH1903 is None:
+            return True
+        sheet = catalog.lookup(layer=self.layer_param.name, name=filename.name)
+        if sheet is None:
+            if filename.exists():
+                # Downloaded but not in the catalog yet
+                sheet = catalog.get(
+                    layer=self.layer_param.name, url=url, filename=filename
+                )
+            else:
+                # Not downloaded yet: Only the header is read from the server
+                sheet = TiffSheet.read_header_remote(
+                    layer=self.layer_param.name, url=url
+                )
+                catalog.update(sheet)
+        return sheet.intersects(boundsCH1903)
+
+    def count_sheets(self) -> int:
+        """
+        The tiffs of this layer, selected like in 'iter_tiffs()'.
+        With 'Context.only_boundsCH1903', tiffs not in the catalog yet are counted.
+        """
+        if self.layer_param.tiff_filename:
+            return 1
+        filename_url_tiffs = self.directory_resources / "url_tiffs.txt"
+        names = [url.split("/")[-1] for url in filename_url_tiffs.read_text().split()]
+        if self.context.only_tiffs is not None:
+            names = [name for name in names if name in self.context.only_tiffs]
+        boundsCH1903 = self.context.only_boundsCH1903
+        if boundsCH1903 is not None:
+            with TiffCatalog() as catalog:
+                sheets = [
+                    catalog.lookup(layer=self.layer_param.name, name=name)
+                    for name in names
+                ]
+            names = [
+                name
+                for name, sheet in zip(names, sheets)
+                if (sheet is None) or sheet.intersects(boundsCH1903)
+            ]
+        return len(names)
+
+    @staticmethod
+    def _download(
+        session, url: str, filename: pathlib.Path
+    ) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Returns the validators 'ETag' and 'Last-Modified'.
+        Like 'Refresher.refresh()': A failed download leaves no tiff and no '.tmp'.
+        """
+        with session.get(url, timeout=TIMEOUT_S, stream=True) as r:
+            r.raise_for_status()
+            filename_tmp = filename.with_name(filename.name + ".tmp")
+            try:
+                with filename_tmp.open("wb") as f:
+                    for chunk in r.iter_content(chunk_size=CHUNK_BYTES):
+                        f.write(chunk)
+                filename_tmp.replace(filename)
+            finally:
+                filename_tmp.unlink(missing_ok=True)
+            return r.headers.get("ETag"), r.headers.get("Last-Modified")
+
+    def _iter_download_tiffs(
+        self, catalog: TiffCatalog, is_done: Callable[[str], bool]
+    ) -> Iterable[Tuple[str, pathlib.Path]]:
+        filename_url_tiffs = self.directory_resources / "url_tiffs.txt"
+        assert filename_url_tiffs.exists()
+        directory_cache = DIRECTORY_CACHE_TIF / self.layer_param.name
+        directory_cache.mkdir(exist_ok=True)
+        # Created with the first download
+        session = None
+        with filename_url_tiffs.open("r") as f:
+            for url in sorted(f.readlines()):
+                url = url.strip()
+                name = url.split("/")[-1]
+                filename = directory_cache / name
+                if self.context.only_tiffs is not None:
+                    if filename.name not in self.context.only_tiffs:
+                        continue
+                if is_done(name):
+                    # Already done by a previous, interrupted run
+                    continue
+                if not self.is_sheet_needed(
+                    catalog=catalog, url=url, filename=filename
+                ):
+                    continue
+                if not filename.exists():
+                    if session is None:
+                        import requests
+
+                        session = requests.Session()
+                    self.enforce_diskspace_quota()
+                    print(f"Downloading {filename.relative_to(DIRECTORY_BASE)}")
+                    etag, last_modified = self._download(
+                        session=session, url=url, filename=filename
+                    )
+                    # Used by 'refresh_tiffs.py' for conditional requests
+                    catalog.update_validators(
+                        layer=self.layer_param.name,
+                        name=name,
+                        etag=etag,
+                        last_modified=last_modified,
+                    )
+                if self.context.normalize_tiffs:
+                    _normalize_tiff(filename)
+                touch_atime(filename)
+                yield url, filename
+
+    def iter_tiffs(
+        self, catalog: TiffCatalog, is_done: Callable[[str], bool]
+    ) -> Iterable[Tuple[str, pathlib.Path]]:
+        """
+        Yields url and filename of the tiffs of this layer.
+        Missing tiffs are downloaded.
+        'is_done(name)' returns True if the tiff was processed by a previous run.
+        """
+        if self.layer_param.tiff_filename:
+            from oruxmap.utils.download_zip_and_extract import (
+                DownloadZipAndExtractTiff,
+            )
+
+            # For big scales, the image has to be extracted form a zip file
+            tiff_filename = (
+                DIRECTORY_CACHE_TIF
+                / self.layer_param.name
+                / self.layer_param.tiff_filename
+            )
+            if is_done(tiff_filename.name):
+                return
+            d = DownloadZipAndExtractTiff(
+                url=self.layer_param.tiff_url, tiff_filename=tiff_filename
+            )
+            d.download()
+            if self.context.normalize_tiffs:
+                _normalize_tiff(tiff_filename)
+            yield self.layer_param.tiff_url, tiff_filename
+            return
+
+        yield from self._iter_download_tiffs(catalog=catalog, is_done=is_done)
+
+
+def download_tiffs(
+    context: Context,
+    layers: List[LayerParams],
+    enforce_diskspace_quota: Callable[[LayerParams], None],
+) -> None:
+    """
+    Downloads the tiffs of the layers and reads their headers into the catalog.
+    The tiffs are not processed. See the command 'download' of 'cli.py'.
+    'enforce_diskspace_quota(layer_param)' is called before a tiff is downloaded.
+    """
+    create_directories()
+    with TiffCatalog() as catalog:
+        for layer_param in layers:
+            if layer_param.derived_from is not None:
+                continue
+            tiffs = LayerTiffs(
+                context=context,
+                layer_param=layer_param,
+                enforce_diskspace_quota=functools.partial(
+                    enforce_diskspace_quota, layer_param
+                ),
+            )
+            for url, filename in tiffs.iter_tiffs(
+                catalog=catalog, is_done=lambda name: False
+            ):
+                catalog.get(layer=layer_param.name, url=url, filename=filename)
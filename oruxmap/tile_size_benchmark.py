@@ -0,0 +1,199 @@
+"""
+Compares the tile sizes of maps by panning them like the phone does.
+
+  python -m oruxmap.tile_size_benchmark target/maps/CH_SwissTopo target/maps/CH_SwissTopo_256px
+
+The maps are built with different 'Context.orux_pixel_per_tile'.
+For every layer, walks start at random positions and pan by a fraction of
+the screen into a random direction. Every pan reads the tiles entering the
+screen from 'OruxMapsImages.db' by x/y/z and decodes them. Decoded tiles are
+kept in an LRU of '--cache-mbytes' like the tile cache of the app, a walk
+starts with an empty cache. All maps are panned along the same walks.
+"""
+import io
+import sys
+import time
+import math
+import random
+import sqlite3
+import pathlib
+import argparse
+import collections
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+import PIL.Image
+
+from oruxmap.utils.orux_xml_otrk2 import OruxXmlLayer, read_layers
+from oruxmap.utils.sqlite_orux import FILENAME_ORUX_DB
+
+# Android decodes into ARGB_8888
+BYTES_PER_PIXEL = 4
+MBYTE = 1024 ** 2
+
+# A walk: The north west corner of the screen in pixels of the layer
+Walk = List[Tuple[float, float]]
+
+
+@dataclass
+class Screen:
+    width: int
+    height: int
+
+    @staticmethod
+    def parse(text: str) -> "Screen":
+        width, height = text.split("x")
+        return Screen(width=int(width), height=int(height))
+
+
+@dataclass
+class LayerResult:
+    pans: int = 0
+    tiles: int = 0
+    pixels: int = 0
+    bytes_read: int = 0
+    latencies_s: List[float] = None
+
+
+def create_walks(  # pylint: disable=too-many-arguments
+    rnd: random.Random,
+    width: int,
+    height: int,
+    screen: Screen,
+    walks: int,
+    pans: int,
+    pan_fraction: float,
+) -> List[Walk]:
+    max_x = max(0, width - screen.width)
+    max_y = max(0, height - screen.height)
+    step = pan_fraction * min(screen.width, screen.height)
+    result = []
+    for _ in range(walks):
+        x, y = rnd.uniform(0, max_x), rnd.uniform(0, max_y)
+        walk = [(x, y)]
+        for _ in range(pans):
+            angle = rnd.choice(range(8)) * math.pi / 4.0
+            x = min(max_x, max(0.0, x + step * math.cos(angle)))
+            y = min(max_y, max(0.0, y + step * math.sin(angle)))
+            walk.append((x, y))
+        result.append(walk)
+    return result
+
+
+def pan_layer(
+    db: sqlite3.Connection,
+    layer: OruxXmlLayer,
+    walks: List[Walk],
+    screen: Screen,
+    cache_bytes: int,
+) -> LayerResult:
+    tile_size = layer.tile_size
+    bytes_per_tile = tile_size * tile_size * BYTES_PER_PIXEL
+    result = LayerResult(latencies_s=[])
+    for walk in walks:
+        lru = collections.OrderedDict()
+        for x_pixel, y_pixel in walk:
+            start_s = time.perf_counter()
+            for y in range(
+                int(y_pixel) // tile_size,
+                int(y_pixel + screen.height - 1) // tile_size + 1,
+            ):
+                for x in range(
+                    int(x_pixel) // tile_size,
+                    int(x_pixel + screen.width - 1) // tile_size + 1,
+                ):
+                    if (x, y) in lru:
+                        lru.move_to_end((x, y))
+                        continue
+                    row = db.execute(
+                        "select image from tiles where x=? and y=? and z=?",
+                        (x, y, layer.layer),
+                    ).fetchone()
+                    img = None
+                    if row is not None:
+                        img = PIL.Image.open(io.BytesIO(row[0]))
+                        img.load()
+                        result.tiles += 1
+                        result.pixels += img.width * img.height
+                        result.bytes_read += len(row[0])
+                    lru[(x, y)] = img
+                    while len(lru) * bytes_per_tile > cache_bytes:
+                        lru.popitem(last=False)
+            result.latencies_s.append(time.perf_counter() - start_s)
+            result.pans += 1
+    return result
+
+
+def percentile(values_sorted: List[float], fraction: float) -> float:
+    index = min(len(values_sorted) - 1, int(fraction * len(values_sorted)))
+    return values_sorted[index]
+
+
+def read_map_layers(directory_map: pathlib.Path) -> Dict[int, OruxXmlLayer]:
+    filenames_xml = list(directory_map.glob("*.otrk2.xml"))
+    assert len(filenames_xml) == 1, filenames_xml
+    return {layer.layer: layer for layer in read_layers(filenames_xml[0])}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("directories_map", type=pathlib.Path, nargs="+")
+    parser.add_argument("--screen", type=Screen.parse, default=Screen(1080, 2340))
+    parser.add_argument("--walks", type=int, default=20)
+    parser.add_argument("--pans", type=int, default=50)
+    parser.add_argument(
+        "--pan-fraction",
+        type=float,
+        default=0.25,
+        help="The distance of a pan relative to the screen",
+    )
+    parser.add_argument("--cache-mbytes", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    maps = {
+        directory_map: read_map_layers(directory_map)
+        for directory_map in args.directories_map
+    }
+    levels = sorted(set.intersection(*(set(layers) for layers in maps.values())))
+    rnd = random.Random(args.seed)
+    for level in levels:
+        # The maps of a layer differ at the east and south border only
+        width = min(layers[level].width for layers in maps.values())
+        height = min(layers[level].height for layers in maps.values())
+        walks = create_walks(
+            rnd=rnd,
+            width=width,
+            height=height,
+            screen=args.screen,
+            walks=args.walks,
+            pans=args.pans,
+            pan_fraction=args.pan_fraction,
+        )
+        print(f"Layer {level}: {args.walks} walks of {args.pans} pans")
+        for directory_map, layers in maps.items():
+            layer = layers[level]
+            db = sqlite3.connect(
+                f"file:{directory_map / FILENAME_ORUX_DB}?mode=ro", uri=True
+            )
+            r = pan_layer(
+                db=db,
+                layer=layer,
+                walks=walks,
+                screen=args.screen,
+                cache_bytes=args.cache_mbytes * MBYTE,
+            )
+            db.close()
+            latencies_s = sorted(r.latencies_s)
+            print(
+                f"  {directory_map.name} {layer.tile_size}px: {r.tiles/r.pans:0.1f} tiles/pan, {r.pixels/r.pans/1e6:0.2f} Mpixel/pan, {r.bytes_read/r.pans/1024:0.0f} kBytes/pan, "
+                + ", ".join(
+                    f"{name} {percentile(latencies_s, fraction)*1000:0.1f}ms"
+                    for name, fraction in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99))
+                )
+                + f", max {latencies_s[-1]*1000:0.1f}ms"
+            )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
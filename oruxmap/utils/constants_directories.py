@@ -6,13 +6,23 @@ DIRECTORY_BASE = DIRECTORY_ORUX_SWISSTOPO.parent
 DIRECTORY_TARGET = DIRECTORY_BASE / "target"
 DIRECTORY_CACHE_TIF = DIRECTORY_TARGET / "cache_tif"
 DIRECTORY_CACHE_TILES = DIRECTORY_TARGET / "cache_tiles"
+DIRECTORY_CACHE_WMTS = DIRECTORY_TARGET / "cache_wmts"
 DIRECTORY_LOGS = DIRECTORY_TARGET / "logs"
 DIRECTORY_MAPS = DIRECTORY_TARGET / "maps"
 DIRECTORY_TESTRESULTS = DIRECTORY_ORUX_SWISSTOPO / "testresults"
+FILENAME_TIFF_CATALOG = DIRECTORY_TARGET / "tiff_catalog.db"
 
-DIRECTORY_TARGET.mkdir(exist_ok=True)
-DIRECTORY_CACHE_TIF.mkdir(exist_ok=True)
-DIRECTORY_CACHE_TILES.mkdir(exist_ok=True)
-DIRECTORY_LOGS.mkdir(exist_ok=True)
-DIRECTORY_MAPS.mkdir(exist_ok=True)
-assert DIRECTORY_MAPS.exists()
+
+def create_directories() -> None:
+    """
+    Called by the commands writing into 'target', not at import time.
+    """
+    for directory in (
+        DIRECTORY_TARGET,
+        DIRECTORY_CACHE_TIF,
+        DIRECTORY_CACHE_TILES,
+        DIRECTORY_CACHE_WMTS,
+        DIRECTORY_LOGS,
+        DIRECTORY_MAPS,
+    ):
+        directory.mkdir(exist_ok=True)
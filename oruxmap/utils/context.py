@@ -1,6 +1,21 @@
+import pathlib
 from dataclasses import dataclass
 from typing import List
 
+from oruxmap.utils.projection import BoundsCH1903
+
+# tiffs -> subtiles -> tiles
+ENGINE_SUBTILES = "subtiles"
+# tiffs -> tiles, see 'MapScale.sqlite_mosaic_tiles()'
+ENGINE_MOSAIC = "mosaic"
+# WMTS tiles -> tiles, see 'MapScale.sqlite_wmts_tiles()'.
+# Fetches only the tiles of 'Context.only_boundsCH1903' instead of whole tiffs.
+ENGINE_WMTS = "wmts"
+
+# The storage of 'cache_tiles', see 'tile_storage.py'
+STORAGE_SQLITE = "sqlite"
+STORAGE_PACK = "pack"
+
 
 @dataclass
 class Context:
@@ -9,17 +24,62 @@ class Context:
     skip_tiff_read: bool = False
     only_example_tiles: bool = False
     only_tiffs: List[str] = None
+    # Only the tiles intersecting these bounds. See 'BoundsCH1903.from_WGS84()'
+    only_boundsCH1903: BoundsCH1903 = None
     only_tiles_border: int = None
     only_tiles_modulo: int = None
     skip_sqlite_vacuum: bool = False
     skip_map_zip: bool = False
+    # Validate the map before it is zipped, see 'map_validate.py'
+    skip_map_validate: bool = False
+    # The directory of the previous release of the map. If set, a patch
+    # '<map_name>-patch.db' is written next to the map, see 'map_delta.py'
+    delta_from: pathlib.Path = None
+    engine: str = ENGINE_SUBTILES
+    # None: The map gets the tiles of the cache, 'LayerParams.pixel_per_tile'.
+    # Else: The tiles are cut into tiles of this size, for example 256 or 512,
+    # which are decoded faster on the phone. See 'MapScale.sqlite_retile()'.
+    orux_pixel_per_tile: int = None
+    tile_storage: str = STORAGE_SQLITE
+    # The layers are written into partial orux dbs by worker processes
+    # and merged into 'OruxMapsImages.db', see 'LayerParams.orux_shards'.
+    # Only applied to STORAGE_PACK, see 'use_partial_orux_dbs()'
+    partial_orux_dbs: bool = False
     multiprocessing: bool = True
+    # None: os.cpu_count()
+    max_workers: int = None
+    # None: No limit. Else: Limits the decoded tiffs in memory of all processes
+    memory_budget_bytes: int = None
+    # Threads decoding the subtiles in 'sqlite_subtiles_to_tiles()'
+    decode_threads: int = 4
+    # Threads reading one tiff in horizontal bands. Useful for the
+    # layers consisting of one huge tiff like 1:500k and 1:1M.
+    sheet_workers: int = 1
+    # Rewrite the downloaded tiffs as tiled GeoTIFF with overviews,
+    # see 'tiff_normalize.py'
+    normalize_tiffs: bool = False
+    # Engine 'wmts': None for 'wmts.WMTS_URL'. Placeholders: {layer}, {zoom}, {col}, {row}
+    wmts_url: str = None
+    wmts_max_connections: int = 8
+    # None: No limit
+    wmts_requests_per_s: float = 20.0
+    # Remove the tiffs and the subtiles as soon as they are processed
     save_diskspace: bool = False
+    # None: No limit. Else: Limits 'cache_tif' and 'cache_tiles'
+    diskspace_quota_bytes: int = None
+    # The stages write 'logs/progress_<layer>_<stage>.json' at most this often,
+    # see 'progress.py'. None: No progress is written
+    progress_interval_s: float = 5.0
 
     def skip_count(self, count) -> int:
         return len(list(self.range(count)))
 
     def range(self, count):
+        """
+        Used for fast sampling builds. Applied to the tile columns and
+        the tile rows of every tiff: only_tiles_border selects the tiles at
+        the corners of the tiffs, only_tiles_modulo every n-th tile.
+        """
         if self.only_tiles_border:
             for i in range(count):
                 skip = self.only_tiles_border <= i < count - self.only_tiles_border
@@ -34,12 +94,31 @@ class Context:
 
         yield from range(count)
 
+    def use_partial_orux_dbs(self) -> bool:
+        """
+        The tiles of a pack file are copied into 'OruxMapsImages.db' by python:
+        The partial orux dbs spread this over the worker processes.
+        The tiles of a sqlite cache are copied by sqlite itself, see
+        'SqliteOrux.insert_attached()'. Partial orux dbs would copy every tile
+        twice and the merge is serial: This is slower.
+        """
+        return self.partial_orux_dbs and (self.tile_storage == STORAGE_PACK)
+
     def append_version(self, basename: str) -> str:
         parts = [
             basename,
         ]
         if self.skip_optimize_png:
             parts.append("skip_optimize")
+        if self.skip_tiff_read:
+            parts.append("skip_tiff_read")
+        if self.skip_png_write:
+            parts.append("skip_png_write")
         if self.only_tiles_border or self.only_tiles_modulo:
             parts.append("subset")
+        if self.only_boundsCH1903 is not None:
+            bounds_km = [
+                f"{v/1000.0:0.0f}" for v in self.only_boundsCH1903._iter_value
+            ]
+            parts.append("bbox_" + "_".join(bounds_km))
         return "-".join(parts)
@@ -0,0 +1,157 @@
+import math
+from dataclasses import dataclass
+from typing import Iterable, List
+
+import numpy as np
+import PIL.Image
+
+from oruxmap.utils.constants_directories import DIRECTORY_BASE, DIRECTORY_LOGS
+from oruxmap.utils.tiff_catalog import TiffSheet
+
+# The pixels of 'coverage_<layer>.png', one pixel per tile
+COLOR_NONE = 0
+COLOR_WRITTEN = 1
+COLOR_DROPPED = 2
+COLOR_UNPROCESSED = 3
+PALETTE = (
+    (255, 255, 255),  # No tiff
+    (150, 150, 150),  # Written
+    (255, 0, 0),  # Dropped, only partially covered by tiffs
+    (255, 160, 0),  # Covered by a sheet which was not processed
+)
+
+STATUS_DROPPED = "dropped"
+STATUS_UNPROCESSED = "unprocessed"
+
+
+@dataclass
+class DroppedTile:
+    nw_east_m: int
+    nw_north_m: int
+    # The share of the tile covered by tiffs
+    coverage: float
+
+
+class CoverageReport:
+    """
+    Accounts the tiles of a layer which are not written as they are only
+    partially covered by tiffs: at the border of the country or next to a
+    missing sheet. The tiles are identified by the north west corner of
+    their cell in the tile grid of the layer.
+
+    'write()' adds the tiles covered by sheets of the catalog which were not
+    processed, for example because they are not downloaded.
+    """
+
+    def __init__(self, layer_name: str, m_per_tile: int):
+        assert isinstance(m_per_tile, int)
+        self.layer_name = layer_name
+        self.m_per_tile = m_per_tile
+        self.dropped: List[DroppedTile] = []
+
+    def drop(self, nw_east_m: int, nw_north_m: int, coverage: float) -> None:
+        self.dropped.append(
+            DroppedTile(nw_east_m=nw_east_m, nw_north_m=nw_north_m, coverage=coverage)
+        )
+
+    def _sheet_cells(self, sheet: TiffSheet):
+        """
+        The columns and rows of the cells intersecting the sheet.
+        The row is the north of the cell divided by 'm_per_tile'.
+        """
+        m = self.m_per_tile
+        columns = range(math.floor(sheet.nw_east_m / m), math.ceil(sheet.se_east_m / m))
+        rows = range(
+            math.floor(sheet.se_north_m / m) + 1, math.ceil(sheet.nw_north_m / m) + 1
+        )
+        return columns, rows
+
+    def _intersecting(self, sheets: List[TiffSheet], column: int, row: int) -> str:
+        names = []
+        for sheet in sheets:
+            columns, rows = self._sheet_cells(sheet)
+            if column in columns and row in rows:
+                names.append(sheet.name)
+        return ";".join(names)
+
+    def write(
+        self,
+        written_east_m: np.ndarray,
+        written_north_m: np.ndarray,
+        sheets: List[TiffSheet],
+        processed: Iterable[str],
+    ) -> None:
+        """
+        Writes 'coverage_<layer>.csv' and 'coverage_<layer>.png' to DIRECTORY_LOGS.
+        'sheets': The sheets of the layer in the catalog.
+        'processed': The names of the sheets the tiles were created from.
+        """
+        m = self.m_per_tile
+        processed = set(processed)
+        sheets_processed = [s for s in sheets if s.name in processed]
+        sheets_unprocessed = [s for s in sheets if s.name not in processed]
+
+        # cells: column, row
+        written = (
+            np.floor_divide(written_east_m, m),
+            -np.floor_divide(-written_north_m, m),
+        )
+        dropped = (
+            np.array([t.nw_east_m // m for t in self.dropped], dtype=np.int64),
+            np.array([-(-t.nw_north_m // m) for t in self.dropped], dtype=np.int64),
+        )
+        columns = [written[0], dropped[0]]
+        rows = [written[1], dropped[1]]
+        for sheet in sheets_unprocessed:
+            sheet_columns, sheet_rows = self._sheet_cells(sheet)
+            columns.append(np.array([sheet_columns.start, sheet_columns.stop - 1]))
+            rows.append(np.array([sheet_rows.start, sheet_rows.stop - 1]))
+        columns = np.concatenate(columns)
+        rows = np.concatenate(rows)
+        filename_csv = DIRECTORY_LOGS / f"coverage_{self.layer_name}.csv"
+        filename_png = DIRECTORY_LOGS / f"coverage_{self.layer_name}.png"
+        if len(columns) == 0:
+            # For example an empty region of interest: Remove a previous report
+            filename_csv.unlink(missing_ok=True)
+            filename_png.unlink(missing_ok=True)
+            print(f"Coverage {self.layer_name}: No tiles")
+            return
+        min_column, max_column = columns.min(), columns.max()
+        min_row, max_row = rows.min(), rows.max()
+
+        # The image is north up: The y of a cell is 'max_row - row'
+        grid = np.full(
+            (max_row - min_row + 1, max_column - min_column + 1),
+            COLOR_NONE,
+            dtype=np.uint8,
+        )
+        for sheet in sheets_unprocessed:
+            sheet_columns, sheet_rows = self._sheet_cells(sheet)
+            grid[
+                max_row - (sheet_rows.stop - 1) : max_row - sheet_rows.start + 1,
+                sheet_columns.start - min_column : sheet_columns.stop - min_column,
+            ] = COLOR_UNPROCESSED
+        grid[max_row - dropped[1], dropped[0] - min_column] = COLOR_DROPPED
+        grid[max_row - written[1], written[0] - min_column] = COLOR_WRITTEN
+
+        with filename_csv.open("w") as f:
+            f.write("nw_east_m,nw_north_m,status,coverage,sheets,sheets_unprocessed\n")
+            for tile in self.dropped:
+                column, row = tile.nw_east_m // m, -(-tile.nw_north_m // m)
+                f.write(
+                    f"{column*m},{row*m},{STATUS_DROPPED},{tile.coverage:0.3f},{self._intersecting(sheets_processed, column, row)},{self._intersecting(sheets_unprocessed, column, row)}\n"
+                )
+            y_unprocessed, x_unprocessed = np.nonzero(grid == COLOR_UNPROCESSED)
+            for y, x in zip(y_unprocessed.tolist(), x_unprocessed.tolist()):
+                column, row = x + int(min_column), int(max_row) - y
+                f.write(
+                    f"{column*m},{row*m},{STATUS_UNPROCESSED},0.000,,{self._intersecting(sheets_unprocessed, column, row)}\n"
+                )
+
+        img = PIL.Image.fromarray(grid, mode="P")
+        img.putpalette([v for color in PALETTE for v in color])
+        img.save(filename_png)
+
+        print(
+            f"Coverage {self.layer_name}: {len(written[0])} tiles written, {len(self.dropped)} dropped, {len(y_unprocessed)} of unprocessed sheets, see {filename_csv.relative_to(DIRECTORY_BASE)}"
+        )
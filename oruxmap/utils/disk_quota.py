@@ -0,0 +1,84 @@
+import os
+import time
+import pathlib
+from typing import Iterable, List
+
+from oruxmap.utils.constants_directories import DIRECTORY_BASE
+
+GBYTE = 1024 ** 3
+
+# The files next to a sqlite db or a pack file, see 'tile_storage.py'
+SIDECAR_SUFFIXES = ("-wal", "-shm", "-journal", "-idx", "-checkpoints")
+
+
+def touch_atime(filename: pathlib.Path) -> None:
+    """
+    Mark the file as recently used. The mtime is not changed.
+    """
+    stat = filename.stat()
+    os.utime(filename, ns=(time.time_ns(), stat.st_mtime_ns))
+
+
+class DiskQuota:
+    """
+    Keeps the files in 'directories' below 'quota_bytes'
+    by removing the least recently used files.
+    Files which are written ('.tmp') or are protected are never removed.
+    This includes their sidecar files like '-wal' and '-idx'.
+    """
+
+    def __init__(self, directories: List[pathlib.Path], quota_bytes: int):
+        assert isinstance(quota_bytes, int)
+        self.directories = directories
+        self.quota_bytes = quota_bytes
+
+    def _iter_files(self) -> Iterable[pathlib.Path]:
+        for directory in self.directories:
+            for filename in directory.rglob("*"):
+                if filename.is_file():
+                    yield filename
+
+    @staticmethod
+    def _is_protected(filename: pathlib.Path, protect: set) -> bool:
+        # 'tiles.db-wal' -> 'tiles.db'
+        name = filename.name
+        for suffix in SIDECAR_SUFFIXES:
+            if name.endswith(suffix):
+                name = name[: -len(suffix)]
+                break
+        if name.endswith(".tmp"):
+            return True
+        return filename.with_name(name) in protect
+
+    def enforce(self, protect: Iterable[pathlib.Path] = ()) -> None:
+        protect = set(protect)
+        total_bytes = 0
+        candidates = []
+        for filename in self._iter_files():
+            try:
+                stat = filename.stat()
+            except FileNotFoundError:
+                # Removed by another process
+                continue
+            total_bytes += stat.st_size
+            if self._is_protected(filename=filename, protect=protect):
+                continue
+            last_used_s = max(stat.st_atime, stat.st_mtime)
+            candidates.append((last_used_s, stat.st_size, filename))
+
+        if total_bytes <= self.quota_bytes:
+            return
+
+        for _last_used_s, size_bytes, filename in sorted(candidates):
+            if total_bytes <= self.quota_bytes:
+                break
+            print(
+                f"Disk quota: remove {filename.relative_to(DIRECTORY_BASE)} ({size_bytes/GBYTE:0.1f} GBytes)"
+            )
+            filename.unlink(missing_ok=True)
+            total_bytes -= size_bytes
+
+        if total_bytes > self.quota_bytes:
+            print(
+                f"Disk quota: WARNING: {total_bytes/GBYTE:0.1f} GBytes used by files in use, quota is {self.quota_bytes/GBYTE:0.1f} GBytes"
+            )
@@ -0,0 +1,56 @@
+import io
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import PIL.Image
+
+FORMAT_PNG = "PNG"
+FORMAT_JPEG = "JPEG"
+
+
+@dataclass(frozen=True)
+class TileCodec:
+    """
+    The image format of the tiles written into 'cache_tiles' and 'OruxMapsImages.db'.
+    PNG is lossless (palette), JPEG is lossy and requires a 'quality'.
+    """
+
+    format: str = FORMAT_PNG
+    quality: int = None
+
+    def __post_init__(self):
+        assert self.format in (FORMAT_PNG, FORMAT_JPEG)
+        if self.format == FORMAT_PNG:
+            assert self.quality is None
+            return
+        assert isinstance(self.quality, int)
+        assert 1 <= self.quality <= 100
+
+    @property
+    def name(self) -> str:
+        if self.format == FORMAT_PNG:
+            return "png"
+        return f"{self.format.lower()}{self.quality}"
+
+    def tobytes(self, img: "PIL.Image.Image", skip_optimize_png: bool) -> bytes:
+        if self.format == FORMAT_PNG:
+            # Not imported by the module: The layers are listed without PIL,
+            # see 'layers_switzerland.py'
+            # pylint: disable=import-outside-toplevel
+            from oruxmap.utils.img_png import convert_to_png_raw
+
+            return convert_to_png_raw(img=img, skip_optimize_png=skip_optimize_png)
+
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        with io.BytesIO() as fOut:
+            # See 'doc/README_evaluation.md', 10k: png 182GBytes
+            # quality=30: 24GBytes, good quality, little jpg macciato
+            # quality=15: 15GBytes
+            img.save(fOut, format="JPEG", quality=self.quality, optimize=False)
+            return fOut.getvalue()
+
+
+CODEC_PNG = TileCodec()
+CODEC_JPEG_30 = TileCodec(format=FORMAT_JPEG, quality=30)
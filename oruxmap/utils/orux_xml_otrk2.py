@@ -1,5 +1,11 @@
 import pathlib
-from oruxmap.utils.projection import BoundsWGS84
+import xml.etree.ElementTree
+from dataclasses import dataclass
+from typing import Dict, List
+
+from oruxmap.utils.projection import BoundsWGS84, WGS84
+
+NAMESPACE = "{http://oruxtracker.com/app/res/calibration}"
 
 TEMPLATE_LAYER_BEGIN = """    <OruxTracker xmlns="http://oruxtracker.com/app/res/calibration" versionCode="3.0">
       <MapCalibration layers="false" layerLevel="{id}">
@@ -53,3 +59,48 @@ class OruxXmlOtrk2:
     def close(self):
         self.f.write(TEMPLATE_MAIN_END)
         self.f.close()
+
+
+@dataclass
+class OruxXmlLayer:
+    """
+    One layer as written by 'OruxXmlOtrk2.write_layer()'.
+    """
+
+    layer: int
+    xMax: int
+    yMax: int
+    tile_size: int
+    width: int
+    height: int
+    # "TL", "BR", "TR", "BL"
+    corners: Dict[str, WGS84]
+
+
+def read_layers(filename: pathlib.Path) -> List[OruxXmlLayer]:
+    root = xml.etree.ElementTree.parse(filename).getroot()
+    layers = []
+    for calibration in root.iter(f"{NAMESPACE}MapCalibration"):
+        chunks = calibration.find(f"{NAMESPACE}MapChunks")
+        if chunks is None:
+            # The main calibration containing the layers
+            continue
+        dimensions = calibration.find(f"{NAMESPACE}MapDimensions")
+        corners = {
+            point.get("corner"): WGS84(
+                lon_deg=float(point.get("lon")), lat_deg=float(point.get("lat"))
+            )
+            for point in calibration.iter(f"{NAMESPACE}CalibrationPoint")
+        }
+        layers.append(
+            OruxXmlLayer(
+                layer=int(calibration.get("layerLevel")),
+                xMax=int(chunks.get("xMax")),
+                yMax=int(chunks.get("yMax")),
+                tile_size=int(chunks.get("img_width")),
+                width=int(dimensions.get("width")),
+                height=int(dimensions.get("height")),
+                corners=corners,
+            )
+        )
+    return layers
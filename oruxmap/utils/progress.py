@@ -0,0 +1,198 @@
+import os
+import json
+import time
+import datetime
+import collections
+from typing import Optional
+
+from oruxmap.utils.constants_directories import DIRECTORY_LOGS
+
+MBYTE = 1024 ** 2
+
+STATE_RUNNING = "running"
+STATE_DONE = "done"
+STATE_FAILED = "failed"
+
+
+def _isoformat(timestamp_s: float) -> str:
+    return datetime.datetime.fromtimestamp(timestamp_s).isoformat(timespec="seconds")
+
+
+class Progress:
+    """
+    The live progress of one stage of one layer, written to
+    'progress_<layer>_<stage>.json' in DIRECTORY_LOGS. Watch it by
+    'watch cat target/logs/progress_*.json'.
+
+    'add_tile()' is called for every tile written and only counts: The file
+    is rewritten at most every 'interval_s' seconds. The rates are averaged
+    over the last 'window_s' seconds.
+
+    'tiles_total' may be an estimate. If it is None, it is extrapolated
+    from the tiles per sheet done so far.
+    """
+
+    def __init__(
+        self,
+        layer: str,
+        stage: str,
+        interval_s: float = 5.0,
+        window_s: float = 60.0,
+        print_interval_s: float = 60.0,
+    ):
+        self.layer = layer
+        self.stage = stage
+        self.interval_s = interval_s
+        self.window_s = window_s
+        self.print_interval_s = print_interval_s
+        self.filename = DIRECTORY_LOGS / f"progress_{layer}_{stage}.json"
+        self.sheets_total: Optional[int] = None
+        self.tiles_total: Optional[int] = None
+        self.sheets_done = 0
+        self.tiles_done = 0
+        self.bytes_written = 0
+        self.start_time_s = time.time()
+        self.start_s = time.monotonic()
+        self._next_write_s = self.start_s + interval_s
+        self._next_print_s = self.start_s + print_interval_s
+        # (monotonic_s, tiles_done, bytes_written)
+        self._samples = collections.deque([(self.start_s, 0, 0)])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _type, value, tb):
+        state = STATE_DONE if tb is None else STATE_FAILED
+        self.write(state=state)
+        print(self.summary(state=state))
+
+    def set_totals(self, sheets: int = None, tiles: int = None) -> None:
+        self.sheets_total = sheets
+        self.tiles_total = tiles
+        self.write()
+
+    def resume(self, sheets: int = 0, tiles: int = 0) -> None:
+        """
+        The work done by a previous, interrupted run.
+        """
+        self.sheets_done += sheets
+        self.tiles_done += tiles
+        self._samples = collections.deque([(time.monotonic(), self.tiles_done, 0)])
+
+    def add_tile(self, nbytes: int) -> None:
+        self.tiles_done += 1
+        self.bytes_written += nbytes
+        now_s = time.monotonic()
+        if now_s >= self._next_write_s:
+            self._tick(now_s)
+
+    def add_sheet(self) -> None:
+        self.sheets_done += 1
+        self._tick(time.monotonic())
+
+    def _tick(self, now_s: float) -> None:
+        self._next_write_s = now_s + self.interval_s
+        self._samples.append((now_s, self.tiles_done, self.bytes_written))
+        while now_s - self._samples[1][0] > self.window_s:
+            self._samples.popleft()
+        self.write()
+        if now_s >= self._next_print_s:
+            self._next_print_s = now_s + self.print_interval_s
+            print(self.summary())
+
+    @property
+    def tiles_estimated(self) -> Optional[int]:
+        if self.tiles_total is not None:
+            return max(self.tiles_total, self.tiles_done)
+        if (self.sheets_total is None) or (self.sheets_done == 0):
+            return None
+        return round(self.tiles_done * self.sheets_total / self.sheets_done)
+
+    def rates(self):
+        """
+        Returns tiles_per_s and mbytes_per_s over the last 'window_s'.
+        """
+        start_s, start_tiles, start_bytes = self._samples[0]
+        duration_s = time.monotonic() - start_s
+        if duration_s <= 0.0:
+            return 0.0, 0.0
+        tiles_per_s = (self.tiles_done - start_tiles) / duration_s
+        mbytes_per_s = (self.bytes_written - start_bytes) / MBYTE / duration_s
+        return tiles_per_s, mbytes_per_s
+
+    def eta_s(self, tiles_per_s: float) -> Optional[float]:
+        tiles_estimated = self.tiles_estimated
+        if (tiles_estimated is None) or (tiles_per_s <= 0.0):
+            return None
+        return (tiles_estimated - self.tiles_done) / tiles_per_s
+
+    def status(self, state: str = STATE_RUNNING) -> dict:
+        tiles_per_s, mbytes_per_s = self.rates()
+        eta_s = None
+        tiles_total = self.tiles_estimated
+        if state == STATE_RUNNING:
+            eta_s = self.eta_s(tiles_per_s)
+        elif state == STATE_DONE:
+            # The estimate includes tiles dropped at the border
+            tiles_total = self.tiles_done
+        return {
+            "layer": self.layer,
+            "stage": self.stage,
+            "state": state,
+            "pid": os.getpid(),
+            "started": _isoformat(self.start_time_s),
+            "updated": _isoformat(time.time()),
+            "elapsed_s": round(time.monotonic() - self.start_s, 1),
+            "sheets_done": self.sheets_done,
+            "sheets_total": self.sheets_total,
+            "tiles_done": self.tiles_done,
+            "tiles_total": tiles_total,
+            "mbytes_written": round(self.bytes_written / MBYTE, 1),
+            "tiles_per_s": round(tiles_per_s, 2),
+            "mbytes_per_s": round(mbytes_per_s, 3),
+            "eta_s": None if eta_s is None else round(eta_s),
+            "eta": None if eta_s is None else _isoformat(time.time() + eta_s),
+        }
+
+    def write(self, state: str = STATE_RUNNING) -> None:
+        # Written atomically: The file may be read at any time
+        filename_tmp = self.filename.with_name(self.filename.name + ".tmp")
+        filename_tmp.write_text(json.dumps(self.status(state=state), indent=2))
+        filename_tmp.replace(self.filename)
+
+    def summary(self, state: str = STATE_RUNNING) -> str:
+        s = self.status(state=state)
+        text = f"Progress {self.layer} {self.stage} {state}: "
+        if s["sheets_total"] is not None:
+            text += f"{s['sheets_done']}/{s['sheets_total']} sheets, "
+        text += f"{s['tiles_done']}/{s['tiles_total'] or '?'} tiles, {s['tiles_per_s']:0.1f} tiles/s, {s['mbytes_per_s']:0.2f} MBytes/s"
+        if s["eta_s"] is not None:
+            text += f", eta {datetime.timedelta(seconds=s['eta_s'])}"
+        return text
+
+
+class _NoProgress(Progress):
+    """
+    Used outside of 'run_stage()' and if 'Context.progress_interval_s' is None.
+    """
+
+    def __init__(self):
+        super().__init__(layer="-", stage="-")
+
+    def __exit__(self, _type, value, tb):
+        pass
+
+    def resume(self, sheets: int = 0, tiles: int = 0) -> None:
+        pass
+
+    def add_tile(self, nbytes: int) -> None:
+        pass
+
+    def add_sheet(self) -> None:
+        pass
+
+    def write(self, state: str = STATE_RUNNING) -> None:
+        pass
+
+
+NO_PROGRESS = _NoProgress()
@@ -188,6 +188,35 @@ class BoundsCH1903:
     def csv_header(name: str) -> str:
         return f"{name}.nw.lon_m,{name}.nw.lat_m,{name}.se.lon_m,{name}.se.lat_m"
 
+    def intersects(self, bounds: "BoundsCH1903") -> bool:
+        assert isinstance(bounds, BoundsCH1903)
+        return (
+            self.nw.lon_m < bounds.se.lon_m
+            and bounds.nw.lon_m < self.se.lon_m
+            and self.se.lat_m < bounds.nw.lat_m
+            and bounds.se.lat_m < self.nw.lat_m
+        )
+
+    @staticmethod
+    def from_WGS84(northWest: "WGS84", southEast: "WGS84") -> "BoundsCH1903":
+        """The smallest bounds which contain the WGS84 rectangle"""
+        assertWGS84IsNorthWest(northWest, southEast)
+        corners = [
+            WGS84(lon_deg=lon_deg, lat_deg=lat_deg).to_CH1903()
+            for lon_deg in (northWest.lon_deg, southEast.lon_deg)
+            for lat_deg in (northWest.lat_deg, southEast.lat_deg)
+        ]
+        return BoundsCH1903(
+            nw=CH1903(
+                lon_m=min(c.lon_m for c in corners),
+                lat_m=max(c.lat_m for c in corners),
+            ),
+            se=CH1903(
+                lon_m=max(c.lon_m for c in corners),
+                lat_m=min(c.lat_m for c in corners),
+            ),
+        )
+
     def floor(self, floor_m: float, valid_data=True):
         """Cut incomplete tiles from top, left, bottom and right"""
         return BoundsCH1903(
@@ -253,6 +282,29 @@ class WGS84:
         assert 3.3 < self.lon_deg < 19.0
         assert 40.0 < self.lat_deg < 55.0
 
+    def to_CH1903(self, valid_data=True) -> CH1903:
+        """
+        Inverse of 'CH1903.to_WGS84()', see naeherung_d.pdf
+        """
+        phi = (self.lat_deg * 3600.0 - 169028.66) / 10000.0
+        lam = (self.lon_deg * 3600.0 - 26782.5) / 10000.0
+        lon_m = (
+            2_600_072.37
+            + 211_455.93 * lam
+            - 10_938.51 * lam * phi
+            - 0.36 * lam * phi * phi
+            - 44.54 * lam * lam * lam
+        )
+        lat_m = (
+            1_200_147.07
+            + 308_807.95 * phi
+            + 3_745.25 * lam * lam
+            + 76.63 * phi * phi
+            - 194.56 * lam * lam * phi
+            + 119.79 * phi * phi * phi
+        )
+        return CH1903(lon_m=lon_m, lat_m=lat_m, valid_data=valid_data)
+
 
 class BoundsWGS84:
     def __init__(
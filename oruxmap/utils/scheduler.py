@@ -0,0 +1,174 @@
+import os
+import contextlib
+import multiprocessing
+import concurrent.futures
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List
+
+GBYTE = 1024 ** 3
+
+
+class MemoryBudget:
+    """
+    Limits the sum of the memory used by jobs running in parallel processes.
+    A job is admitted if it fits into the budget. A job which exceeds
+    the budget on its own is admitted as soon as no other job is running.
+    """
+
+    def __init__(self, budget_bytes: int):
+        assert isinstance(budget_bytes, int)
+        self.budget_bytes = budget_bytes
+        self._condition = multiprocessing.Condition()
+        self._used_bytes = multiprocessing.Value("q", 0, lock=False)
+
+    def _log(self, verb: str, name: str, nbytes: int) -> None:
+        print(
+            f"Memory budget: {verb} {name} {nbytes/GBYTE:0.1f} GBytes, in use {self._used_bytes.value/GBYTE:0.1f}/{self.budget_bytes/GBYTE:0.1f} GBytes"
+        )
+
+    @contextlib.contextmanager
+    def admit(self, name: str, nbytes: int):
+        with self._condition:
+            while (self._used_bytes.value > 0) and (
+                self._used_bytes.value + nbytes > self.budget_bytes
+            ):
+                self._condition.wait()
+            self._used_bytes.value += nbytes
+            self._log("admitted", name, nbytes)
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._used_bytes.value -= nbytes
+                self._log("released", name, nbytes)
+                self._condition.notify_all()
+
+
+class _NoMemoryBudget:
+    @contextlib.contextmanager
+    def admit(self, name: str, nbytes: int):
+        yield
+
+
+_memory_budget = _NoMemoryBudget()
+
+
+def memory_budget():
+    """
+    The budget shared by all processes of the DagScheduler.
+    """
+    return _memory_budget
+
+
+def set_memory_budget(budget) -> None:
+    """
+    Used as 'initializer' of process pools which share the budget.
+    """
+    global _memory_budget  # pylint: disable=global-statement
+    _memory_budget = budget
+
+
+@dataclass
+class Task:
+    """
+    One stage of one layer, for example 'subtiles 0025'.
+
+    'func' and 'args' have to be picklable as the task might run in a worker process.
+    'is_done' returns True if the cached output of the task already exists.
+    'serial' tasks always run in the main process, one after the other.
+    """
+
+    name: str
+    func: Callable
+    args: tuple = ()
+    dependencies: List[str] = field(default_factory=list)
+    is_done: Callable[[], bool] = None
+    serial: bool = False
+
+    @property
+    def cached(self) -> bool:
+        if self.is_done is None:
+            return False
+        return self.is_done()
+
+
+class DagScheduler:
+    def __init__(
+        self,
+        multiprocessing: bool,
+        max_workers: int = None,
+        memory_budget_bytes: int = None,
+    ):
+        self.multiprocessing = multiprocessing
+        self.max_workers = max_workers or os.cpu_count()
+        self.budget = _NoMemoryBudget()
+        if memory_budget_bytes is not None:
+            self.budget = MemoryBudget(budget_bytes=memory_budget_bytes)
+        self.tasks: Dict[str, Task] = {}
+
+    def add(self, task: Task) -> None:
+        assert isinstance(task, Task)
+        assert task.name not in self.tasks
+        for dependency in task.dependencies:
+            # The tasks have to be added in topological order
+            assert dependency in self.tasks, dependency
+        self.tasks[task.name] = task
+
+    def _needed_tasks(self) -> List[Task]:
+        """
+        A task has to run if its output is not cached and
+        if it is required by a task which has to run.
+        """
+        needed = set()
+        for task in reversed(list(self.tasks.values())):
+            if task.cached:
+                continue
+            dependents = [t for t in self.tasks.values() if task.name in t.dependencies]
+            if len(dependents) == 0 or any(t.name in needed for t in dependents):
+                needed.add(task.name)
+        return [task for task in self.tasks.values() if task.name in needed]
+
+    def run(self) -> None:
+        pending = self._needed_tasks()
+        done = set(self.tasks) - set(task.name for task in pending)
+
+        set_memory_budget(self.budget)
+        if not self.multiprocessing:
+            for task in pending:
+                task.func(*task.args)
+            return
+
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            initializer=set_memory_budget,
+            initargs=(self.budget,),
+        ) as executor:
+            running = {}
+
+            def is_ready(task: Task) -> bool:
+                return all(d in done for d in task.dependencies)
+
+            while len(pending) > 0 or len(running) > 0:
+                for task in [t for t in pending if is_ready(t) and not t.serial]:
+                    pending.remove(task)
+                    future = executor.submit(task.func, *task.args)
+                    running[future] = task
+
+                serial_tasks = [t for t in pending if is_ready(t) and t.serial]
+                if len(serial_tasks) > 0:
+                    # The worker processes continue while the main process is busy
+                    task = serial_tasks[0]
+                    pending.remove(task)
+                    task.func(*task.args)
+                    done.add(task.name)
+                    continue
+
+                assert len(running) > 0, "Cyclic dependencies"
+                finished, _ = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in finished:
+                    task = running.pop(future)
+                    # Raises the exception of the worker process
+                    future.result()
+                    done.add(task.name)
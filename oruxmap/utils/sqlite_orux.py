@@ -1,5 +1,10 @@
 import pathlib
 import sqlite3
+from typing import Iterable, Tuple
+
+from oruxmap.utils.tile_storage import TileRange
+
+FILENAME_ORUX_DB = "OruxMapsImages.db"
 
 
 class SqliteOrux:
@@ -27,16 +32,67 @@ class SqliteOrux:
     def close(self) -> None:
         self.db.close()
 
-    def insert(
-        self, x_tile_offset: int, y_tile_offset: int, orux_layer: int, img
+    def insert_attached(  # pylint: disable=too-many-arguments
+        self,
+        filename_tiles: pathlib.Path,
+        tile_range: TileRange,
+        orux_layer: int,
+        nw_east_m: int,
+        nw_north_m: int,
+        m_per_tile: int,
     ) -> None:
-        b = sqlite3.Binary(img)
+        """
+        Copies the tiles of a sqlite tile cache by one 'insert ... select'.
+        The tile offsets are calculated by sqlite relative to the
+        north west corner of the layer: the images never pass through python.
+        """
+        # 'attach' is not allowed within a transaction
+        self.db.commit()
+        self.db.execute("attach database ? as cache", (str(filename_tiles),))
         self.db.execute(
+            f"""insert into tiles
+                select (nw_east_m - ?) / ?, (? - nw_north_m) / ?, ?, image
+                from cache.tiles where {tile_range.sql_where()}
+                order by nw_east_m, nw_north_m desc""",
+            (nw_east_m, m_per_tile, nw_north_m, m_per_tile, orux_layer),
+        )
+        self.db.commit()
+        self.db.execute("detach database cache")
+
+    def insert_rows(  # pylint: disable=too-many-arguments
+        self,
+        rows: Iterable[Tuple[int, int, bytes]],
+        orux_layer: int,
+        nw_east_m: int,
+        nw_north_m: int,
+        m_per_tile: int,
+    ) -> None:
+        """
+        Like 'insert_attached()' for tile caches which are not sqlite.
+        The images may be memoryviews of a memory mapped file:
+        sqlite reads them without a copy.
+        """
+        self.db.executemany(
             "insert into tiles values (?,?,?,?)",
             (
-                x_tile_offset,  # png.x_tile + x_tile_offset,
-                y_tile_offset,  # png.y_tile + y_tile_offset,
-                orux_layer,
-                b,
+                (
+                    (tile_east_m - nw_east_m) // m_per_tile,
+                    (nw_north_m - tile_north_m) // m_per_tile,
+                    orux_layer,
+                    img,
+                )
+                for tile_east_m, tile_north_m, img in rows
             ),
         )
+
+    def insert_partial(self, filename_partial: pathlib.Path) -> None:
+        """
+        Copies all tiles of a partial orux db in the order of the primary key.
+        """
+        self.db.commit()
+        self.db.execute("attach database ? as partial", (str(filename_partial),))
+        self.db.execute(
+            "insert into tiles select x, y, z, image from partial.tiles order by x, y, z"
+        )
+        self.db.commit()
+        self.db.execute("detach database partial")
@@ -1,33 +1,56 @@
 import io
 import pathlib
-import sqlite3
+import itertools
+import collections
+import concurrent.futures
+from typing import List, Tuple
+
+import numpy as np
 import PIL.Image
 
-from oruxmap.utils.img_png import convert_to_png_raw
+from oruxmap.utils.img_codec import TileCodec, CODEC_PNG
+from oruxmap.utils.progress import Progress, NO_PROGRESS
+from oruxmap.utils.tile_storage import TileRange, TILE_RANGE_ALL, storage_for
 
 
 class _SqliteTilesBase:
+    """
+    The tiles are stored in a 'TileStorage' selected by the suffix
+    of 'filename_sqlite', see 'tile_storage.storage_for()'.
+    The tiles added are counted by 'progress'.
+    """
+
     def __init__(
-        self, filename_sqlite: pathlib.Path, pixel_per_tile: int, create=False
+        self,
+        filename_sqlite: pathlib.Path,
+        pixel_per_tile: int,
+        create=False,
+        progress: Progress = NO_PROGRESS,
     ):
+        self.storage = storage_for(filename_sqlite)
         self.filename_sqlite = filename_sqlite
-        self.filename_sqlite_tmp = filename_sqlite.with_suffix(".tmp")
+        self.filename_sqlite_tmp = filename_sqlite.with_name(
+            filename_sqlite.stem + self.storage.TMP_SUFFIX
+        )
         self.pixel_per_tile = pixel_per_tile
         self.create = create
-        self.db = None
+        self.progress = progress
+        self.connected = False
+        self._placeholder_raw = None
 
     def __enter__(self):
         return self
 
     def __exit__(self, _type, value, tb):
-        assert self.db is not None
-        self.db.commit()
-        # print(f"{self.filename_sqlite.relative_to(DIRECTORY_BASE)}: {self.select_int('count(*)')} records.")
-        self.db.close()
-        self.db = None
+        assert self.connected
+        self.storage.close(commit=tb is None)
+        self.connected = False
         if self.create:
             if tb is None:
-                self.filename_sqlite_tmp.rename(self.filename_sqlite)
+                self.storage.rename(
+                    filename_tmp=self.filename_sqlite_tmp,
+                    filename=self.filename_sqlite,
+                )
 
     def _tobytes(self, img: PIL.Image.Image, skip_optimize_png: bool) -> bytes:
         raise NotImplementedError()
@@ -35,30 +58,62 @@ class _SqliteTilesBase:
     def _frombytes(self, data: bytes) -> PIL.Image.Image:
         raise NotImplementedError()
 
+    def _frombytes_loaded(self, data: bytes) -> PIL.Image.Image:
+        img = self._frombytes(data=data)
+        # Decode now and not lazily in the consumer thread
+        img.load()
+        return img
+
     def remove(self) -> None:
         for filename in (self.filename_sqlite, self.filename_sqlite_tmp):
-            if filename.exists():
-                filename.unlink()
-        self.db = None
+            for suffix in ("",) + self.storage.SIDECAR_SUFFIXES:
+                filename_remove = filename.with_name(filename.name + suffix)
+                if filename_remove.exists():
+                    filename_remove.unlink()
+        self.connected = False
 
     def connect(self) -> None:
-        if self.create:
-            self.filename_sqlite.parent.mkdir(exist_ok=True, parents=True)
-            filename = self.filename_sqlite_tmp
-        else:
-            filename = self.filename_sqlite
-            assert filename.exists()
-        self.db = sqlite3.connect(filename)
-
-    def create_db(self) -> None:
+        assert not self.create
+        assert self.filename_sqlite.exists()
+        self.storage.open_read(self.filename_sqlite)
+        self.connected = True
+
+    def create_db(self, auto_vacuum=False) -> None:
+        """
+        auto_vacuum: Required to shrink the file in 'delete()'
+        """
         assert self.create
-        self.connect()
-
-        self.db.execute("pragma journal_mode=OFF")
-        self.db.execute(
-            """CREATE TABLE tiles (nw_east_m int, nw_north_m int, image blob, PRIMARY KEY (nw_east_m, nw_north_m))"""
+        self.filename_sqlite.parent.mkdir(exist_ok=True, parents=True)
+        self.storage.create(self.filename_sqlite_tmp, auto_vacuum=auto_vacuum)
+        self.connected = True
+
+    def resume_or_create_db(self, auto_vacuum=False) -> None:
+        """
+        If a previous run was interrupted, continue with the '.tmp' file.
+        Everything up to the last 'checkpoint()' is kept.
+        """
+        assert self.create
+        if not self.filename_sqlite_tmp.exists():
+            self.remove()
+            self.create_db(auto_vacuum=auto_vacuum)
+            return
+        self.storage.resume(self.filename_sqlite_tmp)
+        self.connected = True
+        self.progress.resume(tiles=self.storage.count_added())
+        print(
+            f"{self.filename_sqlite_tmp.name}: Resume after {self.storage.count_checkpoints()} checkpoints"
         )
 
+    def checkpoint(self, name: str) -> None:
+        """
+        Commits everything added so far. After a crash, the work
+        will be resumed after this checkpoint.
+        """
+        self.storage.checkpoint(name)
+
+    def is_checkpoint(self, name: str) -> bool:
+        return self.storage.is_checkpoint(name)
+
     def add_subtile(
         self,
         img: PIL.Image.Image,
@@ -66,36 +121,86 @@ class _SqliteTilesBase:
         nw_north_m: int,
         skip_optimize_png=False,
     ) -> None:
-        b = sqlite3.Binary(self._tobytes(img=img, skip_optimize_png=skip_optimize_png))
-        self.db.execute(
-            "insert into tiles values (?,?,?)",
-            (
-                nw_east_m,
-                nw_north_m,
-                b,
-            ),
+        self.add_subtile_raw(
+            data=self._tobytes(img=img, skip_optimize_png=skip_optimize_png),
+            nw_east_m=nw_east_m,
+            nw_north_m=nw_north_m,
         )
 
-    def select_int(self, select: str) -> int:
-        c = self.db.cursor()
-        c.execute(f"select {select} from tiles")
-        row = next(c)
-        value = row[0]
-        assert isinstance(value, int)
-        c.close()
-        return value
-
-    def select(self, where: str, order: str, raw=False):
-        c = self.db.cursor()
-        c.execute(
-            f"select nw_east_m, nw_north_m, image from tiles where {where} order by {order}"
+    def add_subtile_raw(self, data: bytes, nw_east_m: int, nw_north_m: int) -> None:
+        self.storage.add(nw_east_m=nw_east_m, nw_north_m=nw_north_m, data=data)
+        self.progress.add_tile(len(data))
+
+    def add_placeholder(self, nw_east_m: int, nw_north_m: int) -> None:
+        """
+        A grey tile which is encoded only once.
+        Used by 'Context.skip_tiff_read' and 'Context.skip_png_write'.
+        """
+        if self._placeholder_raw is None:
+            img = PIL.Image.new(
+                mode="RGB",
+                size=(self.pixel_per_tile, self.pixel_per_tile),
+                color=(128, 128, 128),
+            )
+            self._placeholder_raw = self._tobytes(img=img, skip_optimize_png=True)
+        self.add_subtile_raw(
+            data=self._placeholder_raw, nw_east_m=nw_east_m, nw_north_m=nw_north_m
         )
-        for row in c:
-            img = row[2]
+
+    def commit(self) -> None:
+        self.storage.commit()
+
+    def delete(self, tile_range: TileRange) -> None:
+        self.storage.delete(tile_range)
+
+    def count(self, tile_range: TileRange = TILE_RANGE_ALL) -> int:
+        return self.storage.count(tile_range)
+
+    def key_range(self) -> TileRange:
+        return self.storage.key_range()
+
+    def norths(self) -> List[int]:
+        return self.storage.norths()
+
+    def keys(self) -> Tuple[np.ndarray, np.ndarray]:
+        return self.storage.keys()
+
+    def select(self, tile_range: TileRange, order: str, raw=False):
+        for nw_east_m, nw_north_m, img in self.storage.select(
+            tile_range=tile_range, order=order
+        ):
             if not raw:
                 img = self._frombytes(data=img)
-            yield row[0], row[1], img
-        c.close()
+            yield nw_east_m, nw_north_m, img
+
+    def select_prefetch(
+        self,
+        tile_range: TileRange,
+        order: str,
+        executor: concurrent.futures.Executor,
+        depth: int,
+    ):
+        """
+        Like 'select()', but up to 'depth' images are decoded ahead by the
+        threads of 'executor'. The rows are fetched in batches of 'depth':
+        At most two batches of blobs are held in memory.
+        """
+        rows = self.storage.select(tile_range=tile_range, order=order)
+
+        pending = collections.deque()
+        while True:
+            batch = list(itertools.islice(rows, depth))
+            if len(batch) == 0:
+                break
+            for nw_east_m, nw_north_m, data in batch:
+                future = executor.submit(self._frombytes_loaded, data)
+                pending.append((nw_east_m, nw_north_m, future))
+            while len(pending) > depth:
+                nw_east_m, nw_north_m, future = pending.popleft()
+                yield nw_east_m, nw_north_m, future.result()
+        while len(pending) > 0:
+            nw_east_m, nw_north_m, future = pending.popleft()
+            yield nw_east_m, nw_north_m, future.result()
 
 
 class SqliteTilesRaw_obsolete(_SqliteTilesBase):
@@ -109,14 +214,31 @@ class SqliteTilesRaw_obsolete(_SqliteTilesBase):
 
 
 class SqliteTilesPng(_SqliteTilesBase):
+    def __init__(
+        self,
+        filename_sqlite: pathlib.Path,
+        pixel_per_tile: int,
+        create=False,
+        codec: TileCodec = CODEC_PNG,
+        progress: Progress = NO_PROGRESS,
+    ):
+        super().__init__(
+            filename_sqlite=filename_sqlite,
+            pixel_per_tile=pixel_per_tile,
+            create=create,
+            progress=progress,
+        )
+        assert isinstance(codec, TileCodec)
+        self.codec = codec
+
     def _tobytes(self, img: PIL.Image.Image, skip_optimize_png: bool) -> bytes:
         assert img.width == self.pixel_per_tile
         assert img.height == self.pixel_per_tile
-        img_tile_png_raw = convert_to_png_raw(
+        img_tile_raw = self.codec.tobytes(
             img=img,
             skip_optimize_png=skip_optimize_png,
         )
-        return img_tile_png_raw
+        return img_tile_raw
 
     def _frombytes(self, data: bytes) -> PIL.Image.Image:
         return PIL.Image.open(io.BytesIO(data))
@@ -0,0 +1,262 @@
+import pathlib
+import sqlite3
+from dataclasses import dataclass
+from typing import List, Tuple
+
+from oruxmap.utils.projection import CH1903, BoundsCH1903
+from oruxmap.utils.constants_directories import (
+    DIRECTORY_CACHE_TIF,
+    FILENAME_TIFF_CATALOG,
+)
+
+
+@dataclass
+class TiffSheet:
+    layer: str
+    name: str
+    url: str
+    size_bytes: int
+    mtime_ns: int
+    nw_east_m: float
+    nw_north_m: float
+    se_east_m: float
+    se_north_m: float
+    m_per_pixel: float
+    width_pixel: int
+    height_pixel: int
+    bands: int
+
+    @property
+    def filename(self) -> pathlib.Path:
+        return DIRECTORY_CACHE_TIF / self.layer / self.name
+
+    def boundsCH1903(self, valid_data=True) -> BoundsCH1903:
+        return BoundsCH1903(
+            nw=CH1903(
+                lon_m=self.nw_east_m, lat_m=self.nw_north_m, valid_data=valid_data
+            ),
+            se=CH1903(
+                lon_m=self.se_east_m, lat_m=self.se_north_m, valid_data=valid_data
+            ),
+            valid_data=valid_data,
+        )
+
+    def intersects(self, boundsCH1903: BoundsCH1903) -> bool:
+        return self.boundsCH1903(valid_data=False).intersects(boundsCH1903)
+
+    @staticmethod
+    def read_header(layer: str, url: str, filename: pathlib.Path) -> "TiffSheet":
+        """
+        Only the header is read, not the image.
+        The transform is taken from the geotiff tags or from the '.tfw' file.
+        """
+        stat = filename.stat()
+        return TiffSheet._read_header(
+            layer=layer,
+            url=url,
+            name=filename.name,
+            path=str(filename),
+            size_bytes=stat.st_size,
+            mtime_ns=stat.st_mtime_ns,
+        )
+
+    @staticmethod
+    def read_header_remote(layer: str, url: str) -> "TiffSheet":
+        """
+        Reads the header from the server using http range requests.
+        The tiff is not downloaded. Size and mtime are 0: The entry will be
+        updated as soon the tiff is downloaded.
+        """
+        name = url.split("/")[-1]
+        print(f"Read header of {name}")
+        return TiffSheet._read_header(
+            layer=layer,
+            url=url,
+            name=name,
+            path=f"/vsicurl/{url}",
+            size_bytes=0,
+            mtime_ns=0,
+        )
+
+    @staticmethod
+    def _read_header(  # pylint: disable=too-many-arguments
+        layer: str, url: str, name: str, path: str, size_bytes: int, mtime_ns: int
+    ) -> "TiffSheet":
+        # Not imported by the module: The command 'download' reads the
+        # catalog without rasterio as long as no header has to be read
+        import rasterio  # pylint: disable=import-outside-toplevel
+
+        with rasterio.open(path, "r") as dataset:
+            t = dataset.get_transform()
+            m_per_pixel = t[1]
+            assert t[1] == -t[5]
+            return TiffSheet(
+                layer=layer,
+                name=name,
+                url=url,
+                size_bytes=size_bytes,
+                mtime_ns=mtime_ns,
+                nw_east_m=t[0],
+                nw_north_m=t[3],
+                se_east_m=t[0] + dataset.width * m_per_pixel,
+                se_north_m=t[3] - dataset.height * m_per_pixel,
+                m_per_pixel=m_per_pixel,
+                width_pixel=dataset.width,
+                height_pixel=dataset.height,
+                bands=len(dataset.indexes),
+            )
+
+
+_COLUMNS = (
+    "layer",
+    "name",
+    "url",
+    "size_bytes",
+    "mtime_ns",
+    "nw_east_m",
+    "nw_north_m",
+    "se_east_m",
+    "se_north_m",
+    "m_per_pixel",
+    "width_pixel",
+    "height_pixel",
+    "bands",
+)
+_SELECT = ", ".join(f"sheets.{c}" for c in _COLUMNS)
+
+
+class TiffCatalog:
+    """
+    Caches the header of every tiff in 'cache_tif'.
+    A entry is valid as long as size and mtime of the file do not change.
+    The bounds are indexed by a sqlite rtree.
+    """
+
+    def __init__(self, filename_sqlite: pathlib.Path = FILENAME_TIFF_CATALOG):
+        self.filename_sqlite = filename_sqlite
+        # Several processes might use the catalog at the same time
+        self.db = sqlite3.connect(self.filename_sqlite, timeout=60.0)
+        self.db.execute("pragma journal_mode=WAL")
+        self.db.execute(
+            f"""CREATE TABLE IF NOT EXISTS sheets (id INTEGER PRIMARY KEY, {', '.join(_COLUMNS)}, UNIQUE (layer, name))"""
+        )
+        self.db.execute(
+            """CREATE VIRTUAL TABLE IF NOT EXISTS sheets_rtree USING rtree(id, min_east_m, max_east_m, min_north_m, max_north_m)"""
+        )
+        # The http validators of the downloaded tiffs, see 'refresh_tiffs.py'
+        self.db.execute(
+            """CREATE TABLE IF NOT EXISTS validators (layer, name, etag, last_modified, PRIMARY KEY (layer, name))"""
+        )
+        self.db.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _type, value, tb):
+        self.close()
+
+    def close(self) -> None:
+        self.db.close()
+
+    def _select(self, where: str, parameters: tuple) -> List[TiffSheet]:
+        c = self.db.execute(
+            f"select {_SELECT} from sheets where {where} order by sheets.name",
+            parameters,
+        )
+        return [TiffSheet(*row) for row in c]
+
+    def lookup(self, layer: str, name: str) -> TiffSheet:
+        """
+        Returns None if the sheet is not in the catalog.
+        """
+        sheets = self._select(where="layer=? and name=?", parameters=(layer, name))
+        if len(sheets) == 0:
+            return None
+        return sheets[0]
+
+    def get(self, layer: str, url: str, filename: pathlib.Path) -> TiffSheet:
+        """
+        Returns the sheet from the catalog. If the file changed, the header is read.
+        """
+        stat = filename.stat()
+        sheet = self.lookup(layer=layer, name=filename.name)
+        if sheet is not None:
+            if (sheet.size_bytes == stat.st_size) and (
+                sheet.mtime_ns == stat.st_mtime_ns
+            ):
+                return sheet
+        sheet = TiffSheet.read_header(layer=layer, url=url, filename=filename)
+        self.update(sheet)
+        return sheet
+
+    def update(self, sheet: TiffSheet) -> None:
+        self.delete(layer=sheet.layer, name=sheet.name)
+        values = [getattr(sheet, c) for c in _COLUMNS]
+        c = self.db.execute(
+            f"insert into sheets ({', '.join(_COLUMNS)}) values ({', '.join('?'*len(_COLUMNS))})",
+            values,
+        )
+        self.db.execute(
+            "insert into sheets_rtree values (?,?,?,?,?)",
+            (
+                c.lastrowid,
+                sheet.nw_east_m,
+                sheet.se_east_m,
+                sheet.se_north_m,
+                sheet.nw_north_m,
+            ),
+        )
+        self.db.commit()
+
+    def delete(self, layer: str, name: str) -> None:
+        self.db.execute(
+            "delete from sheets_rtree where id in (select id from sheets where layer=? and name=?)",
+            (layer, name),
+        )
+        self.db.execute("delete from sheets where layer=? and name=?", (layer, name))
+        self.db.commit()
+
+    def select_layer(self, layer: str) -> List[TiffSheet]:
+        return self._select(where="layer=?", parameters=(layer,))
+
+    def select_intersecting(
+        self, layer: str, boundsCH1903: BoundsCH1903
+    ) -> List[TiffSheet]:
+        """
+        All sheets of the layer which intersect the bounds, for example a tile.
+        """
+        bounds = (
+            boundsCH1903.se.lon_m,
+            boundsCH1903.nw.lon_m,
+            boundsCH1903.nw.lat_m,
+            boundsCH1903.se.lat_m,
+        )
+        # The rtree uses 32 bit floats: Its result is refined using the exact bounds
+        return self._select(
+            where="""layer=? and id in (select id from sheets_rtree
+                where min_east_m < ? and max_east_m > ? and min_north_m < ? and max_north_m > ?)
+                and nw_east_m < ? and se_east_m > ? and se_north_m < ? and nw_north_m > ?""",
+            parameters=(layer,) + bounds + bounds,
+        )
+
+    def lookup_validators(self, layer: str, name: str) -> Tuple[str, str]:
+        """
+        Returns etag and last_modified. None if unknown.
+        """
+        c = self.db.execute(
+            "select etag, last_modified from validators where layer=? and name=?",
+            (layer, name),
+        )
+        row = c.fetchone()
+        if row is None:
+            return None, None
+        return row
+
+    def update_validators(
+        self, layer: str, name: str, etag: str, last_modified: str
+    ) -> None:
+        self.db.execute(
+            "insert or replace into validators values (?,?,?,?)",
+            (layer, name, etag, last_modified),
+        )
+        self.db.commit()
@@ -0,0 +1,47 @@
+import pathlib
+
+import rasterio
+import rasterio.shutil
+from rasterio.enums import ColorInterp
+
+from oruxmap.utils.constants_directories import DIRECTORY_BASE
+
+# GeoTIFF blocks have to be a multiple of 16 pixels.
+# 400 pixels are 4x4 subtiles, see 'PIXEL_PER_SUBTILE'.
+BLOCK_PIXEL = 400
+
+
+def is_normalized(filename: pathlib.Path) -> bool:
+    with rasterio.open(filename, "r") as dataset:
+        if dataset.block_shapes[0] != (BLOCK_PIXEL, BLOCK_PIXEL):
+            return False
+        return len(dataset.overviews(1)) > 0
+
+
+def normalize_tiff(filename: pathlib.Path) -> None:
+    """
+    'Context.normalize_tiffs': The swisstopo tiffs are organized in strips:
+    Reading a window decodes all strips crossing it. The tiff is
+    rewritten as cloud optimized GeoTIFF: deflate compressed blocks of
+    BLOCK_PIXEL and overviews. The georeference and the palette are kept.
+    A tiff which is normalized already is not touched.
+    """
+    if is_normalized(filename):
+        return
+    print(f"Normalize {filename.relative_to(DIRECTORY_BASE)}")
+    # '.tmp' files are never removed by 'DiskQuota'
+    filename_tmp = filename.with_name(filename.name + ".tmp")
+    with rasterio.open(filename, "r") as dataset:
+        palette = dataset.colorinterp[0] == ColorInterp.palette
+        rasterio.shutil.copy(
+            dataset,
+            filename_tmp,
+            driver="COG",
+            BLOCKSIZE=BLOCK_PIXEL,
+            COMPRESS="DEFLATE",
+            PREDICTOR="NO" if palette else "YES",
+            # Averaging palette indexes would create random colors
+            OVERVIEW_RESAMPLING="NEAREST" if palette else "AVERAGE",
+            NUM_THREADS="ALL_CPUS",
+        )
+    filename_tmp.replace(filename)
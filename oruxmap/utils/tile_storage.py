@@ -0,0 +1,555 @@
+import os
+import mmap
+import array
+import struct
+import itertools
+import pathlib
+import sqlite3
+from dataclasses import dataclass
+from typing import Iterable, List, Tuple
+
+import numpy as np
+
+from oruxmap.utils.context import STORAGE_SQLITE, STORAGE_PACK
+
+ORDER_EAST_NORTH = "nw_east_m, nw_north_m"
+ORDER_EAST_NORTH_DESC = "nw_east_m, nw_north_m desc"
+
+
+@dataclass(frozen=True)
+class TileRange:
+    """
+    Selects tiles by their north west corner. The limits are included.
+    None: No limit.
+    """
+
+    min_east_m: int = None
+    max_east_m: int = None
+    min_north_m: int = None
+    max_north_m: int = None
+
+    def _iter_limits(self):
+        for column, oper, value in (
+            ("nw_east_m", ">=", self.min_east_m),
+            ("nw_east_m", "<=", self.max_east_m),
+            ("nw_north_m", ">=", self.min_north_m),
+            ("nw_north_m", "<=", self.max_north_m),
+        ):
+            if value is not None:
+                yield column, oper, int(value)
+
+    def sql_where(self) -> str:
+        conditions = [f"{c} {oper} {v}" for c, oper, v in self._iter_limits()]
+        if len(conditions) == 0:
+            return "true"
+        return " and ".join(conditions)
+
+    def mask(self, east: np.ndarray, north: np.ndarray) -> np.ndarray:
+        mask = np.ones(len(east), dtype=bool)
+        for column, oper, value in self._iter_limits():
+            values = east if column == "nw_east_m" else north
+            mask &= (values >= value) if oper == ">=" else (values <= value)
+        return mask
+
+
+TILE_RANGE_ALL = TileRange()
+
+# (nw_east_m, nw_north_m, image)
+Row = Tuple[int, int, bytes]
+
+
+class TileStorage:
+    """
+    Stores the encoded tiles by their north west corner.
+    A storage is created in a '.tmp' file which is renamed when finished.
+    """
+
+    SUFFIX = None
+    TMP_SUFFIX = None
+    # Files which belong to the storage file, for example 'tiles.db-wal'
+    SIDECAR_SUFFIXES = ()
+
+    def create(self, filename: pathlib.Path, auto_vacuum: bool) -> None:
+        raise NotImplementedError()
+
+    def resume(self, filename: pathlib.Path) -> None:
+        raise NotImplementedError()
+
+    def open_read(self, filename: pathlib.Path) -> None:
+        raise NotImplementedError()
+
+    def close(self, commit: bool) -> None:
+        raise NotImplementedError()
+
+    def rename(self, filename_tmp: pathlib.Path, filename: pathlib.Path) -> None:
+        raise NotImplementedError()
+
+    def add(self, nw_east_m: int, nw_north_m: int, data: bytes) -> None:
+        raise NotImplementedError()
+
+    def commit(self) -> None:
+        raise NotImplementedError()
+
+    def checkpoint(self, name: str) -> None:
+        raise NotImplementedError()
+
+    def is_checkpoint(self, name: str) -> bool:
+        raise NotImplementedError()
+
+    def count_checkpoints(self) -> int:
+        raise NotImplementedError()
+
+    def count_added(self) -> int:
+        """
+        The tiles added to the storage being written, also by a previous run.
+        """
+        raise NotImplementedError()
+
+    def delete(self, tile_range: TileRange) -> None:
+        raise NotImplementedError()
+
+    def count(self, tile_range: TileRange) -> int:
+        raise NotImplementedError()
+
+    def key_range(self) -> TileRange:
+        """
+        The smallest range containing all tiles.
+        """
+        raise NotImplementedError()
+
+    def norths(self) -> List[int]:
+        """
+        The distinct values of nw_north_m.
+        """
+        raise NotImplementedError()
+
+    def keys(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        nw_east_m and nw_north_m of all tiles.
+        """
+        raise NotImplementedError()
+
+    def select(self, tile_range: TileRange, order: str) -> Iterable[Row]:
+        raise NotImplementedError()
+
+
+class SqliteTileStorage(TileStorage):
+    SUFFIX = ".db"
+    TMP_SUFFIX = ".tmp"
+    SIDECAR_SUFFIXES = ("-wal", "-shm")
+
+    def __init__(self):
+        self.db = None
+
+    def _connect(self, filename: pathlib.Path) -> None:
+        self.db = sqlite3.connect(filename)
+
+    def _pragma_crash_safe(self) -> None:
+        # A crash rolls back to the last commit, see 'checkpoint()'
+        self.db.execute("pragma journal_mode=WAL")
+        self.db.execute("pragma synchronous=NORMAL")
+
+    def create(self, filename: pathlib.Path, auto_vacuum: bool) -> None:
+        self._connect(filename)
+        if auto_vacuum:
+            # Required to shrink the file in 'delete()'
+            self.db.execute("pragma auto_vacuum=INCREMENTAL")
+        self._pragma_crash_safe()
+        self.db.execute(
+            """CREATE TABLE tiles (nw_east_m int, nw_north_m int, image blob, PRIMARY KEY (nw_east_m, nw_north_m))"""
+        )
+        self.db.execute("""CREATE TABLE checkpoints (name text PRIMARY KEY)""")
+        self.db.commit()
+
+    def resume(self, filename: pathlib.Path) -> None:
+        self._connect(filename)
+        self._pragma_crash_safe()
+
+    def open_read(self, filename: pathlib.Path) -> None:
+        # A reader may be shared by threads which serialize their reads,
+        # see 'preview_server.TileSources'
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+
+    def close(self, commit: bool) -> None:
+        if commit:
+            self.db.commit()
+        else:
+            # Keep the state of the last 'checkpoint()'
+            self.db.rollback()
+        self.db.close()
+        self.db = None
+
+    def rename(self, filename_tmp: pathlib.Path, filename: pathlib.Path) -> None:
+        filename_tmp.rename(filename)
+
+    def add(self, nw_east_m: int, nw_north_m: int, data: bytes) -> None:
+        b = sqlite3.Binary(data)
+        self.db.execute(
+            "insert into tiles values (?,?,?)",
+            (
+                nw_east_m,
+                nw_north_m,
+                b,
+            ),
+        )
+
+    def commit(self) -> None:
+        self.db.commit()
+
+    def checkpoint(self, name: str) -> None:
+        self.db.execute("insert into checkpoints values (?)", (name,))
+        self.db.commit()
+
+    def is_checkpoint(self, name: str) -> bool:
+        c = self.db.execute("select count(*) from checkpoints where name=?", (name,))
+        return c.fetchone()[0] > 0
+
+    def count_checkpoints(self) -> int:
+        return self.db.execute("select count(*) from checkpoints").fetchone()[0]
+
+    def count_added(self) -> int:
+        return self.db.execute("select count(*) from tiles").fetchone()[0]
+
+    def delete(self, tile_range: TileRange) -> None:
+        self.db.execute(f"delete from tiles where {tile_range.sql_where()}")
+        self.db.commit()
+        # Return the free pages to the filesystem, see 'create(auto_vacuum=True)'
+        self.db.execute("pragma incremental_vacuum").fetchall()
+
+    def count(self, tile_range: TileRange) -> int:
+        c = self.db.execute(
+            f"select count(*) from tiles where {tile_range.sql_where()}"
+        )
+        return c.fetchone()[0]
+
+    def key_range(self) -> TileRange:
+        c = self.db.execute(
+            "select min(nw_east_m), max(nw_east_m), min(nw_north_m), max(nw_north_m) from tiles"
+        )
+        return TileRange(*c.fetchone())
+
+    def norths(self) -> List[int]:
+        c = self.db.execute("select distinct nw_north_m from tiles")
+        return [row[0] for row in c]
+
+    def keys(self) -> Tuple[np.ndarray, np.ndarray]:
+        c = self.db.execute("select nw_east_m, nw_north_m from tiles")
+        keys = np.fromiter(itertools.chain.from_iterable(c), dtype=np.int64)
+        keys = keys.reshape(-1, 2)
+        return keys[:, 0], keys[:, 1]
+
+    def select(self, tile_range: TileRange, order: str) -> Iterable[Row]:
+        assert order in (ORDER_EAST_NORTH, ORDER_EAST_NORTH_DESC)
+        c = self.db.cursor()
+        c.execute(
+            f"select nw_east_m, nw_north_m, image from tiles where {tile_range.sql_where()} order by {order}"
+        )
+        yield from c
+        c.close()
+
+
+class PackTileStorage(TileStorage):
+    """
+    The tiles are appended to the pack file, each prefixed by a
+    record header. When finished, the index sorted by (nw_north_m, nw_east_m)
+    is written to '-idx' as numpy array: It is memory mapped by the readers
+    as well as the pack file. The tiles returned are memoryviews into the
+    pack file: They are not copied.
+
+    'checkpoint()' appends the length of the pack file to '-checkpoints'.
+    'resume()' truncates the pack file to the last checkpoint and rebuilds
+    the index from the record headers. '-checkpoints' is kept when finished:
+    Like the sqlite storage, 'is_checkpoint()' works for the readers.
+
+    'delete()' writes the index without the tiles to '-idx'. As soon as the
+    deleted tiles take up half of the pack file, the pack file is rewritten
+    without them into '-compact.tmp' and replaces the pack file: Every tile
+    is copied about once. 'open_read()' completes a compaction interrupted
+    by a crash.
+    """
+
+    SUFFIX = ".pack"
+    TMP_SUFFIX = ".pack.tmp"
+    SIDECAR_SUFFIXES = ("-idx", "-checkpoints", "-idx.tmp", "-compact.tmp")
+    # nw_east_m, nw_north_m, length
+    RECORD_HEADER = struct.Struct("<iiI")
+    INDEX_DTYPE = np.dtype(
+        [("east", "<i4"), ("north", "<i4"), ("offset", "<i8"), ("length", "<i4")]
+    )
+
+    def __init__(self):
+        self.filename = None
+        self.f = None
+        self.mm = None
+        self.index = None
+        self.checkpoints = {}
+        # The index while writing
+        self._east = None
+        self._north = None
+        self._offset = None
+        self._length = None
+
+    @staticmethod
+    def _sidecar(filename: pathlib.Path, suffix: str) -> pathlib.Path:
+        return filename.with_name(filename.name + suffix)
+
+    def _init_writer(self, filename: pathlib.Path) -> None:
+        self.filename = filename
+        self._east = array.array("i")
+        self._north = array.array("i")
+        self._offset = array.array("q")
+        self._length = array.array("i")
+
+    def create(self, filename: pathlib.Path, auto_vacuum: bool) -> None:
+        self._init_writer(filename)
+        self._sidecar(filename, "-checkpoints").write_text("")
+        self.f = filename.open("wb")
+
+    def _read_checkpoints(self) -> int:
+        """
+        Returns the length of the pack file at the last checkpoint.
+        """
+        length_bytes = 0
+        filename = self._sidecar(self.filename, "-checkpoints")
+        with filename.open("r") as f:
+            for line in f:
+                if not line.endswith("\n"):
+                    # Incomplete line written during a crash
+                    break
+                length, name = line.rstrip("\n").split("\t", 1)
+                length_bytes = int(length)
+                self.checkpoints[name] = length_bytes
+        return length_bytes
+
+    def resume(self, filename: pathlib.Path) -> None:
+        self._init_writer(filename)
+        length_bytes = self._read_checkpoints()
+        # The next 'checkpoint()' must not continue an incomplete line
+        filename_checkpoints = self._sidecar(filename, "-checkpoints")
+        lines = filename_checkpoints.read_text().splitlines(keepends=True)
+        filename_checkpoints.write_text(
+            "".join(line for line in lines if line.endswith("\n"))
+        )
+        self.f = filename.open("r+b")
+        self.f.truncate(length_bytes)
+        offset = 0
+        while offset < length_bytes:
+            self.f.seek(offset)
+            header = self.f.read(self.RECORD_HEADER.size)
+            nw_east_m, nw_north_m, length = self.RECORD_HEADER.unpack(header)
+            offset += self.RECORD_HEADER.size
+            self._append_index(nw_east_m, nw_north_m, offset, length)
+            offset += length
+        assert offset == length_bytes
+        self.f.seek(length_bytes)
+
+    def open_read(self, filename: pathlib.Path) -> None:
+        self.filename = filename
+        self._recover_compact()
+        self.index = np.load(self._sidecar(filename, "-idx"), mmap_mode="r")
+        if self._sidecar(filename, "-checkpoints").exists():
+            self._read_checkpoints()
+        self._open_mmap()
+
+    def _open_mmap(self) -> None:
+        if self.filename.stat().st_size > 0:
+            with self.filename.open("rb") as f:
+                self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _recover_compact(self) -> None:
+        """
+        See '_compact()' for the order the files are written.
+        """
+        filename_compact = self._sidecar(self.filename, "-compact.tmp")
+        filename_idx_tmp = self._sidecar(self.filename, "-idx.tmp")
+        if filename_compact.exists():
+            # The pack file was not replaced: The old index is valid
+            filename_compact.unlink()
+            filename_idx_tmp.unlink(missing_ok=True)
+        if filename_idx_tmp.exists():
+            # The pack file was replaced but not the index
+            filename_idx_tmp.replace(self._sidecar(self.filename, "-idx"))
+
+    def _append_index(
+        self, nw_east_m: int, nw_north_m: int, offset: int, length: int
+    ) -> None:
+        self._east.append(nw_east_m)
+        self._north.append(nw_north_m)
+        self._offset.append(offset)
+        self._length.append(length)
+
+    def _sorted_index(self) -> np.ndarray:
+        index = np.empty(len(self._east), dtype=self.INDEX_DTYPE)
+        index["east"] = np.frombuffer(self._east, dtype="<i4")
+        index["north"] = np.frombuffer(self._north, dtype="<i4")
+        index["offset"] = np.frombuffer(self._offset, dtype="<i8")
+        index["length"] = np.frombuffer(self._length, dtype="<i4")
+        index = index[np.lexsort((index["east"], index["north"]))]
+        # Like the primary key of the sqlite storage
+        duplicates = (np.diff(index["east"]) == 0) & (np.diff(index["north"]) == 0)
+        assert not duplicates.any(), "Duplicate tiles"
+        return index
+
+    def close(self, commit: bool) -> None:
+        if self.f is not None:
+            if commit:
+                self.commit()
+                with self._sidecar(self.filename, "-idx").open("wb") as f:
+                    np.save(f, self._sorted_index(), allow_pickle=False)
+            else:
+                # Keep the state of the last 'checkpoint()'
+                self.f.truncate(max(self.checkpoints.values(), default=0))
+            self.f.close()
+            self.f = None
+        # The mmap is closed as soon as the consumers release their memoryviews
+        self.mm = None
+        self.index = None
+
+    def rename(self, filename_tmp: pathlib.Path, filename: pathlib.Path) -> None:
+        self._sidecar(filename_tmp, "-idx").rename(self._sidecar(filename, "-idx"))
+        self._sidecar(filename_tmp, "-checkpoints").rename(
+            self._sidecar(filename, "-checkpoints")
+        )
+        # The pack file is renamed last: Its existence marks the storage as finished
+        filename_tmp.rename(filename)
+
+    def add(self, nw_east_m: int, nw_north_m: int, data: bytes) -> None:
+        header = self.RECORD_HEADER.pack(nw_east_m, nw_north_m, len(data))
+        self.f.write(header)
+        self._append_index(nw_east_m, nw_north_m, self.f.tell(), len(data))
+        self.f.write(data)
+
+    def commit(self) -> None:
+        self.f.flush()
+
+    def checkpoint(self, name: str) -> None:
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        length_bytes = self.f.tell()
+        filename = self._sidecar(self.filename, "-checkpoints")
+        with filename.open("a") as f:
+            f.write(f"{length_bytes}\t{name}\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.checkpoints[name] = length_bytes
+
+    def is_checkpoint(self, name: str) -> bool:
+        return name in self.checkpoints
+
+    def count_checkpoints(self) -> int:
+        return len(self.checkpoints)
+
+    def count_added(self) -> int:
+        return len(self._east)
+
+    def _selected(self, tile_range: TileRange) -> np.ndarray:
+        """
+        The positions in 'self.index' of the tiles in the range.
+        The index is sorted by north: The rows of the range are contiguous.
+        """
+        assert self.index is not None, "Only a finished pack may be queried"
+        north = self.index["north"]
+        start, stop = 0, len(north)
+        if tile_range.min_north_m is not None:
+            start = np.searchsorted(north, tile_range.min_north_m, side="left")
+        if tile_range.max_north_m is not None:
+            stop = np.searchsorted(north, tile_range.max_north_m, side="right")
+        positions = np.arange(start, stop)
+        mask = tile_range.mask(
+            east=self.index["east"][start:stop], north=north[start:stop]
+        )
+        return positions[mask]
+
+    def delete(self, tile_range: TileRange) -> None:
+        positions = self._selected(tile_range)
+        if len(positions) == 0:
+            return
+        self.index = np.delete(self.index, positions)
+        record_bytes = self.index["length"].astype(np.int64) + self.RECORD_HEADER.size
+        if 2 * int(record_bytes.sum()) <= self.filename.stat().st_size:
+            self._compact()
+            return
+        self._write_index(self._sidecar(self.filename, "-idx.tmp"))
+        self._sidecar(self.filename, "-idx.tmp").replace(
+            self._sidecar(self.filename, "-idx")
+        )
+
+    def _write_index(self, filename: pathlib.Path) -> None:
+        with filename.open("wb") as f:
+            np.save(f, self.index, allow_pickle=False)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _compact(self) -> None:
+        """
+        The files are written in this order:
+        '-compact.tmp', '-idx.tmp', replace the pack file, replace '-idx'.
+        """
+        filename_compact = self._sidecar(self.filename, "-compact.tmp")
+        filename_idx_tmp = self._sidecar(self.filename, "-idx.tmp")
+        index = self.index.copy()
+        with filename_compact.open("wb") as f:
+            for i, (nw_east_m, nw_north_m, offset, length) in enumerate(self.index):
+                f.write(self.RECORD_HEADER.pack(nw_east_m, nw_north_m, length))
+                index["offset"][i] = f.tell()
+                f.write(self.mm[offset : offset + length])
+            f.flush()
+            os.fsync(f.fileno())
+        self.index = index
+        self._write_index(filename_idx_tmp)
+        if self.mm is not None:
+            # Raises BufferError if a memoryview of 'select()' is still in use
+            self.mm.close()
+            self.mm = None
+        filename_compact.replace(self.filename)
+        filename_idx_tmp.replace(self._sidecar(self.filename, "-idx"))
+        self._open_mmap()
+
+    def count(self, tile_range: TileRange) -> int:
+        return len(self._selected(tile_range))
+
+    def key_range(self) -> TileRange:
+        if len(self.index) == 0:
+            return TileRange()
+        east = self.index["east"]
+        north = self.index["north"]
+        return TileRange(
+            min_east_m=int(east.min()),
+            max_east_m=int(east.max()),
+            min_north_m=int(north[0]),
+            max_north_m=int(north[-1]),
+        )
+
+    def norths(self) -> List[int]:
+        return [int(north) for north in np.unique(self.index["north"])]
+
+    def keys(self) -> Tuple[np.ndarray, np.ndarray]:
+        return self.index["east"].astype(np.int64), self.index["north"].astype(np.int64)
+
+    def select(self, tile_range: TileRange, order: str) -> Iterable[Row]:
+        positions = self._selected(tile_range)
+        rows = self.index[positions]
+        if order == ORDER_EAST_NORTH:
+            rows = rows[np.lexsort((rows["north"], rows["east"]))]
+        else:
+            assert order == ORDER_EAST_NORTH_DESC
+            rows = rows[np.lexsort((-rows["north"], rows["east"]))]
+        view = memoryview(self.mm) if self.mm is not None else None
+        for nw_east_m, nw_north_m, offset, length in rows:
+            yield int(nw_east_m), int(nw_north_m), view[offset : offset + length]
+
+
+STORAGES = {
+    STORAGE_SQLITE: SqliteTileStorage,
+    STORAGE_PACK: PackTileStorage,
+}
+
+
+def storage_for(filename: pathlib.Path) -> TileStorage:
+    """
+    The storage is selected by the suffix of the final filename.
+    """
+    for cls in STORAGES.values():
+        if filename.suffix == cls.SUFFIX:
+            return cls()
+    raise ValueError(f"{filename}: Unknown tile storage")
@@ -0,0 +1,247 @@
+import io
+import math
+import threading
+import time
+import concurrent.futures
+import pathlib
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import PIL.Image
+import requests
+import requests.adapters
+import urllib3.util
+
+from oruxmap.utils.constants_directories import DIRECTORY_CACHE_WMTS
+
+# The swisstopo WMTS, see 'doc/README_wmts.md'
+WMTS_URL = "https://wmts.geo.admin.ch/1.0.0/{layer}/default/current/2056/{zoom}/{col}/{row}.jpeg"
+
+# The tile matrix set '2056' (LV95) of the swisstopo WMTS
+TOP_LEFT_EAST_M = 2420000.0
+TOP_LEFT_NORTH_M = 1350000.0
+PIXEL_PER_WMTS_TILE = 256
+# Index: zoom
+RESOLUTIONS_M_PER_PIXEL = (
+    4000.0,
+    3750.0,
+    3500.0,
+    3250.0,
+    3000.0,
+    2750.0,
+    2500.0,
+    2250.0,
+    2000.0,
+    1750.0,
+    1500.0,
+    1250.0,
+    1000.0,
+    750.0,
+    650.0,
+    500.0,
+    250.0,
+    100.0,
+    50.0,
+    20.0,
+    10.0,
+    5.0,
+    2.5,
+    2.0,
+    1.5,
+    1.0,
+    0.5,
+    0.25,
+    0.1,
+)
+
+TIMEOUT_S = 60.0
+
+
+def select_zoom(m_per_pixel: float) -> int:
+    """
+    The coarsest zoom which is at least as fine as 'm_per_pixel':
+    The WMTS tiles are only downsampled, never upsampled.
+    """
+    for zoom, resolution in enumerate(RESOLUTIONS_M_PER_PIXEL):
+        if resolution <= m_per_pixel * 1.0001:
+            return zoom
+    raise ValueError(f"No WMTS zoom for {m_per_pixel} m_per_pixel")
+
+
+@dataclass(frozen=True)
+class WmtsTile:
+    zoom: int
+    col: int
+    row: int
+
+    @property
+    def m_per_tile(self) -> float:
+        return RESOLUTIONS_M_PER_PIXEL[self.zoom] * PIXEL_PER_WMTS_TILE
+
+    @property
+    def nw_east_m(self) -> float:
+        return TOP_LEFT_EAST_M + self.col * self.m_per_tile
+
+    @property
+    def nw_north_m(self) -> float:
+        return TOP_LEFT_NORTH_M - self.row * self.m_per_tile
+
+
+def wmts_tiles(
+    zoom: int, west_m: float, north_m: float, east_m: float, south_m: float
+) -> List[WmtsTile]:
+    """
+    The WMTS tiles intersecting the bounds.
+    """
+    m_per_tile = RESOLUTIONS_M_PER_PIXEL[zoom] * PIXEL_PER_WMTS_TILE
+    cols = range(
+        math.floor((west_m - TOP_LEFT_EAST_M) / m_per_tile),
+        math.ceil((east_m - TOP_LEFT_EAST_M) / m_per_tile),
+    )
+    rows = range(
+        math.floor((TOP_LEFT_NORTH_M - north_m) / m_per_tile),
+        math.ceil((TOP_LEFT_NORTH_M - south_m) / m_per_tile),
+    )
+    return [WmtsTile(zoom=zoom, col=col, row=row) for row in rows for col in cols]
+
+
+class RateLimiter:
+    """
+    Limits the requests of all threads to 'requests_per_s'.
+    """
+
+    def __init__(self, requests_per_s: Optional[float]):
+        self.interval_s = 0.0 if requests_per_s is None else 1.0 / requests_per_s
+        self._lock = threading.Lock()
+        self._next_s = time.monotonic()
+
+    def acquire(self) -> None:
+        if self.interval_s == 0.0:
+            return
+        with self._lock:
+            now_s = time.monotonic()
+            wait_s = self._next_s - now_s
+            self._next_s = max(self._next_s, now_s) + self.interval_s
+        if wait_s > 0.0:
+            time.sleep(wait_s)
+
+
+class WmtsClient:
+    """
+    Fetches WMTS tiles concurrently over one pool of http connections.
+    The tiles are cached in 'cache_wmts/<layer>/<zoom>/<col>/<row>'.
+    A tile missing on the server (404) is cached as empty file.
+    """
+
+    def __init__(
+        self,
+        layer: str,
+        url: str = WMTS_URL,
+        max_connections: int = 8,
+        requests_per_s: Optional[float] = None,
+        directory_cache: pathlib.Path = DIRECTORY_CACHE_WMTS,
+    ):
+        self.layer = layer
+        self.url = url
+        self.max_connections = max_connections
+        self.directory_cache = directory_cache / layer
+        self.rate_limiter = RateLimiter(requests_per_s=requests_per_s)
+        # Retries with backoff if the server is busy
+        retry = urllib3.util.Retry(
+            total=5,
+            backoff_factor=0.5,
+            status_forcelist=(429, 500, 502, 503, 504),
+        )
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=max_connections, max_retries=retry
+        )
+        # The session is shared by the threads: The connections are pooled
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._lock = threading.Lock()
+        self.count_requests = 0
+        self.count_cached = 0
+        self.bytes_downloaded = 0
+
+    def close(self) -> None:
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _type, value, tb):
+        self.close()
+
+    def _filename(self, tile: WmtsTile) -> pathlib.Path:
+        return self.directory_cache / str(tile.zoom) / str(tile.col) / str(tile.row)
+
+    def fetch(self, tile: WmtsTile) -> Optional[bytes]:
+        """
+        Returns the encoded image or None if the tile does not exist.
+        """
+        filename = self._filename(tile)
+        if filename.exists():
+            with self._lock:
+                self.count_cached += 1
+            data = filename.read_bytes()
+            return data if len(data) > 0 else None
+
+        self.rate_limiter.acquire()
+        url = self.url.format(
+            layer=self.layer, zoom=tile.zoom, col=tile.col, row=tile.row
+        )
+        r = self.session.get(url, timeout=TIMEOUT_S)
+        if r.status_code == 404:
+            data = b""
+        else:
+            r.raise_for_status()
+            data = r.content
+        with self._lock:
+            self.count_requests += 1
+            self.bytes_downloaded += len(data)
+
+        filename.parent.mkdir(parents=True, exist_ok=True)
+        # Written atomically: Other processes may read the cache
+        filename_tmp = filename.with_name(
+            f"{filename.name}.{threading.get_ident()}.tmp"
+        )
+        filename_tmp.write_bytes(data)
+        filename_tmp.replace(filename)
+        return data if len(data) > 0 else None
+
+    def fetch_many(self, tiles: Iterable[WmtsTile]) -> Dict[WmtsTile, Optional[bytes]]:
+        tiles = list(tiles)
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.max_connections
+        ) as executor:
+            return dict(zip(tiles, executor.map(self.fetch, tiles)))
+
+    def mosaic(
+        self, zoom: int, west_m: int, north_m: int, east_m: int, south_m: int
+    ) -> Tuple[PIL.Image.Image, PIL.Image.Image]:
+        """
+        Returns the image of the bounds at the resolution of 'zoom' and
+        a mask: 255 where the pixel is covered by a WMTS tile.
+        """
+        m_per_pixel = RESOLUTIONS_M_PER_PIXEL[zoom]
+        size = (
+            round((east_m - west_m) / m_per_pixel),
+            round((north_m - south_m) / m_per_pixel),
+        )
+        img = PIL.Image.new(mode="RGB", size=size, color=0)
+        mask = PIL.Image.new(mode="L", size=size, color=0)
+        tiles = wmts_tiles(
+            zoom=zoom, west_m=west_m, north_m=north_m, east_m=east_m, south_m=south_m
+        )
+        for tile, data in self.fetch_many(tiles).items():
+            if data is None:
+                continue
+            x = round((tile.nw_east_m - west_m) / m_per_pixel)
+            y = round((north_m - tile.nw_north_m) / m_per_pixel)
+            with PIL.Image.open(io.BytesIO(data)) as img_tile:
+                img.paste(im=img_tile.convert("RGB"), box=(x, y))
+            mask.paste(
+                255, box=(x, y, x + PIXEL_PER_WMTS_TILE, y + PIXEL_PER_WMTS_TILE)
+            )
+        return img, mask